@@ -0,0 +1,71 @@
+"""
+Discrete event simulation of a slot budget filled by each admission policy,
+reports slot utilization over the makespan of random jobs:
+
+    PYTHONPATH=. python benchmarks/bench_admission.py [--jobs N] [--max-slots N] [--seed N]
+"""
+import argparse
+import heapq
+import random
+from collections import deque
+from itertools import count
+from unittest import mock
+
+from scheduler.executor import admission
+from scheduler.executor.admission import POLICIES, create_policy, job_slots
+from scheduler.job import JobSpec
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self)->float:
+        return self.now
+
+
+def _simulate(policy_name: str, jobs: list, max_slots: int)->float:
+    """
+    Utilization of max_slots from the first submission to the last exit
+    """
+    clock = _Clock()
+    policy = create_policy(policy_name, max_slots)
+    durations = {id(job_spec): duration for job_spec, duration in jobs}
+    queued = deque(job_spec for job_spec, _ in jobs)
+    running = []  # heap of (end time, sequence, slots)
+    sequence = count()
+    free_slots = max_slots
+    busy = 0.0
+    with mock.patch.object(admission, 'time', clock):
+        while queued or running:
+            for job_spec in policy.select(queued, len(queued), free_slots):
+                free_slots -= job_slots(job_spec)
+                busy += job_slots(job_spec) * durations[id(job_spec)]
+                heapq.heappush(running, (clock.now + durations[id(job_spec)], next(sequence), job_slots(job_spec)))
+            # Every exit is a chance to submit more
+            end_time, _, slots = heapq.heappop(running)
+            clock.now = end_time
+            free_slots += slots
+    return busy / (clock.now * max_slots)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', type=int, default=3000)
+    parser.add_argument('--max-slots', type=int, default=64)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    jobs = [
+        (JobSpec(command='true', name='job{}'.format(i), num_slots=rng.choice((1, 1, 1, 2, 4, 8, 16, 32))),
+         rng.uniform(1, 100))
+        for i in range(args.jobs)
+    ]
+    print('{} jobs of 1-32 slots taking 1-100s on {} slots'.format(args.jobs, args.max_slots))
+    for name in POLICIES:
+        print('{:<14} {:6.1%} utilization'.format(name, _simulate(name, jobs, args.max_slots)))
+
+
+if __name__ == '__main__':
+    main()
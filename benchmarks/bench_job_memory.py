@@ -0,0 +1,102 @@
+"""
+Bytes per job of the job model (JobSpec, Job and Executor.JobStatus of a prepared
+job) against dict-backed classes keeping three eagerly derived paths per job,
+as the model was before __slots__ and BatchLayout:
+
+    PYTHONPATH=. python benchmarks/bench_job_memory.py [--jobs N]
+"""
+import argparse
+import gc
+import tracemalloc
+from os.path import join
+
+from scheduler.executor.base import Executor
+from scheduler.job import BatchLayout, Job, JobSpec
+
+
+class _DictJobSpec:
+    def __init__(self, command, name, args, work_dir, num_slots, log_path, status_path, time_path):
+        self.command = command
+        self.name = name
+        self.args = args
+        self.work_dir = work_dir
+        self.num_slots = num_slots
+        self.log_path = log_path
+        self.status_path = status_path
+        self.time_path = time_path
+        self.depends_on = None
+        self.max_attempts = None
+        self.inputs = None
+        self.fingerprint = None
+
+
+class _DictJob:
+    def __init__(self, spec, job_id):
+        self.spec = spec
+        self.job_id = job_id
+        self.start_time = None
+        self.end_time = None
+        self.attempts = None
+        self.usage = None
+
+
+class _DictJobStatus:
+    def __init__(self, job):
+        self.job = job
+        self.has_exited = False
+        self.exit_status = None
+        self.failure = None
+        self.usage = None
+
+
+def _slots_jobs(n: int)->list:
+    layout = BatchLayout('batch', '/data/run/status', '/data/run/log', '/data/run/time')
+    jobs = []
+    for i in range(n):
+        # Parsed lines give every job its own copies of shared strings
+        spec = JobSpec(command=''.join(['/usr/bin/', 'process']), name='job{}'.format(i),
+                       args=['--input', 'data/{}.txt'.format(i)], work_dir=''.join(['/data/', 'run']),
+                       num_slots=1, layout=layout)
+        job = Job(spec=spec, job_id=i)
+        jobs.append(Executor.JobStatus(has_exited=False, exit_status=None, job=job))
+    return jobs
+
+
+def _dict_jobs(n: int)->list:
+    jobs = []
+    for i in range(n):
+        name = 'job{}'.format(i)
+        spec = _DictJobSpec(command=''.join(['/usr/bin/', 'process']), name=name,
+                            args=['--input', 'data/{}.txt'.format(i)], work_dir=''.join(['/data/', 'run']),
+                            num_slots=1,
+                            log_path=join('/data/run/log', 'batch', name),
+                            status_path=join('/data/run/status', 'batch', name),
+                            time_path=join('/data/run/time', 'batch', name + '.time'))
+        jobs.append(_DictJobStatus(_DictJob(spec, i)))
+    return jobs
+
+
+def _bytes_per_job(create, n: int)->float:
+    gc.collect()
+    tracemalloc.start()
+    jobs = create(n)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del jobs
+    return size / n
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', type=int, default=200000)
+    args = parser.parse_args()
+
+    dict_size = _bytes_per_job(_dict_jobs, args.jobs)
+    slots_size = _bytes_per_job(_slots_jobs, args.jobs)
+    print('{} jobs'.format(args.jobs))
+    print('dict-backed, eager paths {:6.0f} bytes per job'.format(dict_size))
+    print('__slots__, lazy paths    {:6.0f} bytes per job ({:.0%})'.format(slots_size, slots_size / dict_size))
+
+
+if __name__ == '__main__':
+    main()
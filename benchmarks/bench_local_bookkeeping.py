@@ -0,0 +1,37 @@
+"""
+Per-job cost of the local executor's bookkeeping (queue_job, job_status and
+forget_job of ExecutorThread) for growing batch sizes, no process is started:
+
+    PYTHONPATH=. python benchmarks/bench_local_bookkeeping.py [--sizes 10000,50000,200000]
+"""
+import argparse
+import time
+
+from scheduler.executor.local import ExecutorThread
+from scheduler.job import JobSpec
+
+
+def _per_job(size: int)->float:
+    # The thread is not started, jobs stay queued
+    executor_thread = ExecutorThread()
+    spec = JobSpec(command='true', name='job')
+    start = time.perf_counter()
+    jobs = [executor_thread.queue_job(spec) for _ in range(size)]
+    for job in jobs:
+        executor_thread.job_status(job)
+    for job in jobs:
+        executor_thread.forget_job(job)
+    return (time.perf_counter() - start) / size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='10000,50000,200000')
+    args = parser.parse_args()
+
+    for size in (int(size) for size in args.sizes.split(',')):
+        print('{:>8} jobs {:6.2f} us per job'.format(size, _per_job(size) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
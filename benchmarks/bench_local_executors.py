@@ -0,0 +1,75 @@
+"""
+Throughput of the thread based LocalExecutor and the asyncio based AsyncLocalExecutor
+on a batch of short commands, with the most threads the scheduler had at once:
+
+    PYTHONPATH=. python benchmarks/bench_local_executors.py [--jobs N] [--cores N] [--command CMD]
+"""
+import argparse
+import logging
+import shlex
+import tempfile
+import threading
+import time
+from os.path import join
+
+from scheduler.executor.async_local import AsyncLocalExecutor
+from scheduler.executor.local import LocalExecutor
+from scheduler.job import Batch, JobSpec
+from scheduler.scheduler import Scheduler
+from scheduler.store import JournalStore
+
+
+class _ThreadSampler(threading.Thread):
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.max_threads = 0
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(0.01):
+            self.max_threads = max(self.max_threads, threading.active_count() - 1)
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+def _run(executor_class, jobs: int, cores: int, command: list):
+    with tempfile.TemporaryDirectory() as directory:
+        # Journal keeps per-job status file writes out of the measurement
+        store = JournalStore(join(directory, 'journal.db'))
+        executor = executor_class(num_cores=cores, store=store)
+        scheduler = Scheduler(log_dir=join(directory, 'log'), status_dir=join(directory, 'status'),
+                              time_dir=join(directory, 'time'))
+        batch = Batch(name='bench', jobs=[
+            JobSpec(command=command[0], args=command[1:], name='job{}'.format(i)) for i in range(jobs)
+        ])
+        sampler = _ThreadSampler()
+        sampler.start()
+        start = time.perf_counter()
+        # Shuts the executor down
+        scheduler.run_batches(executor, [batch])
+        seconds = time.perf_counter() - start
+        sampler.stop()
+        store.close()
+    return seconds, sampler.max_threads
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', type=int, default=2000)
+    parser.add_argument('--cores', type=int, default=64)
+    parser.add_argument('--command', default='sleep 0.2')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    print('{} jobs of "{}" on {} cores'.format(args.jobs, args.command, args.cores))
+    for name, executor_class in (('local', LocalExecutor), ('async-local', AsyncLocalExecutor)):
+        seconds, max_threads = _run(executor_class, args.jobs, args.cores, shlex.split(args.command))
+        print('{:<12} {:7.2f}s {:8.0f} jobs/s {:5d} threads at most'.format(
+            name, seconds, args.jobs / seconds, max_threads
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Time to parse generated sh job lines with the scanner, with argparse alone
+and with --parse-processes, every tenth line is quoted and split by shlex.
+CPU time of this process is what parsing takes when workers have CPUs of their own:
+
+    PYTHONPATH=. python benchmarks/bench_sh_parser.py [--lines N] [--processes N]
+"""
+import argparse
+import io
+import time
+from unittest import mock
+
+from scheduler.parser import sh
+
+
+def _lines(n: int)->str:
+    return ''.join(
+        '-b batch{b} -j job{i} -t 2 --depends-on job{p} --log-path log/job{i} process --input data/{i}.txt '
+        '--output {out}\n'.format(b=i // 1000, i=i, p=max(i - 1, 0),
+                                   out='"out {}.txt"'.format(i) if i % 10 == 0 else 'out/{}.txt'.format(i))
+        for i in range(n)
+    )
+
+
+def _time(text: str, processes: int=None):
+    """
+    Wall and CPU seconds of this process, workers not included
+    """
+    start = time.perf_counter()
+    start_cpu = time.process_time()
+    sh.parse_config(io.StringIO(text), processes)
+    return time.perf_counter() - start, time.process_time() - start_cpu
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, default=100000)
+    parser.add_argument('--processes', type=int, default=2)
+    args = parser.parse_args()
+
+    text = _lines(args.lines)
+    scanner = _time(text)
+    with mock.patch.object(sh, '_scan_args', lambda _: None):
+        argparse_only = _time(text)
+    processes = _time(text, args.processes)
+
+    print('{} lines'.format(args.lines))
+    for name, (seconds, cpu) in (('scanner', scanner), ('argparse', argparse_only),
+                                 ('scanner, {} processes'.format(args.processes), processes)):
+        print('{:<24} {:8.2f}s {:8.1f} us/line, {:8.1f} us/line CPU of this process'.format(
+            name, seconds, seconds / args.lines * 1e6, cpu / args.lines * 1e6
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,15 +2,26 @@ import argparse
 import logging
 import sys
 from collections import Counter
-from typing import List
+from typing import List, Iterable, Iterator, Optional
 
 from scheduler import version
 from scheduler.job import Batch
 from scheduler.parser import json, sh
+from scheduler.executor.admission import POLICIES
+from scheduler.executor.bundle import Bundler
+from scheduler.executor.checkpoint import Checkpoint
+from scheduler.executor.retry import RetryPolicy, FAILURES, DEFAULT_RETRY_ON, REQUEUE_FRONT, REQUEUE_BACK
+from scheduler.daemon import SchedulerDaemon, run_client
+from scheduler.dag import DEFAULT_DEPENDS_ON, DependencyError
+from scheduler.executor.base import Executor
+from scheduler.fingerprint import Fingerprinter
+from scheduler.history import ORDERS, RuntimeHistory
+from scheduler.metrics import FORMATS, FORMAT_PROMETHEUS, MetricsExporter, Profiler
 from scheduler.scheduler import Scheduler
+from scheduler.store import JournalStore, FileStore, ResultStore
 
 logging.basicConfig()
-logging.getLogger().setLevel(logging.DEBUG)
+logger = logging.getLogger(__name__)
 
 
 def _validate_batches(batches: List[Batch]):
@@ -33,6 +44,84 @@ def _validate_batches(batches: List[Batch]):
         exit(1)
 
 
+def _validate_streamed_batches(batches: Iterable[Batch])->Iterator[Batch]:
+    seen = set()
+    for batch in batches:
+        if batch.name in seen:
+            sys.stderr.write('Batch "{}" occurred more tan 1 time\n'.format(
+                batch.name
+            ))
+            exit(1)
+        seen.add(batch.name)
+        yield batch
+
+
+def _create_executor(args: argparse.Namespace, store: ResultStore, retry: RetryPolicy, bundler: Optional[Bundler],
+                     metrics: Optional[MetricsExporter], profiler: Optional[Profiler],
+                     checkpoint: Checkpoint=None, contact: str=None)->Executor:
+    if args.executor == 'drmaa':
+        from scheduler.executor.drmaa import DRMAAExecutor
+        executor = DRMAAExecutor(
+            max_jobs=args.max_jobs,
+            stop_on_first_error=args.stop_on_first_error,
+            skip_already_done=args.skip_already_done,
+            store=store,
+            max_slots=args.max_slots,
+            admission=args.admission,
+            retry=retry,
+            submit_rate=args.submit_rate,
+            submit_burst=args.submit_burst,
+            submit_workers=args.submit_workers,
+            metrics=metrics,
+            profiler=profiler,
+            bundler=bundler,
+            status_mode=args.drmaa_status_mode,
+            array_jobs=args.array_jobs,
+            array_dir=args.array_dir,
+            checkpoint=checkpoint,
+            contact=contact,
+        )
+    elif args.executor == 'local':
+        from scheduler.executor.local import LocalExecutor
+        executor = LocalExecutor(
+            max_jobs=args.max_jobs,
+            stop_on_first_error=args.stop_on_first_error,
+            skip_already_done=args.skip_already_done,
+            store=store,
+            max_slots=args.max_slots,
+            admission=args.admission,
+            retry=retry,
+            submit_rate=args.submit_rate,
+            submit_burst=args.submit_burst,
+            submit_workers=args.submit_workers,
+            metrics=metrics,
+            profiler=profiler,
+            bundler=bundler,
+            num_cores=args.local_cores,
+        )
+    elif args.executor == 'async-local':
+        from scheduler.executor.async_local import AsyncLocalExecutor
+        executor = AsyncLocalExecutor(
+            max_jobs=args.max_jobs,
+            stop_on_first_error=args.stop_on_first_error,
+            skip_already_done=args.skip_already_done,
+            store=store,
+            max_slots=args.max_slots,
+            admission=args.admission,
+            retry=retry,
+            submit_rate=args.submit_rate,
+            submit_burst=args.submit_burst,
+            submit_workers=args.submit_workers,
+            metrics=metrics,
+            profiler=profiler,
+            bundler=bundler,
+            num_cores=args.local_cores,
+        )
+    else:
+        raise ValueError('Invalid executor')
+    return executor
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('batch', nargs='?', default='-')
@@ -40,66 +129,261 @@ def main():
     parser.add_argument('--status-dir', '-s', default='status')
     parser.add_argument('--time-dir', '-T', default='time')
     parser.add_argument('-j', '--max-jobs', type=int)
+    parser.add_argument('--max-slots', type=int,
+                        help='limit sum of threads (num_slots) of running jobs')
+    parser.add_argument('--admission', choices=sorted(POLICIES), default='fifo',
+                        help='how queued jobs are packed into free slots')
+    parser.add_argument('--journal',
+                        help='keep job results in this SQLite journal instead of status and time files, '
+                             'should be on a local disk')
+    parser.add_argument('--fsync-results', action='store_true',
+                        help='fsync status and time files, in batches')
+    parser.add_argument('--export-journal', action='store_true',
+                        help='write status and time files from --journal and exit')
+
+    parser.add_argument('--submit-rate', type=float,
+                        help='submit at most this many jobs per second on average')
+    parser.add_argument('--submit-burst', type=int,
+                        help='jobs which may be submitted at once under --submit-rate, defaults to the rate')
+    parser.add_argument('--submit-workers', type=int, default=0,
+                        help='submit jobs from this many threads, concurrently with waiting for finished ones')
+
+    parser.add_argument('--log-level', choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'), default='DEBUG')
+    parser.add_argument('--metrics',
+                        help='export queue, submission, harvesting and per-batch metrics to this file')
+    parser.add_argument('--metrics-format', choices=FORMATS, default=FORMAT_PROMETHEUS,
+                        help='prometheus textfile replaced on every export or JSONL appended to')
+    parser.add_argument('--metrics-interval', type=float, default=15,
+                        help='seconds between exports of --metrics')
+    parser.add_argument('--profile',
+                        help='write cProfile stats of waiting for jobs to this file, see python -m pstats')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='log top memory allocations made while waiting for jobs, with tracemalloc')
+
+    parser.add_argument('--max-attempts', type=int, default=1,
+                        help='attempts of every job unless set by the job, failed attempts are retried '
+                             'if their failure is one of --retry-on')
+    parser.add_argument('--retry-on', default=','.join(DEFAULT_RETRY_ON),
+                        help='comma separated failures which are retried, of: {}'.format(', '.join(FAILURES)))
+    parser.add_argument('--retry-exit-codes', default='',
+                        help='comma separated exit codes which are retried without "exit" in --retry-on')
+    parser.add_argument('--retry-backoff', type=float, default=30,
+                        help='seconds before the first retry, doubled for every next one')
+    parser.add_argument('--retry-max-backoff', type=float, default=600)
+    parser.add_argument('--retry-requeue', choices=[REQUEUE_FRONT, REQUEUE_BACK], default=REQUEUE_FRONT,
+                        help='where retried jobs are put in the queue')
 
     parser.add_argument('-d', '--dry-run', action='store_true')
     parser.add_argument('-K', '--stop-on-first-error', action='store_true')
     parser.add_argument('-S', '--skip-already-done', action='store_true')
+    parser.add_argument('--fingerprint', action='store_true',
+                        help='skip already done jobs only if their command, executable, args, work dir '
+                             'and inputs have not changed, implies --skip-already-done')
     parser.add_argument('--version', '-V', action='version', version="%(prog)s " + version.get_version())
     parser.add_argument('--batch-format', '-f', choices=['json', 'sh'], default='json')
-    parser.add_argument('--executor', '-e', choices=['drmaa', 'local'], default='drmaa')
+    parser.add_argument('--parse-processes', type=int,
+                        help='parse sh batch file in this many processes, only faster with as many idle CPUs: '
+                             'the main process still builds every job from what they send back')
+    parser.add_argument('--stream', action='store_true',
+                        help='read jobs lazily while they are submitted instead of loading the whole file')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='start every job as soon as the jobs and batches it depends on have succeeded')
+    parser.add_argument('--default-depends-on', choices=DEFAULT_DEPENDS_ON, default='previous',
+                        help='what batches without depends_on wait for in --pipeline mode')
+    parser.add_argument('--order', choices=ORDERS, default='file',
+                        help='submission order of jobs, by runtimes of their previous runs '
+                             'in status and time files or --journal')
+    parser.add_argument('--executor', '-e', choices=['drmaa', 'local', 'async-local'], default='drmaa')
+    parser.add_argument('--local-cores', type=int,
+                        help='cores shared by jobs of local executors, default: number of CPUs')
+    parser.add_argument('--drmaa-status-mode', choices=['notify', 'bulk', 'per-job'], default='notify')
+    parser.add_argument('--array-jobs', action='store_true',
+                        help='submit jobs with the same command, threads and work dir as array jobs (drmaa only)')
+    parser.add_argument('--daemon', metavar='SOCKET',
+                        help='serve batches of --connect clients on this Unix socket with one executor, '
+                             'executor options apply to all of them')
+    parser.add_argument('--connect', metavar='SOCKET',
+                        help='run batches in the daemon listening on this socket and wait for them')
+    parser.add_argument('--checkpoint',
+                        help='log submitted jobs and the DRMAA session to this file, an interrupted run '
+                             'leaves its jobs running (drmaa only, not with array jobs or bundles)')
+    parser.add_argument('--resume', action='store_true',
+                        help='reattach to jobs left running by the run which wrote --checkpoint, '
+                             'implies --skip-already-done')
+    parser.add_argument('--array-dir', default='.scheduler',
+                        help='directory for array job and bundle index files, must be visible from cluster nodes')
+    parser.add_argument('--bundle-size', type=int,
+                        help='submit this many consecutive jobs of a batch as one job, '
+                             'with --bundle-runtime until runtimes of the batch are known (default {})'.format(
+                                 Bundler.DEFAULT_SIZE))
+    parser.add_argument('--bundle-runtime', type=float,
+                        help='bundle as many jobs as take about this many seconds, by their runtimes '
+                             'in this run or previous ones')
+    parser.add_argument('--bundle-slots', type=int,
+                        help='slots requested by a bundle, its jobs run in parallel while their slots fit in')
 
     args = parser.parse_args()
+    logging.getLogger().setLevel(args.log_level)
+    if args.pipeline and args.stream:
+        parser.error('--pipeline needs all batches up front and can not be used with --stream')
+    if args.submit_rate is not None and args.submit_rate <= 0:
+        parser.error('--submit-rate must be positive')
+    if args.fingerprint:
+        args.skip_already_done = True
+    if args.daemon and args.connect:
+        parser.error('--daemon and --connect are mutually exclusive')
+    if (args.daemon or args.connect) and args.stop_on_first_error:
+        parser.error('--stop-on-first-error would stop jobs of all clients of the daemon')
+    if args.checkpoint and (args.executor != 'drmaa' or args.daemon or args.connect):
+        parser.error('--checkpoint needs the drmaa executor and can not be used with --daemon or --connect')
+    if args.checkpoint and (args.array_jobs or args.bundle_size or args.bundle_runtime):
+        # Members of array jobs and bundles would be submitted again by --resume
+        parser.error('--checkpoint can not be used with --array-jobs, --bundle-size or --bundle-runtime')
+    if args.resume:
+        if not args.checkpoint:
+            parser.error('--resume requires --checkpoint')
+        args.skip_already_done = True
+
+    if args.export_journal:
+        if not args.journal:
+            parser.error('--export-journal requires --journal')
+        journal = JournalStore(args.journal)
+        journal.export()
+        journal.close()
+        return
+
+    retry_on = [failure for failure in args.retry_on.split(',') if failure]
+    retry_exit_codes = [int(code) for code in args.retry_exit_codes.split(',') if code]
+    try:
+        retry = RetryPolicy(
+            max_attempts=args.max_attempts,
+            backoff=args.retry_backoff,
+            max_backoff=args.retry_max_backoff,
+            retry_on=retry_on,
+            retry_exit_codes=retry_exit_codes,
+            requeue=args.retry_requeue,
+        )
+    except ValueError as e:
+        parser.error(str(e))
+
+    bundler = None
+    if args.bundle_size or args.bundle_runtime:
+        try:
+            bundler = Bundler(
+                directory=args.array_dir,
+                size=args.bundle_size,
+                runtime=args.bundle_runtime,
+                slots=args.bundle_slots,
+            )
+        except ValueError as e:
+            parser.error(str(e))
+
+    store = JournalStore(args.journal) if args.journal else FileStore(fsync=args.fsync_results)
+    metrics = None
+    if args.metrics:
+        metrics = MetricsExporter(args.metrics, format=args.metrics_format, interval=args.metrics_interval)
+    profiler = None
+    if args.profile or args.trace_memory:
+        profiler = Profiler(profile_path=args.profile, trace_memory=args.trace_memory)
+
+    if args.daemon:
+        executor = _create_executor(args, store, retry, bundler, metrics, profiler)
+        daemon = SchedulerDaemon(
+            executor,
+            args.daemon,
+            order=args.order,
+            history=RuntimeHistory(store) if args.order != 'file' else None,
+            fingerprinter=Fingerprinter() if args.fingerprint else None,
+        )
+        try:
+            daemon.serve_forever()
+        except RuntimeError as e:
+            executor.shutdown()
+            sys.stderr.write('{}\n'.format(e))
+            exit(1)
+        return
 
     if args.batch == '-':
         f = sys.stdin
     else:
         f = open(args.batch)
 
-    if args.batch_format == 'json':
-        batches = json.parse_config(f)
-    elif args.batch_format == 'sh':
-        batches = sh.parse_config(f)
+    if args.stream:
+        if args.batch_format == 'json':
+            batches = json.iter_config(f)
+        elif args.batch_format == 'sh':
+            batches = sh.iter_config(f, processes=args.parse_processes)
+        else:
+            raise Exception('Invalid parser_type: {}'.format(args.parser_type))
+        batches = _validate_streamed_batches(batches)
     else:
-        raise Exception('Invalid parser_type: {}'.format(args.parser_type))
+        if args.batch_format == 'json':
+            batches = json.parse_config(f)
+        elif args.batch_format == 'sh':
+            batches = sh.parse_config(f, processes=args.parse_processes)
+        else:
+            raise Exception('Invalid parser_type: {}'.format(args.parser_type))
 
-    if f is not sys.stdin:
-        f.close()
+        if f is not sys.stdin:
+            f.close()
 
-    _validate_batches(batches)
+        _validate_batches(batches)
+        if not args.pipeline and any(j.depends_on for b in batches for j in b.jobs):
+            parser.error('jobs with depends_on need --pipeline')
 
     if args.dry_run:
         for b in batches:
+            jobs_count = threads = 0
+            for j in b.jobs:
+                jobs_count += 1
+                threads += j.num_slots
             print('Batch: {name} ({jobs} jobs, sum of threads: {threads})'.format(
                 name=b.name,
-                jobs=len(b.jobs),
-                threads=sum(j.num_slots for j in b.jobs)
+                jobs=jobs_count,
+                threads=threads
             ))
         return
-    if args.executor == 'drmaa':
-        from scheduler.executor.drmaa import DRMAAExecutor
-        executor = DRMAAExecutor(
-            max_jobs=args.max_jobs,
-            stop_on_first_error=args.stop_on_first_error,
-            skip_already_done=args.skip_already_done,
-
+    if args.connect:
+        ok = run_client(
+            args.connect, list(batches),
+            log_dir=args.log_dir,
+            status_dir=args.status_dir,
+            time_dir=args.time_dir,
+            default_depends_on=args.default_depends_on if args.pipeline else 'previous',
         )
-    elif args.executor == 'local':
-        from scheduler.executor.local import LocalExecutor
-        executor = LocalExecutor(
-            max_jobs=args.max_jobs,
-            stop_on_first_error=args.stop_on_first_error,
-            skip_already_done=args.skip_already_done,
+        exit(0 if ok else 1)
 
-        )
-    else:
-        raise ValueError('Invalid executor')
+    checkpoint = None
+    contact = None
+    reattach = {}
+    if args.checkpoint:
+        checkpoint = Checkpoint(args.checkpoint)
+        if args.resume:
+            contact, reattach = checkpoint.load()
+            logger.info('Resuming session {} with {} jobs to reattach'.format(
+                contact, len(reattach)
+            ))
+    executor = _create_executor(args, store, retry, bundler, metrics, profiler, checkpoint, contact)
+    if checkpoint:
+        reattach = executor.resume(reattach)
+        checkpoint.open(executor.contact, reattach)
 
     scheduler = Scheduler(
         log_dir=args.log_dir,
         status_dir=args.status_dir,
         time_dir=args.time_dir,
+        order=args.order,
+        history=RuntimeHistory(store) if args.order != 'file' else None,
+        fingerprinter=Fingerprinter() if args.fingerprint else None,
     )
-    scheduler.run_batches(executor, batches)
+    try:
+        scheduler.run_batches(executor, batches, pipeline=args.pipeline, default_depends_on=args.default_depends_on)
+    except DependencyError as e:
+        sys.stderr.write('{}\n'.format(e))
+        exit(1)
+
+    if f is not sys.stdin and not f.closed:
+        f.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,233 @@
+"""
+Daemon running batches of many clients with one executor: one backend session,
+one status harvesting loop and one max_jobs / max_slots budget shared by all of them.
+
+Clients connect to a Unix domain socket and send one request as a JSON line:
+
+    {"batches": [...], "log_dir": ..., "status_dir": ..., "time_dir": ...,
+     "work_dir": ..., "default_depends_on": "previous"}
+
+batches are in the JSON config format, paths must be absolute. The daemon answers
+with JSON lines, one per finished job and a last one for the whole request:
+
+    {"event": "job", "batch": ..., "name": ..., "ok": true, "skipped": false}
+    {"event": "done", "ok": 10, "failed": 0, "skipped": 2, "blocked": 0}
+    {"event": "error", "message": ...}
+
+Jobs keep running if their client disconnects.
+"""
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+from collections import Counter
+from itertools import count
+from os.path import abspath, exists
+from threading import Thread, Event
+from typing import Dict, Any, Callable, List
+
+from scheduler.dag import JobGraph
+from scheduler.executor.base import Executor
+from scheduler.fingerprint import Fingerprinter
+from scheduler.history import RuntimeHistory
+from scheduler.job import Batch, JobSpec
+from scheduler.parser import json as json_parser
+from scheduler.scheduler import Scheduler
+
+logger = logging.getLogger(__name__)
+
+EVENT_JOB = 'job'
+EVENT_DONE = 'done'
+EVENT_ERROR = 'error'
+
+
+def _encode(message: Dict[str, Any])->bytes:
+    return json.dumps(message).encode() + b'\n'
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        events = queue.Queue()  # type: queue.Queue
+        self.server.scheduler_daemon.submit(line, events.put)
+        while True:
+            event = events.get()
+            try:
+                self.wfile.write(_encode(event))
+                self.wfile.flush()
+            except OSError:
+                # Client is gone, its jobs run on
+                return
+            if event['event'] in (EVENT_DONE, EVENT_ERROR):
+                return
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class SchedulerDaemon:
+    """
+    Serves requests on socket_path until interrupted. Requests are started from
+    the thread running the executor's wait_for_jobs(), so every client's jobs are
+    queued, harvested and reported by the same loop.
+    """
+    def __init__(self, executor: Executor, socket_path: str, order: str='file',
+                 history: RuntimeHistory=None, fingerprinter: Fingerprinter=None):
+        self._executor = executor
+        self._socket_path = abspath(socket_path)
+        self._order = order
+        self._history = history
+        self._fingerprinter = fingerprinter
+        self._requests = count(1)
+        # Set when a request was passed to the executor
+        self._work = Event()
+
+    def submit(self, line: bytes, send: Callable[[Dict[str, Any]], None]):
+        """
+        Thread-safe: starts the request from the executor's thread, its events are passed to send
+        """
+        request_id = next(self._requests)
+        self._executor.call_soon(lambda: self._start(request_id, line, send))
+        self._work.set()
+
+    def _start(self, request_id: int, line: bytes, send: Callable[[Dict[str, Any]], None]):
+        try:
+            request = json.loads(line.decode())
+            batches = json_parser.parse_batches(request['batches'])
+            scheduler = Scheduler(
+                log_dir=request['log_dir'],
+                status_dir=request['status_dir'],
+                time_dir=request['time_dir'],
+                order=self._order,
+                history=self._history,
+                fingerprinter=self._fingerprinter,
+                work_dir=request['work_dir'],
+            )
+        except (ValueError, KeyError, TypeError) as e:
+            logger.error('Request {}: invalid request: {}'.format(request_id, e))
+            send({'event': EVENT_ERROR, 'message': 'Invalid request: {}'.format(e)})
+            return
+
+        logger.info('Request {id}: {n} jobs in {batches} batches from {work_dir}'.format(
+            id=request_id,
+            n=sum(len(batch.jobs) for batch in batches),
+            batches=len(batches),
+            work_dir=request['work_dir'],
+        ))
+        counts = Counter()
+
+        def on_job_done(job_spec: JobSpec, ok: bool, skipped: bool):
+            counts['skipped' if skipped else 'ok' if ok else 'failed'] += 1
+            send({
+                'event': EVENT_JOB,
+                'batch': job_spec.layout.batch_name,
+                'name': job_spec.name,
+                'ok': ok,
+                'skipped': skipped,
+            })
+
+        def on_done(graph: JobGraph):
+            logger.info('Request {id} done: {ok} ok, {failed} failed, {skipped} skipped, {blocked} blocked'.format(
+                id=request_id,
+                ok=counts['ok'],
+                failed=counts['failed'],
+                skipped=counts['skipped'],
+                blocked=graph.blocked,
+            ))
+            send({
+                'event': EVENT_DONE,
+                'ok': counts['ok'],
+                'failed': counts['failed'],
+                'skipped': counts['skipped'],
+                'blocked': graph.blocked,
+            })
+
+        try:
+            scheduler.start_graph(self._executor, batches, request.get('default_depends_on', 'previous'),
+                                  on_job_done, on_done)
+        except Exception as e:
+            # Fails only this request, the executor's loop serves the others on
+            logger.error('Request {}: {}'.format(request_id, e))
+            send({'event': EVENT_ERROR, 'message': str(e)})
+
+    def _remove_stale_socket(self):
+        if not exists(self._socket_path):
+            return
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(self._socket_path)
+            except ConnectionRefusedError:
+                os.remove(self._socket_path)
+                return
+        raise RuntimeError('Another daemon is listening on {}'.format(self._socket_path))
+
+    def serve_forever(self):
+        self._remove_stale_socket()
+        server = _Server(self._socket_path, _RequestHandler)
+        server.scheduler_daemon = self
+        server_thread = Thread(target=server.serve_forever, name='daemon-server', daemon=True)
+        server_thread.start()
+        logger.info('Listening on {}'.format(self._socket_path))
+        try:
+            while True:
+                self._work.clear()
+                self._executor.wait_for_jobs()
+                # Finite timeout keeps the thread responsive to KeyboardInterrupt
+                self._work.wait(1)
+        except KeyboardInterrupt:
+            self._executor.interrupt()
+        finally:
+            server.shutdown()
+            server.server_close()
+            os.remove(self._socket_path)
+            self._executor.shutdown()
+
+
+def run_client(socket_path: str, batches: List[Batch], log_dir: str, status_dir: str, time_dir: str,
+               default_depends_on: str='previous')->bool:
+    """
+    Runs batches in the daemon listening on socket_path, returns True if all jobs succeeded
+    """
+    for batch in batches:
+        for job_spec in batch.jobs:
+            # Daemon resolves relative paths against its own directory
+            if job_spec.work_dir:
+                job_spec.work_dir = abspath(job_spec.work_dir)
+            for path in ('log_path', 'status_path', 'time_path'):
+                if getattr(job_spec, path):
+                    setattr(job_spec, path, abspath(getattr(job_spec, path)))
+    request = {
+        'batches': json_parser.batches_to_dicts(batches),
+        'log_dir': abspath(log_dir),
+        'status_dir': abspath(status_dir),
+        'time_dir': abspath(time_dir),
+        'work_dir': os.getcwd(),
+        'default_depends_on': default_depends_on,
+    }
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(_encode(request))
+        with sock.makefile('rb') as f:
+            for line in f:
+                event = json.loads(line.decode())
+                if event['event'] == EVENT_JOB:
+                    if event['skipped']:
+                        logger.debug('Job {batch}/{name} is already done'.format(**event))
+                    elif event['ok']:
+                        logger.info('Job {batch}/{name} successfully finished'.format(**event))
+                    else:
+                        logger.error('Job {batch}/{name} finished with error'.format(**event))
+                elif event['event'] == EVENT_DONE:
+                    logger.info('All batches done: {ok} ok, {failed} failed, {skipped} skipped, '
+                                '{blocked} not started because of failed dependencies'.format(**event))
+                    return not event['failed'] and not event['blocked']
+                else:
+                    logger.error(event['message'])
+                    return False
+    logger.error('Daemon closed the connection')
+    return False
@@ -0,0 +1,487 @@
+import heapq
+import logging
+from array import array
+from collections import defaultdict
+from itertools import count
+from math import inf
+from time import time
+from typing import List, Dict, Iterable, Tuple, Iterator, Optional, Callable
+
+import datetime
+import math
+
+from scheduler.executor.admission import job_slots
+from scheduler.executor.base import Executor
+from scheduler.job import Batch, JobSpec
+
+logger = logging.getLogger(__name__)
+
+# Dependencies of batches without depends_on in pipelined mode
+DEFAULT_DEPENDS_ON = ('previous', 'none')
+
+# Node states
+_WAITING = 0
+_RELEASED = 1
+_DONE = 2
+_FAILED = 3
+_BLOCKED = 4
+
+
+def _format_seconds(seconds: float)->str:
+    return str(datetime.timedelta(seconds=math.trunc(seconds)))
+
+
+class DependencyError(ValueError):
+    pass
+
+
+def batch_dependencies(batches: List[Batch], default_depends_on: str='previous')->Dict[str, List[str]]:
+    """
+    Names of batches every batch waits for, raises DependencyError for unknown names and cycles
+    """
+    if default_depends_on not in DEFAULT_DEPENDS_ON:
+        raise ValueError('Invalid default dependency: {}'.format(default_depends_on))
+    dependencies = dict()
+    previous = None
+    for batch in batches:
+        if batch.depends_on is not None:
+            dependencies[batch.name] = list(batch.depends_on)
+        elif default_depends_on == 'previous' and previous is not None:
+            dependencies[batch.name] = [previous]
+        else:
+            dependencies[batch.name] = []
+        previous = batch.name
+
+    for name, depends_on in dependencies.items():
+        for dependency in depends_on:
+            if dependency not in dependencies:
+                raise DependencyError('Batch "{}" depends on unknown batch "{}"'.format(name, dependency))
+
+    # Kahn's algorithm, batches left over are on a cycle
+    waiting = {name: len(set(depends_on)) for name, depends_on in dependencies.items()}
+    dependents = defaultdict(set)
+    for name, depends_on in dependencies.items():
+        for dependency in depends_on:
+            dependents[dependency].add(name)
+    ready = [name for name, n in waiting.items() if not n]
+    while ready:
+        name = ready.pop()
+        del waiting[name]
+        for dependent in dependents[name]:
+            waiting[dependent] -= 1
+            if not waiting[dependent]:
+                ready.append(dependent)
+    if waiting:
+        raise DependencyError('Cyclic dependencies between batches: {}'.format(', '.join(sorted(waiting))))
+    return dependencies
+
+
+class JobGraph:
+    """
+    Jobs of all batches and their dependencies. Every job is released to the executor
+    as soon as all its own predecessors have succeeded (or were already done).
+
+    Explicit job references are edges kept in CSR arrays, only in-degrees change at
+    run time. A batch dependency is not expanded into edges: every batch has a barrier
+    which passes once all its jobs have succeeded and then decrements in-degrees of
+    the jobs of dependent batches. Descendants of a failed job, including whole
+    dependent batches, are marked blocked and never started.
+
+    A job refers to its predecessors by name within its own batch or as "batch/name".
+    """
+    def __init__(self, batches: List[Batch], batch_dependencies: Dict[str, List[str]]):
+        self._batches = batches
+        self._specs = []  # type: List[JobSpec]
+        # Batch index of every job
+        self._job_batch = array('l')
+        self._nodes = dict()  # type: Dict[JobSpec, int]
+        self._batch_jobs = []  # type: List[range]
+
+        nodes_by_name = dict()  # type: Dict[str, Dict[str, int]]
+        for b, batch in enumerate(batches):
+            first = len(self._specs)
+            names = nodes_by_name[batch.name] = dict()
+            for job_spec in batch.jobs:
+                node = len(self._specs)
+                # Ambiguous names can't be referred to
+                names[job_spec.name] = -1 if job_spec.name in names else node
+                self._specs.append(job_spec)
+                self._job_batch.append(b)
+                self._nodes[job_spec] = node
+            self._batch_jobs.append(range(first, len(self._specs)))
+
+        n_jobs = len(self._specs)
+        n_batches = len(batches)
+        batch_index = {batch.name: b for b, batch in enumerate(batches)}
+        self._batch_dependents = [[] for _ in batches]  # type: List[List[int]]
+        self._batch_in_degree = array('l', [0]) * n_batches
+        self._in_degree = in_degree = array('l', [0]) * n_jobs
+        for b, batch in enumerate(batches):
+            for dependency in set(batch_dependencies.get(batch.name, ())):
+                self._batch_dependents[batch_index[dependency]].append(b)
+                self._batch_in_degree[b] += 1
+            for node in self._batch_jobs[b]:
+                in_degree[node] = self._batch_in_degree[b]
+
+        sources = array('l')
+        targets = array('l')
+        for b, batch in enumerate(batches):
+            names = nodes_by_name[batch.name]
+            for node in self._batch_jobs[b]:
+                for reference in self._specs[node].depends_on or ():
+                    source = names.get(reference)
+                    if source is None or source < 0:
+                        source = self._resolve(nodes_by_name, batch.name, reference, self._specs[node])
+                    sources.append(source)
+                    targets.append(node)
+        del nodes_by_name
+
+        # Compressed sparse rows of dependents
+        self._offsets = offsets = array('l', [0]) * (n_jobs + 1)
+        for source, target in zip(sources, targets):
+            offsets[source + 1] += 1
+            in_degree[target] += 1
+        for i in range(n_jobs):
+            offsets[i + 1] += offsets[i]
+        positions = offsets[:-1]
+        self._dependents = dependents = array('l', [0]) * len(sources)
+        for source, target in zip(sources, targets):
+            dependents[positions[source]] = target
+            positions[source] += 1
+        del sources, targets, positions
+
+        # Jobs of every batch which have not succeeded yet
+        self._unfinished = array('l', (len(jobs) for jobs in self._batch_jobs))
+        self._state = bytearray(n_jobs)
+        self._batch_state = bytearray(n_batches)
+        self._check_acyclic()
+
+        # Jobs of every batch which have not finished, failed or been blocked yet
+        self._remaining = array('l', self._unfinished)
+        self._skipped = array('l', [0]) * n_batches
+        self._blocked = array('l', [0]) * n_batches
+        self._start_times = [None] * n_batches
+        # Predicted seconds from the run start to the end of every batch
+        self._predicted_finish = None  # type: Optional[List[float]]
+        self._run_start_time = None  # type: Optional[float]
+        self._priority = array('d', [0.0]) * n_jobs
+        self._ready = []  # type: List[Tuple[float, int, int]]
+        self._release_order = count()
+        self._feeding = False
+        self._executor = None  # type: Executor
+        self._on_job_done = None  # type: Optional[Callable[[JobSpec, bool, bool], None]]
+        self._on_done = None  # type: Optional[Callable[[JobGraph], None]]
+        # Batches with jobs which have not finished yet
+        self._running_batches = sum(1 for jobs in self._batch_jobs if jobs)
+        logger.info('Job graph: {} jobs, {} batches, {} job dependencies'.format(
+            n_jobs, n_batches, len(dependents)
+        ))
+
+    @staticmethod
+    def _resolve(nodes_by_name: Dict[str, Dict[str, int]], batch_name: str, reference: str,
+                 job_spec: JobSpec)->int:
+        names = nodes_by_name[batch_name]
+        if reference not in names and '/' in reference:
+            batch_name, name = reference.split('/', 1)
+            names = nodes_by_name.get(batch_name, {})
+        else:
+            name = reference
+        node = names.get(name)
+        if node is None:
+            raise DependencyError('Job "{}" depends on unknown job "{}"'.format(job_spec.name, reference))
+        if node < 0:
+            raise DependencyError('Job "{}" depends on "{}" which is not unique in batch "{}"'.format(
+                job_spec.name, reference, batch_name
+            ))
+        return node
+
+    def _out(self, node: int)->Iterable[int]:
+        return self._dependents[self._offsets[node]:self._offsets[node + 1]]
+
+    def _initial(self)->Tuple[List[int], List[int]]:
+        """
+        Jobs without predecessors and empty batches without dependencies
+        """
+        return (
+            [node for node, degree in enumerate(self._in_degree) if not degree],
+            [b for b, jobs in enumerate(self._batch_jobs) if not jobs and not self._batch_in_degree[b]],
+        )
+
+    def _save_counters(self)->tuple:
+        return (array('l', self._in_degree), array('l', self._unfinished),
+                array('l', self._batch_in_degree), bytearray(self._state), bytearray(self._batch_state))
+
+    def _restore_counters(self, saved: tuple):
+        (self._in_degree, self._unfinished, self._batch_in_degree,
+         self._state, self._batch_state) = saved
+
+    def _check_acyclic(self):
+        """
+        Kahn's algorithm on copies of the counters, every released job is taken as succeeded.
+        Keeps the order in which jobs were released, it is a topological order.
+        """
+        saved = self._save_counters()
+        released, passed_batches = self._initial()
+        for node in released:
+            self._state[node] = _RELEASED
+        self._topological_order = array('l')
+        while released:
+            self._topological_order.extend(released)
+            released = self._release(released, passed_batches)
+            passed_batches = []
+        on_cycle = [node for node, state in enumerate(self._state) if state == _WAITING]
+        self._restore_counters(saved)
+        if on_cycle:
+            raise DependencyError('Cyclic dependencies between {} jobs, e.g.: {}'.format(
+                len(on_cycle), ', '.join(self._job_name(node) for node in on_cycle[:10])
+            ))
+
+    def prioritize(self, durations: List[float], critical_path: bool=True)->float:
+        """
+        Jobs released at the same time are submitted in descending priority: the predicted
+        duration, or with critical_path its bottom level, i.e. the longest predicted
+        path from the job's start to the end of the run. Returns the critical path length.
+        """
+        if not critical_path:
+            self._priority = array('d', durations)
+            return max(durations, default=0.0)
+
+        self._priority = priority = array('d', [0.0]) * len(durations)
+        # Longest bottom level among jobs of each batch
+        batch_level = array('d', [0.0]) * len(self._batches)
+        tails = dict()  # type: Dict[int, float]
+
+        def tail(b: int)->float:
+            """
+            Longest bottom level of jobs waiting for batch b's barrier
+            """
+            if b not in tails:
+                tails[b] = max((
+                    batch_level[d] if self._batch_jobs[d] else tail(d)
+                    for d in self._batch_dependents[b]
+                ), default=0.0)
+            return tails[b]
+
+        for node in reversed(self._topological_order):
+            b = self._job_batch[node]
+            level = tail(b)
+            for dependent in self._out(node):
+                level = max(level, priority[dependent])
+            priority[node] = level = durations[node] + level
+            batch_level[b] = max(batch_level[b], level)
+        return max(priority, default=0.0)
+
+    def simulate(self, durations: List[float], max_jobs: float=inf, max_slots: float=inf)->List[float]:
+        """
+        Predicts seconds from the start of the run to the end of every batch when jobs take
+        durations and are submitted like by start(), first come first served within capacity.
+        Predictions are reported when batches are done.
+        """
+        saved = self._save_counters()
+        finish = [0.0] * len(self._batches)
+        clock = 0.0
+        free_slots = max_slots
+        running = []  # type: List[Tuple[float, int]]
+        ready = []  # type: List[Tuple[float, int]]
+
+        released, passed_batches = self._initial()
+        released.extend(self._release([], passed_batches))
+        while True:
+            for node in released:
+                self._state[node] = _RELEASED
+                heapq.heappush(ready, (-self._priority[node], node))
+            while ready:
+                node = ready[0][1]
+                slots = min(job_slots(self._specs[node]), max_slots)
+                if len(running) >= max_jobs or (running and free_slots < slots):
+                    break
+                heapq.heappop(ready)
+                free_slots -= slots
+                heapq.heappush(running, (clock + durations[node], node))
+            if not running:
+                break
+            clock, node = heapq.heappop(running)
+            free_slots += min(job_slots(self._specs[node]), max_slots)
+            b = self._job_batch[node]
+            finish[b] = max(finish[b], clock)
+            released = self._release([node], [])
+        self._restore_counters(saved)
+        self._predicted_finish = finish
+        return finish
+
+    def _job_name(self, node: int)->str:
+        return '{}/{}'.format(self._batches[self._job_batch[node]].name, self._specs[node].name)
+
+    @property
+    def blocked(self)->int:
+        """
+        Jobs not started because of failed dependencies
+        """
+        return sum(self._blocked)
+
+    def start(self, executor: Executor, on_job_done: Callable[[JobSpec, bool, bool], None]=None,
+              on_done: Callable[['JobGraph'], None]=None):
+        """
+        Queues jobs without predecessors, the rest is queued from wait_for_jobs() callbacks.
+        From those on_job_done(job_spec, ok, skipped) is called for every finished job (see JobGroup),
+        on_done(graph) once every job has finished or was blocked.
+        """
+        self._executor = executor
+        self._on_job_done = on_job_done
+        self._on_done = on_done
+        self._run_start_time = time()
+        if not self._running_batches and on_done:
+            on_done(self)
+        released, passed_batches = self._initial()
+        for node in released:
+            self._state[node] = _RELEASED
+        self._queue(released + self._release([], passed_batches))
+
+    def _queue(self, nodes: List[int]):
+        """
+        Released jobs wait in a heap by priority (then by release order) and are pulled
+        by the executor only when it can submit them
+        """
+        for node in nodes:
+            b = self._job_batch[node]
+            if self._start_times[b] is None:
+                self._start_times[b] = time()
+                logger.info('Executing batch: {} ({} jobs)'.format(
+                    self._batches[b].name, len(self._batch_jobs[b])
+                ))
+            heapq.heappush(self._ready, (-self._priority[node], next(self._release_order), node))
+        if self._ready and not self._feeding:
+            self._feeding = True
+            self._executor.queue_all(self._feed(), on_job_done=self._job_done)
+
+    def _feed(self)->Iterator[JobSpec]:
+        while self._ready:
+            yield self._specs[heapq.heappop(self._ready)[2]]
+        self._feeding = False
+
+    def _decrement(self, node: int, released: List[int]):
+        self._in_degree[node] -= 1
+        if not self._in_degree[node] and self._state[node] == _WAITING:
+            self._state[node] = _RELEASED
+            released.append(node)
+
+    def _release(self, succeeded: List[int], passed_batches: List[int])->List[int]:
+        """
+        Decrements in-degrees of dependents of succeeded jobs and passed batch barriers,
+        returns released jobs
+        """
+        released = []
+        succeeded = list(succeeded)
+        while succeeded or passed_batches:
+            if succeeded:
+                node = succeeded.pop()
+                for dependent in self._out(node):
+                    self._decrement(dependent, released)
+                b = self._job_batch[node]
+                self._unfinished[b] -= 1
+                if self._unfinished[b] or self._batch_state[b] != _WAITING:
+                    continue
+            else:
+                b = passed_batches.pop()
+            self._batch_state[b] = _DONE
+            for dependent_batch in self._batch_dependents[b]:
+                self._batch_in_degree[dependent_batch] -= 1
+                jobs = self._batch_jobs[dependent_batch]
+                for dependent in jobs:
+                    self._decrement(dependent, released)
+                if not jobs and not self._batch_in_degree[dependent_batch]:
+                    passed_batches.append(dependent_batch)
+        return released
+
+    def _block_descendants(self, node: int)->int:
+        blocked = 0
+        failed = [node]
+        blocked_batches = []
+        while failed or blocked_batches:
+            if failed:
+                node = failed.pop()
+                dependents = list(self._out(node))
+                b = self._job_batch[node]
+                if self._batch_state[b] == _WAITING:
+                    blocked_batches.append(b)
+            else:
+                b = blocked_batches.pop()
+                self._batch_state[b] = _BLOCKED
+                dependents = []
+                for dependent_batch in self._batch_dependents[b]:
+                    if not self._batch_jobs[dependent_batch] and self._batch_state[dependent_batch] == _WAITING:
+                        blocked_batches.append(dependent_batch)
+                    dependents.extend(self._batch_jobs[dependent_batch])
+
+            for dependent in dependents:
+                if self._state[dependent] != _WAITING:
+                    continue
+                self._state[dependent] = _BLOCKED
+                failed.append(dependent)
+                blocked += 1
+                logger.debug('Job {} not started because of a failed dependency'.format(
+                    self._job_name(dependent)
+                ))
+                b = self._job_batch[dependent]
+                self._blocked[b] += 1
+                self._job_finished(b)
+        return blocked
+
+    def _job_done(self, job_spec: JobSpec, ok: bool, skipped: bool):
+        node = self._nodes.pop(job_spec)
+        b = self._job_batch[node]
+        if skipped:
+            self._skipped[b] += 1
+        if self._on_job_done:
+            self._on_job_done(job_spec, ok, skipped)
+        if ok:
+            self._state[node] = _DONE
+            self._job_finished(b)
+            self._queue(self._release([node], []))
+            return
+
+        self._state[node] = _FAILED
+        self._job_finished(b)
+        blocked = self._block_descendants(node)
+        if blocked:
+            logger.warning('{n} jobs not started because job {name} failed'.format(
+                n=blocked,
+                name=self._job_name(node),
+            ))
+
+    def _job_finished(self, b: int):
+        self._remaining[b] -= 1
+        if self._remaining[b]:
+            return
+        self._running_batches -= 1
+        try:
+            self._log_batch_done(b)
+        finally:
+            if not self._running_batches and self._on_done:
+                self._on_done(self)
+
+    def _log_batch_done(self, b: int):
+        batch = self._batches[b]
+        if self._start_times[b] is None:
+            logger.warning('Batch {batch} not started because of failed dependencies'.format(batch=batch.name))
+            return
+        logger.info('Batch {batch} done in {time}{predicted}'.format(
+            batch=batch.name,
+            time=_format_seconds(time() - self._start_times[b]),
+            predicted='' if self._predicted_finish is None else ', {} after start of run (predicted {})'.format(
+                _format_seconds(time() - self._run_start_time),
+                _format_seconds(self._predicted_finish[b]),
+            ),
+        ))
+        if batch.jobs:
+            self._executor.finish_batch(batch.jobs[0].layout)
+        if self._skipped[b]:
+            logger.info('Batch {batch}: skipped {n} already done jobs'.format(
+                batch=batch.name,
+                n=self._skipped[b],
+            ))
+        if self._blocked[b]:
+            logger.warning('Batch {batch}: {n} jobs not started because of failed dependencies'.format(
+                batch=batch.name,
+                n=self._blocked[b],
+            ))
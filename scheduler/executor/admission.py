@@ -0,0 +1,153 @@
+import time
+from abc import ABCMeta, abstractmethod
+from math import inf
+from typing import List, Deque, Optional
+
+from scheduler.job import JobSpec
+
+
+def job_slots(job_spec: JobSpec)->int:
+    return job_spec.num_slots or 1
+
+
+class AdmissionPolicy(metaclass=ABCMeta):
+    """
+    Chooses queued jobs to submit so that their slots fit into the free slot budget
+    """
+    # Queued jobs the policy may look at, including the head
+    WINDOW = 1000
+
+    def __init__(self, max_slots: int=None):
+        self.max_slots = max_slots or inf
+
+    def fits(self, job_spec: JobSpec, free_slots: float)->bool:
+        slots = job_slots(job_spec)
+        # Jobs larger than the whole budget run alone
+        return slots <= free_slots or (slots > self.max_slots and free_slots == self.max_slots)
+
+    @abstractmethod
+    def select(self, queued: Deque[JobSpec], max_count: int, free_slots: float)->List[JobSpec]:
+        """
+        Removes chosen jobs from queued and returns them in submission order
+        """
+        pass
+
+    def _take(self, queued: Deque[JobSpec], candidates: List[int])->List[JobSpec]:
+        """
+        Removes jobs at candidates indexes (sorted) of queued window
+        """
+        if not candidates:
+            return []
+        if candidates[-1] == len(candidates) - 1:
+            # All taken jobs are at the head
+            return [queued.popleft() for _ in candidates]
+
+        window = [queued.popleft() for _ in range(candidates[-1] + 1)]
+        chosen = set(candidates)
+        queued.extendleft(reversed([
+            job_spec
+            for i, job_spec in enumerate(window)
+            if i not in chosen
+        ]))
+        return [window[i] for i in candidates]
+
+
+class FIFOPolicy(AdmissionPolicy):
+    """
+    Strict queue order, a job that does not fit blocks the ones behind it
+    """
+    WINDOW = 1
+
+    def select(self, queued: Deque[JobSpec], max_count: int, free_slots: float)->List[JobSpec]:
+        selected = []
+        while queued and len(selected) < max_count and self.fits(queued[0], free_slots):
+            job_spec = queued.popleft()
+            free_slots -= job_slots(job_spec)
+            selected.append(job_spec)
+        return selected
+
+
+class FirstFitPolicy(AdmissionPolicy):
+    """
+    Every job in the window that fits into the free slots, in queue order
+    """
+    def select(self, queued: Deque[JobSpec], max_count: int, free_slots: float)->List[JobSpec]:
+        candidates = []
+        for i in range(min(len(queued), self.WINDOW)):
+            if len(candidates) >= max_count:
+                break
+            if self.fits(queued[i], free_slots):
+                free_slots -= job_slots(queued[i])
+                candidates.append(i)
+        return self._take(queued, candidates)
+
+
+class LargestFirstPolicy(AdmissionPolicy):
+    """
+    Jobs of the window that fit, the largest ones first
+    """
+    def select(self, queued: Deque[JobSpec], max_count: int, free_slots: float)->List[JobSpec]:
+        window = min(len(queued), self.WINDOW)
+        by_size = sorted(range(window), key=lambda i: -job_slots(queued[i]))
+        candidates = []
+        for i in by_size:
+            if len(candidates) >= max_count:
+                break
+            if self.fits(queued[i], free_slots):
+                free_slots -= job_slots(queued[i])
+                candidates.append(i)
+        return self._take(queued, sorted(candidates))
+
+
+class BackfillPolicy(AdmissionPolicy):
+    """
+    Queue order, but smaller jobs may run behind a blocked head. After the head has waited
+    for reservation_delay seconds nothing else is started until it gets its slots.
+    """
+    RESERVATION_DELAY = 60
+
+    def __init__(self, max_slots: int=None, reservation_delay: float=None):
+        super().__init__(max_slots)
+        self._reservation_delay = self.RESERVATION_DELAY if reservation_delay is None else reservation_delay
+        self._blocked_head = None  # type: Optional[JobSpec]
+        self._blocked_since = None  # type: Optional[float]
+
+    def select(self, queued: Deque[JobSpec], max_count: int, free_slots: float)->List[JobSpec]:
+        selected = []
+        while queued and len(selected) < max_count and self.fits(queued[0], free_slots):
+            job_spec = queued.popleft()
+            free_slots -= job_slots(job_spec)
+            selected.append(job_spec)
+        if not queued or len(selected) >= max_count:
+            return selected
+
+        head = queued[0]
+        if head is not self._blocked_head:
+            self._blocked_head = head
+            self._blocked_since = time.time()
+        if time.time() - self._blocked_since >= self._reservation_delay:
+            # Let running jobs drain so the head gets its slots
+            return selected
+
+        candidates = []
+        for i in range(1, min(len(queued), self.WINDOW)):
+            if len(selected) + len(candidates) >= max_count:
+                break
+            if self.fits(queued[i], free_slots):
+                free_slots -= job_slots(queued[i])
+                candidates.append(i)
+        return selected + self._take(queued, candidates)
+
+
+POLICIES = {
+    'fifo': FIFOPolicy,
+    'first-fit': FirstFitPolicy,
+    'largest-first': LargestFirstPolicy,
+    'backfill': BackfillPolicy,
+}
+
+
+def create_policy(name: str, max_slots: int=None)->AdmissionPolicy:
+    if name not in POLICIES:
+        raise ValueError('Invalid admission policy: {}'.format(name))
+    return POLICIES[name](max_slots=max_slots)
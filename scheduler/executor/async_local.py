@@ -0,0 +1,225 @@
+import asyncio
+import logging
+import os
+import subprocess
+import time
+import warnings
+from collections import deque
+from itertools import count
+from os import cpu_count
+from threading import Thread
+from typing import Dict, Optional, Callable, Any
+
+from scheduler.executor.base import Executor
+from scheduler.executor.util import terminate_process, rusage_usage, start_failure, decode_status, open_log
+from scheduler.job import Job, JobSpec, ResourceUsage
+
+logger = logging.getLogger(__name__)
+
+# Child watchers were removed in Python 3.14, processes are then reaped by asyncio without their usage
+_AbstractChildWatcher = getattr(asyncio, 'AbstractChildWatcher', None)
+
+
+class UsageChildWatcher(_AbstractChildWatcher or object):
+    """
+    Reaps children of the event loop with wait4 once their pidfd is readable, in a thread
+    per child where pidfds are not supported, and keeps their resource usage for pop_usage()
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._pidfds = dict()  # type: Dict[int, int]
+        self._usage = dict()  # type: Dict[int, Any]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        pass
+
+    def is_active(self)->bool:
+        return self._loop.is_running()
+
+    def attach_loop(self, loop: asyncio.AbstractEventLoop):
+        if loop is not None:
+            self._loop = loop
+
+    def close(self):
+        for pid in list(self._pidfds):
+            self.remove_child_handler(pid)
+
+    def add_child_handler(self, pid: int, callback: Callable, *args):
+        try:
+            pidfd = os.pidfd_open(pid)
+        except (AttributeError, OSError):
+            Thread(target=self._wait, args=(pid, callback, args), daemon=True).start()
+            return
+        self._pidfds[pid] = pidfd
+        self._loop.add_reader(pidfd, self._reap, pid, callback, args)
+
+    def remove_child_handler(self, pid: int)->bool:
+        pidfd = self._pidfds.pop(pid, None)
+        if pidfd is None:
+            return False
+        self._loop.remove_reader(pidfd)
+        os.close(pidfd)
+        return True
+
+    def pop_usage(self, pid: int):
+        return self._usage.pop(pid, None)
+
+    def _reap(self, pid: int, callback: Callable, args: tuple):
+        self.remove_child_handler(pid)
+        self._wait(pid, callback, args)
+
+    def _wait(self, pid: int, callback: Callable, args: tuple):
+        try:
+            _, status, rusage = os.wait4(pid, 0)
+        except ChildProcessError:
+            # Reaped elsewhere, asyncio reports the same
+            returncode = 255
+        else:
+            returncode = decode_status(status)
+            self._usage[pid] = rusage
+        # Transports call back into their loop thread-safely
+        callback(pid, returncode, *args)
+
+
+class AsyncLocalExecutor(Executor):
+    """
+    Runs jobs as local subprocesses driven by a single asyncio event loop,
+    packing them by num_slots into num_cores like LocalExecutor
+    """
+    def __init__(self, num_cores: int=None, **kwargs):
+        super().__init__(**kwargs)
+        self._num_cores = num_cores or cpu_count() or 1
+        self._free_cores = self._num_cores
+        self._job_ids = count(1)
+        # Accessed only from the event loop thread
+        self._pending_jobs = deque()
+        self._processes = dict()  # type: Dict[int, asyncio.subprocess.Process]
+        self._tasks = set()
+        self._exit_statuses = dict()  # type: Dict[int, Optional[int]]
+        self._watcher = None  # type: Optional[UsageChildWatcher]
+
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = Thread(target=self._run_loop, daemon=True)
+        self._loop_thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        if _AbstractChildWatcher is not None:
+            # Default watchers reap processes without their resource usage,
+            # and before Python 3.12 wait for every child in its own thread
+            self._watcher = UsageChildWatcher(self._loop)
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', DeprecationWarning)
+                asyncio.set_child_watcher(self._watcher)
+        self._loop.run_forever()
+        self._loop.close()
+
+    def _notifies_exit(self)->bool:
+        return True
+
+    def _slot_capacity(self)->float:
+        return min(self._max_slots, self._num_cores)
+
+    def _job_status(self, job: Job) -> Executor.JobStatus:
+        exit_status = self._exit_statuses.get(job.job_id)
+        return Executor.JobStatus(
+            has_exited=job.job_id in self._exit_statuses,
+            exit_status=exit_status,
+            job=job,
+        )
+
+    def _forget_job(self, job: Job):
+        self._exit_statuses.pop(job.job_id, None)
+
+    def _submit(self, job_spec: JobSpec)->Job:
+        job = Job(spec=job_spec, job_id=next(self._job_ids))
+        self._loop.call_soon_threadsafe(self._queue_job, job)
+        return job
+
+    def _cancel_job(self, job: Job):
+        self._loop.call_soon_threadsafe(self._cancel, job)
+
+    def shutdown(self):
+        self._loop.call_soon_threadsafe(self._stop)
+        self._loop_thread.join()
+        super().shutdown()
+
+    @staticmethod
+    def _job_cores(job: Job)->int:
+        return job.spec.num_slots or 1
+
+    def _queue_job(self, job: Job):
+        self._pending_jobs.append(job)
+        self._dispatch()
+
+    def _dispatch(self):
+        while self._pending_jobs:
+            cores = self._job_cores(self._pending_jobs[0])
+            # Jobs requesting more than num_cores run alone
+            if cores > self._free_cores and self._free_cores != self._num_cores:
+                return
+            job = self._pending_jobs.popleft()
+            self._free_cores -= cores
+            task = self._loop.create_task(self._run_job(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _set_exited(self, job: Job, exit_status: Optional[int], usage: ResourceUsage=None, failure: str=None):
+        self._exit_statuses[job.job_id] = exit_status
+        self._notify_exited(job.job_id, exit_status, failure, usage)
+
+    @staticmethod
+    async def _start_process(job_spec: JobSpec)->asyncio.subprocess.Process:
+        """
+        Raises OSError if the log can't be opened or the process can't be started
+        """
+        with open_log(job_spec) as stdout_f:
+            return await asyncio.create_subprocess_exec(
+                job_spec.command, *job_spec.args,
+                cwd=job_spec.work_dir,
+                stdout=stdout_f,
+                stderr=subprocess.STDOUT if stdout_f else None,
+                close_fds=True
+            )
+
+    async def _run_job(self, job: Job):
+        start_time = time.time()
+        usage = None
+        failure = None
+        try:
+            process = await self._start_process(job.spec)
+        except OSError as e:
+            exit_status = 1
+            failure = start_failure(job, e)
+        else:
+            self._processes[job.job_id] = process
+            exit_status = await process.wait()
+            del self._processes[job.job_id]
+            rusage = self._watcher.pop_usage(process.pid) if self._watcher else None
+            usage = rusage_usage(start_time, time.time(), rusage, max_rss=False)
+
+        self._free_cores += self._job_cores(job)
+        self._set_exited(job, exit_status, usage, failure)
+        self._dispatch()
+
+    def _cancel(self, job: Job):
+        process = self._processes.get(job.job_id)
+        if process is not None:
+            terminate_process(process)
+        elif job in self._pending_jobs:
+            self._pending_jobs.remove(job)
+            self._set_exited(job, None)
+
+    def _stop(self):
+        self._pending_jobs.clear()
+        for process in self._processes.values():
+            terminate_process(process)
+        if not self._tasks:
+            self._loop.stop()
+            return
+        # Let terminated processes be reaped before the loop is closed
+        finished = asyncio.gather(*self._tasks, return_exceptions=True)
+        finished.add_done_callback(lambda _: self._loop.stop())
@@ -1,32 +1,211 @@
+import heapq
 import logging
+import queue
 import time
 from abc import ABCMeta, abstractmethod
 from collections import deque
+from itertools import count
 from math import inf
-from typing import Dict, Optional
+from typing import Dict, Optional, List, Tuple, Iterable, Iterator, Deque, Callable
 
-from scheduler.executor.util import print_job_error, write_time, read_status, write_status, print_job_ok
-from scheduler.job import Job, JobSpec
+from scheduler.executor.admission import create_policy, job_slots
+from scheduler.executor.bundle import Bundler
+from scheduler.executor.checkpoint import Checkpoint, CheckpointJobs, job_key
+from scheduler.executor.retry import RetryPolicy, REQUEUE_FRONT, FAILURE_SUBMIT, classify
+from scheduler.executor.submitter import TokenBucket, SubmitPool, SubmitStats
+from scheduler.executor.util import print_job_error, print_job_ok
+from scheduler.executor.writer import ResultWriter
+from scheduler.job import Job, JobSpec, BatchLayout, Attempt, ResourceUsage
+from scheduler.metrics import Summary, BatchStats, MetricsExporter, Profiler
+from scheduler.store import ResultStore, FileStore, STATUS_OK, STATUS_ERROR
 
 logger = logging.getLogger(__name__)
 
+# Exit reported by the backend: job id, exit status, failure, when it was reported and resource usage
+ExitEvent = Tuple[object, Optional[int], Optional[str], float, Optional[ResourceUsage]]
+
+
+def _format_optional(value: Optional[float], format: str)->str:
+    return 'unknown' if value is None else format.format(value)
+
+
+class HarvestStats:
+    """
+    Counters of status harvesting: sweeps, backend calls and sweep latency
+    """
+    def __init__(self):
+        self.sweeps = 0
+        self.calls = 0
+        self.total_time = 0.0
+        self.last_time = 0.0
+        self.max_time = 0.0
+
+    def record(self, calls: int, seconds: float):
+        self.sweeps += 1
+        self.calls += calls
+        self.total_time += seconds
+        self.last_time = seconds
+        self.max_time = max(self.max_time, seconds)
+
+    def __str__(self):
+        return '{sweeps} sweeps, {calls} calls, avg {avg:.1f} ms, max {max:.1f} ms per sweep'.format(
+            sweeps=self.sweeps,
+            calls=self.calls,
+            avg=1000 * self.total_time / (self.sweeps or 1),
+            max=1000 * self.max_time,
+        )
+
+
+class SubmissionError(Exception):
+    """
+    Raised by executors when a job could not be submitted, the job fails
+    with FAILURE_SUBMIT and may be retried
+    """
+    pass
+
+
+class JobGroup:
+    """
+    Jobs queued by one queue_all() call. From wait_for_jobs() on_job_done(job_spec, ok, skipped)
+    is called for every job once it has finished or was skipped as already done, on_done(group)
+    once all of them have.
+    """
+    __slots__ = ('on_done', 'on_job_done', 'pending', 'failed', 'skipped', 'exhausted')
+
+    def __init__(self, on_done: Callable[['JobGroup'], None]=None,
+                 on_job_done: Callable[[JobSpec, bool, bool], None]=None):
+        self.on_done = on_done
+        self.on_job_done = on_job_done
+        # Jobs pulled from the source, queued or active
+        self.pending = 0
+        self.failed = 0
+        self.skipped = 0
+        self.exhausted = False
+
+    def _job_skipped(self, job_spec: JobSpec):
+        self.skipped += 1
+        if self.on_job_done:
+            self.on_job_done(job_spec, True, True)
+
+    def _job_finished(self, job_spec: JobSpec, ok: bool):
+        self.pending -= 1
+        if not ok:
+            self.failed += 1
+        if self.on_job_done:
+            self.on_job_done(job_spec, ok, False)
+        self._check_done()
+
+    def _check_done(self):
+        if self.on_done and self.exhausted and not self.pending:
+            self.on_done(self)
+
 
 class Executor(metaclass=ABCMeta):
-    JOB_STATUS_OK = 'ok'
-    JOB_STATUS_ERROR = 'error'
+    JOB_STATUS_OK = STATUS_OK
+    JOB_STATUS_ERROR = STATUS_ERROR
+
+    # Bounds (in seconds) of the adaptive poll interval used
+    # for executors which can not notify about finished jobs
+    MIN_POLL_INTERVAL = 0.05
+    MAX_POLL_INTERVAL = 1
+
+    # Jobs submitted per loop iteration, so finished jobs are handled
+    # while a long stream of queued jobs is being read and submitted
+    MAX_SUBMIT_CHUNK = 1000
 
     class JobStatus:
-        def __init__(self, has_exited: bool, exit_status: Optional[int], job: Job):
+        __slots__ = ('job', 'has_exited', 'exit_status', 'failure', 'usage')
+
+        def __init__(self, has_exited: bool, exit_status: Optional[int], job: Job, failure: str=None,
+                     usage: ResourceUsage=None):
             self.job = job
             self.has_exited = has_exited
             self.exit_status = exit_status
+            # One of retry.FAILURES when known better than from exit_status
+            self.failure = failure
+            self.usage = usage
 
-    def __init__(self, stop_on_first_error: bool=False, max_jobs: int=None, skip_already_done=False):
+    def __init__(self, stop_on_first_error: bool=False, max_jobs: int=None, skip_already_done=False,
+                 store: ResultStore=None, max_slots: int=None, admission: str='fifo',
+                 retry: RetryPolicy=None, submit_rate: float=None, submit_burst: int=None,
+                 submit_workers: int=0, metrics: MetricsExporter=None, profiler: Profiler=None,
+                 bundler: Bundler=None, checkpoint: Checkpoint=None):
+        self._store = store or FileStore()
+        self._writer = ResultWriter(self._store)
+        self._writer.start()
+        # Already done jobs with their fingerprints by status dir of their batch, preloaded with preload_done()
+        self._done_jobs = dict()  # type: Dict[str, Dict[str, Optional[str]]]
+        self.skipped_jobs = 0
         self._active_jobs = dict()  # type: Dict[int, Job]
         self._stop_on_first_error = stop_on_first_error
         self._queued_jobs = deque()
+        # Lazy sources of queued jobs with the time they were queued
+        self._job_sources = deque()  # type: Deque[Tuple[Iterator[JobSpec], Optional[JobGroup], float]]
+        # When jobs pulled to _queued_jobs were queued, for queue to submit latency
+        self._queue_times = dict()  # type: Dict[JobSpec, float]
+        # Groups of pulled jobs which were queued with on_done
+        self._job_groups = dict()  # type: Dict[JobSpec, JobGroup]
         self._max_jobs = max_jobs or inf
+        self._max_slots = max_slots or inf
+        self._active_slots = 0
+        self._admission = create_policy(admission, max_slots)
+        # Set when the last submission stopped only because of MAX_SUBMIT_CHUNK
+        self._submit_saturated = False
         self._skip_alreagy_done = skip_already_done
+        self._exited_jobs = queue.Queue()  # type: queue.Queue
+        self._retry = retry or RetryPolicy()
+        # Failed jobs waiting for their retry: (resubmit time, sequence number, job spec)
+        self._retry_waiting = []  # type: List[Tuple[float, int, JobSpec]]
+        self._retry_sequence = count()
+        # Failed attempts of jobs waiting for their retry
+        self._attempts = dict()  # type: Dict[JobSpec, List[Attempt]]
+        # Jobs which submission failed in the last _submit_new_jobs()
+        self._submit_failures = []  # type: List[Job]
+        # Set when a job failed for good in the current wait_for_jobs()
+        self._failed = False
+        self._rate_limiter = TokenBucket(submit_rate, submit_burst) if submit_rate else None
+        # Set when queued jobs were held back only by the rate limiter
+        self._rate_limited = False
+        # Submission runs in worker threads when there are any, concurrently with harvesting
+        self._pool = None
+        if submit_workers:
+            self._pool = SubmitPool(self._submit_many, self._notify_submitted, submit_workers)
+        # Jobs handed to the pool and not yet registered as submitted
+        self._in_flight = 0
+        # Groups of submitted jobs waiting to be registered: (jobs, seconds spent submitting)
+        self._submitted = queue.Queue()  # type: queue.Queue
+        # Exits reported by the backend before their job was registered, by job id
+        self._early_exits = dict()  # type: Dict[object, tuple]
+        self._poll_interval = self.MIN_POLL_INTERVAL
+        self.harvest_stats = HarvestStats()
+        self.submit_stats = SubmitStats()
+        self.exits = 0
+        # Time from the exit of a job to it being handled, for exits the backend told the time of
+        self.exit_detection = Summary()
+        # By status directory of the batch, which tells apart batches of the same name of daemon clients
+        self._batch_stats = dict()  # type: Dict[str, BatchStats]
+        self._metrics = metrics
+        self._profiler = profiler
+        # Queued jobs are packed into bundles submitted as one job each when set
+        self._bundler = bundler
+        # Functions passed to call_soon() from other threads
+        self._callbacks = queue.Queue()  # type: queue.Queue
+        # Submissions and exits of jobs are logged to it when set, see resume()
+        self._checkpoint = checkpoint
+        # Active jobs of a previous run to be reattached once they are queued again
+        self._reattach = dict()  # type: CheckpointJobs
+        self._reattach_ids = set()
+        # Exits of those jobs reaped before they were queued again, by job id
+        self._reattach_exits = dict()  # type: Dict[object, tuple]
+        self.reattached_jobs = 0
+
+    @property
+    def max_jobs(self)->float:
+        return self._max_jobs
+
+    @property
+    def max_slots(self)->float:
+        return self._max_slots
 
     @abstractmethod
     def _job_status(self, job: Job)->JobStatus:
@@ -38,67 +217,619 @@ class Executor(metaclass=ABCMeta):
 
     @abstractmethod
     def shutdown(self):
-        pass
+        """
+        Executors stop their backend and call super().shutdown()
+        """
+        self._stop_submitting()
+        logger.info('Submission: {}'.format(self.submit_stats))
+        if self._bundler:
+            self._bundler.close()
+        if self._checkpoint:
+            self._checkpoint.close()
+        if self._metrics:
+            self._export_metrics()
+        if self._profiler:
+            self._profiler.close()
+        self._writer.close()
+        self._store.close()
 
     @abstractmethod
     def _submit(self, job_spec: JobSpec)->Job:
         pass
 
+    @property
+    def contact(self)->Optional[str]:
+        """
+        Identifies the backend session for reattaching to its jobs, None if executor can't
+        """
+        return None
+
+    def _reattach_job(self, job_id)->bool:
+        """
+        Starts tracking a job submitted by a previous run, False if the backend does not know it
+        """
+        return False
+
+    def resume(self, jobs: CheckpointJobs)->CheckpointJobs:
+        """
+        Starts tracking jobs left active by a previous run (see Checkpoint.load()) and returns
+        those the backend still knows. They are reattached when they are queued again instead
+        of being submitted, the others are submitted as usual.
+        """
+        self._reattach = dict()
+        for key, (job_id, start_time) in jobs.items():
+            if self._reattach_job(job_id):
+                self._reattach[key] = (job_id, start_time)
+            else:
+                logger.warning('Job {batch}/{name} (id: {id}) of the previous run is unknown, '
+                               'it is submitted again'.format(batch=key[0], name=key[1], id=job_id))
+        self._reattach_ids = {job_id for job_id, _ in self._reattach.values()}
+        return dict(self._reattach)
+
+    def _reattached(self, job_spec: JobSpec)->bool:
+        entry = job_spec.layout and self._reattach.pop(job_key(job_spec), None)
+        if not entry:
+            return False
+        job_id, start_time = entry
+        self._reattach_ids.discard(job_id)
+        job = Job(spec=job_spec, job_id=job_id, start_time=start_time)
+        self._active_jobs[job_id] = job
+        self._active_slots += job_slots(job_spec)
+        self.reattached_jobs += 1
+        logger.info('Reattached job {name} (id: {id})'.format(name=job_spec.name, id=job_id))
+        exit = self._reattach_exits.pop(job_id, None)
+        if exit is not None:
+            self._exited_jobs.put((job_id,) + exit)
+        return True
+
+    def _forget_job(self, job: Job):
+        """
+        Called once job's exit is handled, executors drop their per-job state here
+        """
+        pass
+
+    def _notifies_exit(self)->bool:
+        """
+        Executors reporting finished jobs through _notify_exited()
+        return True, the others are polled with _job_status()
+        """
+        return False
+
+    def _notify_exited(self, job_id, exit_status: Optional[int], failure: str=None, usage: ResourceUsage=None):
+        """
+        Thread-safe: may be called from executor's worker threads
+        """
+        self._exited_jobs.put((job_id, exit_status, failure, time.time(), usage))
+
+    def _unknown_exit(self, job_id, exit_status: Optional[int], failure: Optional[str], exit_time: float,
+                      usage: Optional[ResourceUsage]):
+        """
+        Exit of a job which is not active: it is handled once the job is registered if it
+        was reaped before a submission worker handed it over (see _add_submitted()), or
+        once it is queued again if it is a job of a previous run (see _reattached())
+        """
+        if job_id in self._reattach_ids:
+            self._reattach_exits[job_id] = (exit_status, failure, exit_time, usage)
+        elif self._in_flight:
+            self._early_exits[job_id] = (exit_status, failure, exit_time, usage)
+        else:
+            logger.debug('Exit of unknown job {} ignored'.format(job_id))
+
+    def _notify_submitted(self, jobs: List[Job], seconds: float):
+        """
+        Called from submission workers
+        """
+        submit_time = time.time()
+        for job in jobs:
+            job.start_time = submit_time
+        self._submitted.put((jobs, seconds))
+        if self._notifies_exit():
+            # Wakes up wait_for_jobs() waiting for exits
+            self._exited_jobs.put(None)
+
+    def call_soon(self, callback: Callable[[], None]):
+        """
+        Thread-safe: callback is called from the thread running wait_for_jobs(), or by
+        the next one if none is running. Callbacks may queue jobs, e.g. from other threads.
+        """
+        self._callbacks.put(callback)
+        if self._notifies_exit():
+            # Wakes up wait_for_jobs() waiting for exits
+            self._exited_jobs.put(None)
+
+    def _run_callbacks(self):
+        while True:
+            try:
+                callback = self._callbacks.get_nowait()
+            except queue.Empty:
+                return
+            callback()
+
+    def interrupt(self):
+        """
+        Called on KeyboardInterrupt: active jobs are cancelled, or left running
+        for a resumed run to reattach to them when there is a checkpoint
+        """
+        if self._checkpoint is None:
+            self.cancel()
+            return
+        self._stop_submitting()
+        self._checkpoint.flush()
+        logger.warning('Leaving {} jobs running, they are reattached when the run is resumed'.format(
+            len(self._active_jobs)
+        ))
+        self._writer.drain()
+
+    def _stop_submitting(self):
+        """
+        Stops submission workers, jobs they have not started to submit are dropped
+        """
+        if self._pool is None:
+            return
+        for job_spec in self._pool.stop():
+            self._in_flight -= 1
+            self._active_slots -= job_slots(job_spec)
+        self._pool = None
+        self._register_submitted()
+
     def cancel(self):
+        self._stop_submitting()
         logger.warning("Cancelling {} jobs".format(len(self._active_jobs)))
         for job in self._active_jobs.values():
             self._cancel_job(job)
+        self._writer.drain()
+
+    def preload_done(self, layout: BatchLayout):
+        """
+        Reads statuses of the whole batch at once, so skipping already done jobs is O(1)
+        """
+        if self._bundler:
+            self._bundler.preload(layout, self._store)
+        if not self._skip_alreagy_done:
+            return
+        start_time = time.time()
+        self._done_jobs[layout.status_dir] = done_jobs = self._store.done_jobs(layout)
+        logger.info('Batch {batch}: {n} jobs already done, status scan took {time:.3f}s'.format(
+            batch=layout.batch_name,
+            n=len(done_jobs),
+            time=time.time() - start_time,
+        ))
+
+    def _already_done(self, job_spec: JobSpec)->bool:
+        if not self._skip_alreagy_done:
+            return False
+        done_jobs = job_spec.layout and self._done_jobs.get(job_spec.layout.status_dir)
+        if done_jobs is not None and job_spec.has_layout_status_path:
+            done = job_spec.name in done_jobs
+            fingerprint = done_jobs.get(job_spec.name)
+        else:
+            done = self._store.read_status(job_spec) == self.JOB_STATUS_OK
+            fingerprint = self._store.read_fingerprint(job_spec) if done and job_spec.fingerprint else None
+        if done and job_spec.fingerprint and fingerprint != job_spec.fingerprint:
+            logger.debug("Job {name} has changed since it was done".format(name=job_spec.name))
+            return False
+        if done:
+            logger.debug("Job {name} is already done".format(name=job_spec.name))
+            self.skipped_jobs += 1
+        return done
 
     def queue(self, job_spec: JobSpec):
-        if self._skip_alreagy_done and read_status(job_spec) == self.JOB_STATUS_OK:
-            logger.info("Job {name} is already done".format(name=job_spec.name))
+        if self._already_done(job_spec) or self._reattached(job_spec):
             return
+        self._queue_times[job_spec] = time.time()
         self._queued_jobs.append(job_spec)
 
+    def queue_all(self, job_specs: Iterable[JobSpec], on_done: Callable[[JobGroup], None]=None,
+                  on_job_done: Callable[[JobSpec, bool, bool], None]=None):
+        """
+        Queues jobs lazily: they are pulled from job_specs only when they can be submitted.
+        Callbacks (see JobGroup) may queue more jobs, they are picked up by the running wait_for_jobs().
+        """
+        group = JobGroup(on_done, on_job_done) if on_done or on_job_done else None
+        self._job_sources.append((iter(job_specs), group, time.time()))
+
+    def _fill_queue(self, size: int):
+        """
+        Pulls jobs from sources until size jobs (or bundles of consecutive jobs of a source) are queued
+        """
+        while len(self._queued_jobs) < size and self._job_sources:
+            source, group, queued_time = self._job_sources[0]
+            job_specs = []
+            for job_spec in source:
+                if self._already_done(job_spec):
+                    if group:
+                        group._job_skipped(job_spec)
+                    continue
+                if group:
+                    group.pending += 1
+                    self._job_groups[job_spec] = group
+                if self._reattach and self._reattached(job_spec):
+                    continue
+                job_specs.append(job_spec)
+                if not self._bundler or len(job_specs) >= self._bundler.size(job_specs[0]):
+                    break
+            else:
+                self._job_sources.popleft()
+                if group:
+                    group.exhausted = True
+                    group._check_done()
+            if len(job_specs) > 1:
+                job_specs = [self._bundler.create(job_specs)]
+            for job_spec in job_specs:
+                self._queue_times[job_spec] = queued_time
+                self._queued_jobs.append(job_spec)
+
+    def _has_queued(self)->bool:
+        return bool(self._queued_jobs or self._job_sources or self._retry_waiting)
+
+    def _can_submit(self)->bool:
+        return self._submit_saturated or bool(self._submit_failures) or not self._submitted.empty()
+
+    def _submit_many(self, job_specs: List[JobSpec])->List[Job]:
+        """
+        Submits all given jobs, executors able to submit
+        several jobs at once override it. Jobs which could not be
+        submitted are returned without job_id.
+        """
+        jobs = []
+        for job_spec in job_specs:
+            try:
+                jobs.append(self._submit(job_spec))
+            except SubmissionError as e:
+                logger.error('Unable to submit job {name}: {e}'.format(name=job_spec.name, e=e))
+                jobs.append(Job(spec=job_spec))
+        return jobs
+
+    def _submit_groups(self, job_specs: List[JobSpec])->Iterable[List[JobSpec]]:
+        """
+        Splits jobs into groups passed to _submit_many() by submission workers,
+        executors submitting several jobs at once keep those together
+        """
+        return ([job_spec] for job_spec in job_specs)
+
+    def _requeue_due_retries(self):
+        now = time.time()
+        while self._retry_waiting and self._retry_waiting[0][0] <= now:
+            job_spec = heapq.heappop(self._retry_waiting)[2]
+            if self._retry.requeue == REQUEUE_FRONT:
+                self._queue_times[job_spec] = now
+                self._queued_jobs.appendleft(job_spec)
+            else:
+                # Behind every job still to be read from sources
+                self._job_sources.append((iter([job_spec]), None, now))
+
     def _submit_new_jobs(self):
-        can_take = self._max_jobs - len(self._active_jobs)
-        to_submit_count = min(can_take, len(self._queued_jobs))
-        to_submit = (
-            self._queued_jobs.popleft()
-            for _ in range(to_submit_count)
+        self._register_submitted()
+        self._requeue_due_retries()
+        # Jobs handed to submission workers count as active
+        can_take = min(self._max_jobs - len(self._active_jobs), self.MAX_SUBMIT_CHUNK) - self._in_flight
+        self._rate_limited = False
+        if self._rate_limiter:
+            tokens = self._rate_limiter.available()
+            if tokens < can_take:
+                can_take = tokens
+                self._rate_limited = self._has_queued()
+        self._fill_queue(max(can_take, self._admission.WINDOW))
+        to_submit = self._admission.select(
+            self._queued_jobs,
+            max_count=can_take,
+            free_slots=self._max_slots - self._active_slots,
         )
-        for job_spec in to_submit:
-            job = self._submit(job_spec)
+        self._submit_saturated = self._pool is None and len(to_submit) == self.MAX_SUBMIT_CHUNK
+        if not to_submit:
+            return
+        if self._rate_limiter:
+            self._rate_limiter.take(len(to_submit))
+        # Slots are taken once jobs are chosen, so workers never overcommit them
+        self._active_slots += sum(job_slots(job_spec) for job_spec in to_submit)
+        if self._pool is not None:
+            self._in_flight += len(to_submit)
+            for job_specs in self._submit_groups(to_submit):
+                self._pool.put(job_specs)
+            return
+
+        start_time = time.time()
+        jobs = self._submit_many(to_submit)
+        seconds = time.time() - start_time
+        for job in jobs:
+            job.start_time = start_time + seconds
+        self._add_submitted(jobs, seconds)
+
+    def _register_submitted(self):
+        """
+        Adds jobs submitted by workers since the last call to active ones
+        """
+        while True:
+            try:
+                jobs, seconds = self._submitted.get_nowait()
+            except queue.Empty:
+                break
+            self._in_flight -= len(jobs)
+            self._add_submitted(jobs, seconds)
+        if not self._in_flight:
+            self._early_exits.clear()
+
+    def _add_submitted(self, jobs: List[Job], seconds: float):
+        self.submit_stats.record_call(len(jobs), seconds)
+        for job in jobs:
+            job.attempts = self._attempts.pop(job.spec, None)
+            queued_time = self._queue_times.pop(job.spec, None)
+            if job.job_id is None:
+                self._active_slots -= job_slots(job.spec)
+                self._submit_failures.append(job)
+                continue
+            if queued_time is not None:
+                self.submit_stats.record_job(job.start_time - queued_time)
             self._active_jobs[job.job_id] = job
-            job.start_time = time.time()
+            if self._checkpoint and job.spec.layout:
+                self._checkpoint.submitted(job)
             logger.info("Submitted job {name} (id: {id})".format(
                 id=job.job_id,
-                name=job_spec.name,
+                name=job.spec.name,
             ))
+            early_exit = self._early_exits.pop(job.job_id, None)
+            if early_exit is not None:
+                self._exited_jobs.put((job.job_id,) + early_exit)
+
+    def _wait_notified(self, block: bool=True, timeout: float=MAX_POLL_INTERVAL
+                       )->List[ExitEvent]:
+        # Timeout keeps the main thread responsive to KeyboardInterrupt
+        try:
+            exited = [self._exited_jobs.get(block=block, timeout=timeout)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                exited.append(self._exited_jobs.get_nowait())
+            except queue.Empty:
+                # None only wakes up the wait, see _notify_submitted()
+                return [item for item in exited if item is not None]
+
+    def _exit_time(self, reported_time: float, usage: Optional[ResourceUsage])->Optional[float]:
+        """
+        When the job exited as told by the backend: the end time of its usage, or the
+        time a notifying executor reported the exit. Exits found by polling are reported
+        at the sweep that found them, so their time is unknown.
+        """
+        if usage is not None and usage.end_time is not None:
+            return usage.end_time
+        if self._notifies_exit():
+            return reported_time
+        return None
+
+    def _harvest(self)->List[JobStatus]:
+        """
+        One sweep over active jobs returning statuses of exited ones.
+        Executors able to query many jobs at once override it.
+        """
+        start_time = time.time()
+        statuses = [
+            self._job_status(job)
+            for job in list(self._active_jobs.values())
+        ]
+        self.harvest_stats.record(len(statuses), time.time() - start_time)
+        return [
+            status
+            for status in statuses
+            if status.has_exited
+        ]
+
+    def _poll_exited(self, max_sleep: float=MAX_POLL_INTERVAL)->List[ExitEvent]:
+        now = time.time()
+        exited = [
+            (status.job.job_id, status.exit_status, status.failure, now, status.usage)
+            for status in self._harvest()
+        ]
+
+        if exited:
+            self._poll_interval = self.MIN_POLL_INTERVAL
+        else:
+            time.sleep(min(self._poll_interval, max_sleep))
+            self._poll_interval = min(self._poll_interval * 2, self.MAX_POLL_INTERVAL)
+        return exited
+
+    def _collect_exited(self)->List[ExitEvent]:
+        # Don't wait for exits while there are more jobs to submit
+        block = not self._can_submit()
+        timeout = self.MAX_POLL_INTERVAL
+        if self._rate_limited:
+            timeout = min(timeout, self._rate_limiter.delay())
+        if self._notifies_exit():
+            return self._wait_notified(block, timeout)
+        # Early exits of jobs registered since the last sweep, see _add_submitted()
+        exited = self._wait_notified(block=False)
+        if exited or not block:
+            return exited
+        return self._poll_exited(timeout)
+
+    def _retry_job(self, job: Job, exit_status: Optional[int], failure: str):
+        attempt = Attempt(
+            job_id=job.job_id,
+            failure=failure,
+            exit_status=exit_status,
+            start_time=job.start_time,
+            end_time=job.end_time,
+        )
+        self._attempts[job.spec] = (job.attempts or []) + [attempt]
+        delay = self._retry.delay(job.attempt)
+        logger.warning('Job {name} (id: {id}) failed ({failure}, exit status {status}), '
+                       'attempt {attempt} of {max_attempts}, retrying in {delay:.0f}s'.format(
+                           name=job.spec.name,
+                           id=job.job_id,
+                           failure=failure,
+                           status=exit_status,
+                           attempt=job.attempt,
+                           max_attempts=job.spec.max_attempts or self._retry.max_attempts,
+                           delay=delay,
+                       ))
+        self._writer.submit(self._store.write_attempt, job, attempt)
+        heapq.heappush(self._retry_waiting, (time.time() + delay, next(self._retry_sequence), job.spec))
+
+    def _job_exited(self, job: Job, exit_status: Optional[int], failure: Optional[str])->bool:
+        """
+        Records the result of an exited job, returns False if the run should stop
+        """
+        if job.end_time is None:
+            job.end_time = time.time()
+        batch = job.spec.layout.status_dir if job.spec.layout else ''
+        stats = self._batch_stats.get(batch)
+        if stats is None:
+            stats = self._batch_stats[batch] = BatchStats()
+        stats.record(job)
+        if exit_status != 0:
+            failure = failure or classify(exit_status)
+            if self._retry.should_retry(job, failure, exit_status):
+                stats.retried += 1
+                self._retry_job(job, exit_status, failure)
+                return True
+
+        group = self._job_groups.pop(job.spec, None)
+        if exit_status == 0:
+            stats.ok += 1
+            print_job_ok(job)
+            self._writer.submit(self._store.write_result, job, self.JOB_STATUS_OK, exit_status)
+            if group:
+                group._job_finished(job.spec, True)
+            return True
+
+        stats.failed += 1
+        print_job_error(job)
+        self._writer.submit(self._store.write_result, job, self.JOB_STATUS_ERROR, exit_status)
+        self._failed = True
+        if self._stop_on_first_error:
+            return False
+        if group:
+            group._job_finished(job.spec, False)
+        return True
+
+    def _slot_capacity(self)->float:
+        """
+        Slots jobs may take at once, executors with a known size of their own override it
+        """
+        return self._max_slots
+
+    def metrics(self)->Dict[str, float]:
+        """
+        Current values of metrics.METRICS
+        """
+        return {
+            'queued_jobs': len(self._queued_jobs),
+            'retry_waiting_jobs': len(self._retry_waiting),
+            'submitting_jobs': self._in_flight,
+            'active_jobs': len(self._active_jobs),
+            'active_slots': self._active_slots,
+            'submitted_jobs_total': self.submit_stats.submitted,
+            'submit_seconds_total': self.submit_stats.submit_time,
+            'submit_latency_seconds_sum': self.submit_stats.total_latency,
+            'submit_latency_seconds_max': self.submit_stats.max_latency,
+            'harvest_sweeps_total': self.harvest_stats.sweeps,
+            'harvest_calls_total': self.harvest_stats.calls,
+            'harvest_seconds_total': self.harvest_stats.total_time,
+            'harvest_seconds_last': self.harvest_stats.last_time,
+            'exits_total': self.exits,
+            'exit_detection_seconds_count': self.exit_detection.count,
+            'exit_detection_seconds_sum': self.exit_detection.total,
+            'exit_detection_seconds_max': self.exit_detection.max,
+            'skipped_jobs_total': self.skipped_jobs,
+        }
+
+    def batch_metrics(self)->Dict[str, Dict[str, float]]:
+        """
+        Current values of metrics.BATCH_METRICS by status directory of the batch
+        """
+        capacity = self._slot_capacity()
+        return {
+            batch: {
+                'batch_ok_jobs_total': stats.ok,
+                'batch_failed_jobs_total': stats.failed,
+                'batch_retried_jobs_total': stats.retried,
+                'batch_makespan_seconds': stats.makespan,
+                'batch_busy_slot_seconds_total': stats.busy,
+                'batch_utilization': stats.utilization(capacity),
+                'batch_queue_wait_seconds_sum': stats.queue_wait.total,
+                'batch_queue_wait_seconds_max': stats.queue_wait.max,
+                'batch_cpu_seconds_total': stats.cpu_time,
+                'batch_cpu_efficiency': stats.cpu_efficiency,
+                'batch_max_rss_bytes': stats.max_rss,
+            }
+            for batch, stats in self._batch_stats.items()
+        }
+
+    def finish_batch(self, layout: BatchLayout):
+        """
+        Logs and stores the resource usage summary of a batch once all its jobs are done
+        """
+        stats = self._batch_stats.get(layout.status_dir)
+        if stats is None:
+            return
+        summary = stats.summary(self._slot_capacity())
+        self._writer.submit(self._store.write_batch_usage, layout, summary)
+        logger.info('Batch {batch}: queue wait avg {queue_wait}, {cpu:.1f} CPU seconds, '
+                    'CPU efficiency {efficiency}, max RSS {rss} ({rss_job})'.format(
+                        batch=layout.batch_name,
+                        queue_wait=_format_optional(summary['queue_wait_avg'], '{:.1f}s'),
+                        cpu=summary['cpu_time'],
+                        efficiency=_format_optional(summary['cpu_efficiency'], '{:.0%}'),
+                        rss=_format_optional(summary['max_rss'] and summary['max_rss'] / 2 ** 20, '{:.0f} MiB'),
+                        rss_job=summary['max_rss_job'],
+                    ))
+
+    def _export_metrics(self):
+        # Snapshot is taken here, the writer thread only formats and writes it
+        self._writer.submit(self._metrics.write, self.metrics(), self.batch_metrics())
 
-    # TODO: move drmaa not specific code to base
     def wait_for_jobs(self):
-        status_ok = True
+        if self._profiler is None:
+            return self._wait_for_jobs()
+        with self._profiler:
+            return self._wait_for_jobs()
+
+    # TODO: move drmaa not specific code to base
+    def _wait_for_jobs(self):
+        self._failed = False
         while True:
+            if self._metrics and self._metrics.due():
+                self._export_metrics()
+            self._run_callbacks()
             self._submit_new_jobs()
+            if self._checkpoint:
+                self._checkpoint.flush()
+            if not self._active_jobs and not self._has_queued() and not self._submit_failures \
+                    and not self._in_flight:
+                break
 
-            for job_id, job in list(self._active_jobs.items()):
-                status = self._job_status(job)
-                if not status.has_exited:
+            exited = []
+            exits = self._collect_exited()
+            now = time.time()
+            for job_id, exit_status, failure, exit_time, usage in exits:
+                job = self._active_jobs.pop(job_id, None)
+                if job is None:
+                    self._unknown_exit(job_id, exit_status, failure, exit_time, usage)
                     continue
-                del self._active_jobs[job_id]
-
-                job.end_time = time.time()
-                if status.exit_status == 0:
-                    print_job_ok(job)
-                    write_status(job, self.JOB_STATUS_OK)
-                    write_time(job)
-                else:
-                    print_job_error(job)
-                    write_status(job, self.JOB_STATUS_ERROR)
-                    if self._stop_on_first_error:
-                        return False
-                    else:
-                        status_ok = False
-                logger.info('{} jobs left'.format(
-                    len(self._active_jobs) + len(self._queued_jobs)
+                self.exits += 1
+                end_time = self._exit_time(exit_time, usage)
+                if end_time is not None:
+                    self.exit_detection.observe(max(now - end_time, 0.0))
+                if self._checkpoint and job.spec.layout:
+                    self._checkpoint.exited(job)
+                job.end_time = exit_time
+                job.usage = usage
+                self._forget_job(job)
+                self._active_slots -= job_slots(job.spec)
+                exited.append((job, exit_status, failure))
+            exited.extend(
+                (job, None, FAILURE_SUBMIT)
+                for job in self._submit_failures
+            )
+            self._submit_failures = []
+            if self._bundler:
+                exited = self._bundler.expand(exited)
+
+            for job, exit_status, failure in exited:
+                if not self._job_exited(job, exit_status, failure):
+                    return False
+                logger.info('{}{} jobs left'.format(
+                    len(self._active_jobs) + self._in_flight + len(self._queued_jobs) + len(self._retry_waiting),
+                    '+' if self._job_sources else '',
                 ))
-            if not self._active_jobs:
-                break
-            time.sleep(1)
-        return status_ok
+        return not self._failed
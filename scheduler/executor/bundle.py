@@ -0,0 +1,157 @@
+import logging
+import sys
+import tempfile
+from os import makedirs, remove, close
+from os.path import abspath, getsize
+from typing import Dict, List, Tuple, Optional
+
+from scheduler.executor import bundle_runner
+from scheduler.executor.retry import FAILURE_ABORTED, FAILURE_ERROR
+from scheduler.job import Job, JobSpec, BatchLayout, ResourceUsage
+from scheduler.store import ResultStore
+
+logger = logging.getLogger(__name__)
+
+# Exit of a job: the job, its exit status and failure (see retry.FAILURES)
+JobExit = Tuple[Job, Optional[int], Optional[str]]
+
+
+def _batch_name(job_spec: JobSpec)->str:
+    return job_spec.layout.batch_name if job_spec.layout else ''
+
+
+class Bundler:
+    """
+    Packs consecutive jobs of a batch into bundles, each submitted as one job running
+    bundle_runner. Bundles have a fixed size, or with runtime one chosen so a bundle runs
+    for about runtime seconds given the mean runtime of the batch's jobs: of the jobs
+    finished so far, else of their previous runs, else size is used.
+    A bundle gets slots slots (at least those of its largest job) and runs its
+    jobs in parallel as long as their slots fit into them.
+    """
+    DEFAULT_SIZE = 10
+    MAX_SIZE = 1000
+
+    def __init__(self, directory: str='.scheduler', size: int=None, runtime: float=None, slots: int=None):
+        if size is not None and size < 1:
+            raise ValueError('Invalid bundle size: {}'.format(size))
+        if runtime is not None and runtime <= 0:
+            raise ValueError('Invalid bundle runtime: {}'.format(runtime))
+        # Index files must be readable from the nodes, so it should be on a shared filesystem
+        self._directory = abspath(directory)
+        self._size = size or self.DEFAULT_SIZE
+        self._runtime = runtime
+        self._slots = slots or 1
+        # Index file and jobs of every bundle which has not exited yet
+        self._bundles = dict()  # type: Dict[JobSpec, Tuple[str, List[JobSpec]]]
+        self._index_paths = []  # type: List[str]
+        # Sum and number of runtimes of jobs by batch
+        self._runtimes = dict()  # type: Dict[str, Tuple[float, int]]
+
+    def _observe(self, batch: str, runtime: float, count: int=1):
+        total, n = self._runtimes.get(batch, (0.0, 0))
+        self._runtimes[batch] = (total + runtime, n + count)
+
+    def preload(self, layout: BatchLayout, store: ResultStore):
+        """
+        Seeds runtimes of the batch's jobs with those of their previous runs
+        """
+        if self._runtime is None:
+            return
+        runtimes = store.runtimes(layout)
+        if runtimes:
+            self._observe(layout.batch_name, sum(runtimes.values()), len(runtimes))
+
+    def size(self, job_spec: JobSpec)->int:
+        """
+        Number of jobs to bundle starting from job_spec
+        """
+        if self._runtime is None:
+            return self._size
+        total, count = self._runtimes.get(_batch_name(job_spec), (0.0, 0))
+        if not count:
+            return self._size
+        mean = max(total / count, 0.001)
+        parallel = max(self._slots // (job_spec.num_slots or 1), 1)
+        return min(max(int(self._runtime * parallel / mean), 1), self.MAX_SIZE)
+
+    def create(self, job_specs: List[JobSpec])->JobSpec:
+        makedirs(self._directory, exist_ok=True)
+        fd, index_path = tempfile.mkstemp(prefix='bundle.', suffix='.json', dir=self._directory)
+        close(fd)
+        slots = max([self._slots] + [job_spec.num_slots or 1 for job_spec in job_specs])
+        bundle_runner.write_index(index_path, slots, [
+            {
+                'command': job_spec.command,
+                'args': job_spec.args,
+                'work_dir': job_spec.work_dir and abspath(job_spec.work_dir),
+                'log_path': job_spec.log_path and abspath(job_spec.log_path),
+                'num_slots': job_spec.num_slots or 1,
+            }
+            for job_spec in job_specs
+        ])
+        self._index_paths.append(index_path)
+        first = job_specs[0]
+        bundle = JobSpec(
+            command=sys.executable,
+            name='{}+{}'.format(first.name, len(job_specs) - 1),
+            args=['-m', bundle_runner.__name__, index_path],
+            work_dir=first.work_dir,
+            num_slots=slots,
+            log_path=index_path + '.log',
+        )
+        self._bundles[bundle] = (index_path, job_specs)
+        logger.debug('Bundled {n} jobs starting from {name}'.format(n=len(job_specs), name=first.name))
+        return bundle
+
+    def expand(self, exits: List[JobExit])->List[JobExit]:
+        """
+        Replaces exits of bundles with exits of their jobs, jobs without a result
+        did not run or were killed with the bundle and fail like it
+        """
+        expanded = []
+        for job, exit_status, failure in exits:
+            bundle = self._bundles.pop(job.spec, None)
+            if bundle is None:
+                expanded.append((job, exit_status, failure))
+                continue
+            index_path, job_specs = bundle
+            results = bundle_runner.read_results(index_path)
+            for i, job_spec in enumerate(job_specs):
+                sub_job = Job(
+                    spec=job_spec,
+                    job_id='{}.{}'.format(job.job_id, i + 1),
+                    start_time=job.start_time,
+                    end_time=job.end_time,
+                )
+                result = results.get(i)
+                if result is None:
+                    expanded.append((
+                        sub_job,
+                        exit_status or None,
+                        failure or (FAILURE_ERROR if exit_status == 0 else FAILURE_ABORTED),
+                    ))
+                    continue
+                if result['usage']:
+                    sub_job.usage = ResourceUsage(**result['usage'])
+                    sub_job.end_time = sub_job.usage.end_time
+                if result['exit_status'] == 0:
+                    self._observe(_batch_name(job_spec), sub_job.run_time)
+                expanded.append((sub_job, result['exit_status'], None))
+        return expanded
+
+    def close(self):
+        """
+        Removes index and result files, bundle logs only when empty
+        """
+        for index_path in self._index_paths:
+            for path in (index_path, bundle_runner.results_path(index_path), index_path + '.log'):
+                try:
+                    if path.endswith('.log') and getsize(path):
+                        continue
+                    remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.warning('Unable to remove bundle file {}: {}'.format(path, e))
+        self._index_paths = []
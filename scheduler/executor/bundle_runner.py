@@ -0,0 +1,136 @@
+"""
+Runs a bundle of jobs submitted as one job:
+
+    python -m scheduler.executor.bundle_runner <index file>
+
+The index file holds the bundle's slots and its jobs. Jobs are started in order
+while their slots fit into the bundle's ones, so a bundle of one-slot jobs given
+one slot runs them sequentially. Output of every job goes to its own log, its exit
+status and resource usage are appended to <index file>.results as one JSON line
+as soon as it exits, so results of finished jobs survive the bundle being killed.
+"""
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+from typing import List, Dict, Any
+
+from scheduler.executor.util import decode_status, rusage_usage
+
+
+def results_path(index_path: str)->str:
+    return index_path + '.results'
+
+
+def write_index(index_path: str, slots: int, jobs: List[Dict[str, Any]]):
+    with open(index_path, 'w') as f:
+        json.dump({'slots': slots, 'jobs': jobs}, f)
+
+
+def read_results(index_path: str)->Dict[int, Dict[str, Any]]:
+    """
+    Results of the bundle's jobs which have exited by their position in the bundle
+    """
+    results = dict()
+    try:
+        with open(results_path(index_path)) as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    # Last line of a bundle killed while writing it
+                    continue
+                results[result['index']] = result
+    except OSError:
+        pass
+    return results
+
+
+def _start(job: Dict[str, Any])->subprocess.Popen:
+    log_f = open(job['log_path'], 'w') if job.get('log_path') else None
+    try:
+        return subprocess.Popen(
+            args=[job['command']] + job['args'],
+            cwd=job.get('work_dir'),
+            stdout=log_f,
+            stderr=subprocess.STDOUT if log_f else None,
+            close_fds=True,
+        )
+    except OSError as e:
+        (log_f or sys.stderr).write('{}: {}\n'.format(job['command'], e))
+        raise
+    finally:
+        if log_f:
+            log_f.close()
+
+
+def main():
+    index_path = sys.argv[1]
+    with open(index_path) as f:
+        bundle = json.load(f)
+    jobs = bundle['jobs']
+    free_slots = bundle['slots']
+
+    # Processes by pid: (index, process, start time, slots)
+    running = dict()
+    stopped = []
+
+    def stop(signum, frame):
+        stopped.append(signum)
+        for _, process, _, _ in running.values():
+            try:
+                os.kill(process.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    failed = False
+    next_job = 0
+    with open(results_path(index_path), 'a') as results:
+        def write_result(index: int, exit_status: int, usage: Dict[str, Any]=None):
+            results.write(json.dumps({'index': index, 'exit_status': exit_status, 'usage': usage}) + '\n')
+            results.flush()
+
+        while running or (next_job < len(jobs) and not stopped):
+            while next_job < len(jobs) and not stopped:
+                job = jobs[next_job]
+                slots = job.get('num_slots') or 1
+                # Jobs requesting more than the bundle's slots run alone
+                if running and slots > free_slots:
+                    break
+                try:
+                    process = _start(job)
+                except OSError:
+                    failed = True
+                    write_result(next_job, 127)
+                else:
+                    running[process.pid] = (next_job, process, time.time(), slots)
+                    free_slots -= slots
+                next_job += 1
+            if not running:
+                continue
+
+            pid, status, rusage = os.wait4(-1, 0)
+            if pid not in running:
+                continue
+            index, process, start_time, slots = running.pop(pid)
+            free_slots += slots
+            exit_status = decode_status(status)
+            # Popen must not wait for the reaped process again
+            process.returncode = exit_status
+            failed = failed or exit_status != 0
+            # Resident set of a forked child includes the runner's own before exec
+            usage = rusage_usage(start_time, time.time(), rusage, max_rss=False)
+            write_result(index, exit_status, usage._asdict())
+
+    if stopped:
+        sys.exit(128 + stopped[0])
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
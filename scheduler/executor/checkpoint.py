@@ -0,0 +1,87 @@
+import json
+import logging
+import os
+from os import makedirs
+from os.path import dirname, exists
+from typing import Dict, Tuple, Optional
+
+from scheduler.job import Job, JobSpec
+
+logger = logging.getLogger(__name__)
+
+# Job of a previous run by batch and job name: its id and submission time
+CheckpointJobs = Dict[Tuple[str, str], Tuple[object, float]]
+
+
+def job_key(job_spec: JobSpec)->Tuple[str, str]:
+    return job_spec.layout.batch_name, job_spec.name
+
+
+class Checkpoint:
+    """
+    Append-only log of jobs submitted by the executor and not exited yet, with the
+    contact string of the backend session, so a restarted run can reattach to them.
+    The first line holds the contact, every next one a submission or an exit.
+    Lines are flushed once per loop of wait_for_jobs(), open() compacts the log.
+    """
+    def __init__(self, path: str):
+        self._path = path
+        self._file = None
+
+    def load(self)->Tuple[Optional[str], CheckpointJobs]:
+        """
+        Contact string and jobs left active by the previous run
+        """
+        if not exists(self._path):
+            return None, {}
+        contact = None
+        jobs = dict()
+        ids = dict()
+        with open(self._path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Last line of a run killed while writing it
+                    continue
+                if 'contact' in record:
+                    contact = record['contact']
+                elif 'submit' in record:
+                    key = (record['batch'], record['name'])
+                    jobs[key] = (record['submit'], record['time'])
+                    ids[record['submit']] = key
+                elif 'exit' in record:
+                    key = ids.pop(record['exit'], None)
+                    if key is not None and jobs.get(key, (None,))[0] == record['exit']:
+                        del jobs[key]
+        return contact, jobs
+
+    def open(self, contact: Optional[str], jobs: CheckpointJobs):
+        """
+        Starts the log with the contact of the current session and jobs still to be reattached
+        """
+        if dirname(self._path):
+            makedirs(dirname(self._path), exist_ok=True)
+        tmp_path = '{}.{}.tmp'.format(self._path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps({'contact': contact}) + '\n')
+            for (batch, name), (job_id, start_time) in jobs.items():
+                f.write(json.dumps({'submit': job_id, 'batch': batch, 'name': name, 'time': start_time}) + '\n')
+        os.replace(tmp_path, self._path)
+        self._file = open(self._path, 'a')
+
+    def submitted(self, job: Job):
+        batch, name = job_key(job.spec)
+        self._file.write(json.dumps({'submit': job.job_id, 'batch': batch, 'name': name, 'time': job.start_time}) + '\n')
+
+    def exited(self, job: Job):
+        self._file.write(json.dumps({'exit': job.job_id}) + '\n')
+
+    def flush(self):
+        if self._file:
+            self._file.flush()
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
@@ -1,48 +1,356 @@
 import logging
 import re
 import shutil
-from os import makedirs
+import sys
+import tempfile
+import time
+from itertools import groupby
+from os import makedirs, remove, close, devnull
+from os.path import abspath
+from threading import Thread, Condition, Event
+from typing import Callable, Optional, List, Tuple, Dict, Iterable
 
 import drmaa
 from drmaa.const import JobControlAction
-from drmaa.errors import InvalidJobException, InternalException
+from drmaa.errors import InvalidJobException, InternalException, DrmCommunicationException, \
+    TryLaterException, InvalidAttributeValueException
 
-from scheduler.executor.base import Executor
-from scheduler.job import Job, JobSpec
+from scheduler.executor import task_runner
+from scheduler.executor.base import Executor, HarvestStats, SubmissionError
+from scheduler.executor.retry import FAILURE_ABORTED, FAILURE_SIGNAL, FAILURE_ERROR
+from scheduler.job import Job, JobSpec, ResourceUsage
 
 logger = logging.getLogger(__name__)
 
 
+# Errors of runJob() which may go away when submission is retried
+_SUBMIT_ERRORS = (InternalException, DrmCommunicationException, TryLaterException, InvalidAttributeValueException)
+
+
+def _exit_status(res: drmaa.JobInfo)->Tuple[int, Optional[str]]:
+    """
+    Exit status and failure (see retry.FAILURES) of a reaped job,
+    failure is None when the job exited by itself
+    """
+    if res.hasExited:
+        return res.exitStatus, None
+    logger.error('Job {id} did not exit normally (aborted: {aborted}, signal: {signal})'.format(
+        id=res.jobId,
+        aborted=res.wasAborted,
+        signal=res.terminatedSignal or None,
+    ))
+    if res.wasAborted:
+        return 42, FAILURE_ABORTED
+    if res.hasSignal:
+        return 42, FAILURE_SIGNAL
+    return 42, FAILURE_ERROR
+
+
+def _number(resource_usage: Dict[str, str], key: str)->Optional[float]:
+    try:
+        return float(resource_usage[key])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _timestamp(resource_usage: Dict[str, str], key: str)->Optional[float]:
+    value = _number(resource_usage, key)
+    if not value:
+        return None
+    # Some DRMs report milliseconds since the epoch
+    return value / 1000 if value > 1e11 else value
+
+
+def _resource_usage(res: drmaa.JobInfo)->Optional[ResourceUsage]:
+    """
+    Resource usage of a reaped job from the DRM's accounting (SGE names),
+    fields the DRM does not report are None
+    """
+    resource_usage = res.resourceUsage
+    if not resource_usage:
+        return None
+    user_time = _number(resource_usage, 'ru_utime')
+    system_time = _number(resource_usage, 'ru_stime')
+    cpu_time = _number(resource_usage, 'cpu')
+    if cpu_time is None and user_time is not None and system_time is not None:
+        cpu_time = user_time + system_time
+    max_rss = _number(resource_usage, 'ru_maxrss')
+    max_vmem = _number(resource_usage, 'maxvmem')
+    read_blocks = _number(resource_usage, 'ru_inblock')
+    write_blocks = _number(resource_usage, 'ru_oublock')
+    return ResourceUsage(
+        start_time=_timestamp(resource_usage, 'start_time'),
+        end_time=_timestamp(resource_usage, 'end_time'),
+        cpu_time=cpu_time,
+        user_time=user_time,
+        system_time=system_time,
+        # Kilobytes like getrusage()
+        max_rss=None if max_rss is None else int(max_rss * 1024),
+        max_vmem=None if max_vmem is None else int(max_vmem),
+        read_blocks=None if read_blocks is None else int(read_blocks),
+        write_blocks=None if write_blocks is None else int(write_blocks),
+    )
+
+
+def _error_failure(e: Exception)->str:
+    """
+    Failure of a job wait() raised e for
+    """
+    # Dirty hack allowing to catch cancelled job in "queued" status
+    if 'code 24' in str(e):
+        return FAILURE_ABORTED
+    return FAILURE_ERROR
+
+
+def _wait_job(session: drmaa.Session, job_id: str, lost_failure: str=FAILURE_ERROR
+              )->Optional[Tuple[int, Optional[str], Optional[ResourceUsage]]]:
+    """
+    Reaps the job if it has ended: its exit status, failure and resource usage, None while it is active.
+    Jobs wait() fails for exit with 42, lost_failure is the failure of jobs unknown to the session.
+    """
+    try:
+        res = session.wait(job_id, drmaa.Session.TIMEOUT_NO_WAIT)
+    except drmaa.ExitTimeoutException:
+        # job still active
+        return None
+    except InvalidJobException as e:
+        # Reaped without being reported, e.g. by a failed wait(JOB_IDS_SESSION_ANY)
+        logger.error('Job {id} is unknown to the session: {e}'.format(id=job_id, e=e))
+        return 42, lost_failure, None
+    except Exception as e:
+        failure = _error_failure(e)
+        if failure == FAILURE_ABORTED:
+            logger.error("Cancelled job in 'queued' status: {}".format(e))
+        else:
+            logger.error('Unknown exception: {}: {}'.format(type(e), e))
+        return 42, failure, None
+    exit_status, failure = _exit_status(res)
+    return exit_status, failure, _resource_usage(res)
+
+
+class WaiterThread(Thread):
+    """
+    Blocks in session.wait(JOB_IDS_SESSION_ANY) and reports every reaped job.
+    When wait() fails it may have reaped a job without returning it, then every
+    job added and not reported yet is checked with its own wait(job_id).
+    """
+    # Finite timeout lets the thread notice stop()
+    WAIT_TIMEOUT = 5
+
+    def __init__(self, session: drmaa.Session,
+                 on_exit: Callable[[str, Optional[int], Optional[str], Optional[ResourceUsage]], None],
+                 stats: HarvestStats=None):
+        super().__init__()
+        self.setDaemon(True)
+        self._session = session
+        self._on_exit = on_exit
+        self._stats = stats or HarvestStats()
+        # Jobs added and not reaped yet
+        self._pending_jobs = set()
+        # Jobs reaped before they were added, submission is racing with us
+        self._reaped_jobs = set()
+        self._pending_cond = Condition()
+        self._stopped = Event()
+
+    def add_jobs(self, job_ids: Iterable[str]):
+        with self._pending_cond:
+            for job_id in job_ids:
+                if job_id in self._reaped_jobs:
+                    self._reaped_jobs.remove(job_id)
+                else:
+                    self._pending_jobs.add(job_id)
+            self._pending_cond.notify()
+
+    def stop(self):
+        self._stopped.set()
+        with self._pending_cond:
+            self._pending_cond.notify()
+
+    def _reaped(self, job_id: str, exit_status: int, failure: Optional[str], usage: Optional[ResourceUsage]):
+        with self._pending_cond:
+            if job_id in self._pending_jobs:
+                self._pending_jobs.remove(job_id)
+            else:
+                self._reaped_jobs.add(job_id)
+        self._on_exit(job_id, exit_status, failure, usage)
+
+    def _reconcile(self, lost_failure: str):
+        """
+        Reaps pending jobs which have ended, those the session no longer knows end with lost_failure
+        """
+        with self._pending_cond:
+            job_ids = list(self._pending_jobs)
+        start_time = time.time()
+        for job_id in job_ids:
+            result = _wait_job(self._session, job_id, lost_failure)
+            if result is not None:
+                self._reaped(job_id, *result)
+        self._stats.record(len(job_ids), time.time() - start_time)
+
+    def run(self):
+        while not self._stopped.is_set():
+            with self._pending_cond:
+                while not self._pending_jobs and not self._stopped.is_set():
+                    self._pending_cond.wait()
+            if self._stopped.is_set():
+                break
+            start_time = time.time()
+            try:
+                res = self._session.wait(drmaa.Session.JOB_IDS_SESSION_ANY, self.WAIT_TIMEOUT)
+            except drmaa.ExitTimeoutException:
+                self._stats.record(1, time.time() - start_time)
+                continue
+            except drmaa.InvalidJobException:
+                # Session has no jobs yet, submission is racing with us
+                self._stopped.wait(0.1)
+                continue
+            except Exception as e:
+                logger.error('Unknown exception in waiter: {}: {}'.format(type(e), e))
+                self._reconcile(_error_failure(e))
+                self._stopped.wait(1)
+                continue
+
+            self._stats.record(1, time.time() - start_time)
+            self._reaped(res.jobId, *_exit_status(res), _resource_usage(res))
+
+
 class DRMAAExecutor(Executor):
-    def __init__(self, stop_on_first_error: bool = False, max_jobs: int = None, skip_already_done=False):
-        super().__init__(stop_on_first_error, max_jobs, skip_already_done)
+    # Exited jobs are reported by a thread blocking in wait(JOB_IDS_SESSION_ANY)
+    STATUS_MODE_NOTIFY = 'notify'
+    # All exited jobs are drained with non-blocking wait(JOB_IDS_SESSION_ANY) on every sweep
+    STATUS_MODE_BULK = 'bulk'
+    # One non-blocking wait(job_id) per active job on every sweep
+    STATUS_MODE_PER_JOB = 'per-job'
+    STATUS_MODES = (STATUS_MODE_NOTIFY, STATUS_MODE_BULK, STATUS_MODE_PER_JOB)
+
+    # Smaller groups of compatible jobs are submitted one by one
+    MIN_ARRAY_SIZE = 2
+
+    def __init__(self, status_mode: str = STATUS_MODE_NOTIFY,
+                 array_jobs: bool = False, array_dir: str = '.scheduler', contact: str = None, **kwargs):
+        """
+        With contact the session of a previous run is reopened, so its jobs can be reattached.
+        Array jobs and bundles can not be checkpointed: their members are not reattached
+        and their index files are removed on shutdown.
+        """
+        if kwargs.get('checkpoint') and (array_jobs or kwargs.get('bundler')):
+            raise ValueError('Checkpoints can not be used with array jobs or bundles')
+        super().__init__(**kwargs)
+        if status_mode not in self.STATUS_MODES:
+            raise ValueError('Invalid status mode: {}'.format(status_mode))
+        self._status_mode = status_mode
+        self._array_jobs = array_jobs
+        # Index files must be readable from the nodes, so it should be on a shared filesystem
+        self._array_dir = abspath(array_dir)
+        self._array_files = []
         self._session = drmaa.Session()
-        self._session.initialize()
+        if contact:
+            self._session.initialize(contact)
+        else:
+            self._session.initialize()
+        # Set while active jobs are swept one by one after a failed bulk wait(), see _harvest()
+        self._lost_failure = None  # type: Optional[str]
+        self._waiter = None
+        if status_mode == self.STATUS_MODE_NOTIFY:
+            self._waiter = WaiterThread(self._session, on_exit=self._notify_exited, stats=self.harvest_stats)
+            self._waiter.start()
 
-    def _job_status(self, job: Job) -> Executor.JobStatus:
-        has_exited = False
-        exit_status = None
+    def _notifies_exit(self)->bool:
+        return self._status_mode == self.STATUS_MODE_NOTIFY
+
+    @property
+    def contact(self)->Optional[str]:
+        return self._session.contact
+
+    def _reattach_job(self, job_id: str)->bool:
         try:
-            res = self._session.wait(job.job_id,
-                                     drmaa.Session.TIMEOUT_NO_WAIT)
-            if res.hasExited:
-                has_exited = True
-                exit_status = res.exitStatus
-        except drmaa.ExitTimeoutException:
-            # job still active
-            pass
+            # Jobs which exited are known until they are reaped by wait()
+            self._session.jobStatus(job_id)
+        except InvalidJobException:
+            return False
         except Exception as e:
-            # Dirty hack allowing to catch cancelled job in "queued" status
-            if 'code 24' in str(e):
-                logger.error("Cancelled job in 'queued' status: {}".format(e))
-            else:
+            logger.error('Unable to reattach job {id}: {type}: {e}'.format(id=job_id, type=type(e), e=e))
+            return False
+        if self._waiter:
+            self._waiter.add_jobs([job_id])
+        return True
+
+    def _harvest(self) -> List[Executor.JobStatus]:
+        if self._status_mode != self.STATUS_MODE_BULK:
+            return super()._harvest()
+
+        start_time = time.time()
+        calls = 0
+        statuses = []
+        while True:
+            calls += 1
+            try:
+                res = self._session.wait(drmaa.Session.JOB_IDS_SESSION_ANY,
+                                         drmaa.Session.TIMEOUT_NO_WAIT)
+            except (drmaa.ExitTimeoutException, drmaa.InvalidJobException):
+                # nothing else has exited or no jobs left in the session
+                break
+            except Exception as e:
                 logger.error('Unknown exception: {}: {}'.format(type(e), e))
-            exit_status = 42
-            has_exited = True
+                # wait() may have reaped a job without returning it
+                self._lost_failure = _error_failure(e)
+                break
+
+            exit_status, failure = _exit_status(res)
+            job = self._active_jobs.get(res.jobId)
+            if job is None:
+                self._unknown_exit(res.jobId, exit_status, failure, time.time(), _resource_usage(res))
+                continue
+            statuses.append(Executor.JobStatus(
+                exit_status=exit_status,
+                has_exited=True,
+                job=job,
+                failure=failure,
+                usage=_resource_usage(res),
+            ))
+        if self._lost_failure is not None:
+            calls += self._sweep_active(statuses, self._lost_failure)
+            # The lost job may be one a submission worker has not handed over yet
+            if not self._in_flight:
+                self._lost_failure = None
+        self.harvest_stats.record(calls, time.time() - start_time)
+        return statuses
+
+    def _sweep_active(self, statuses: List[Executor.JobStatus], lost_failure: str)->int:
+        """
+        Adds statuses of active jobs not in statuses which have ended, one wait(job_id) each,
+        returns the number of calls
+        """
+        reaped = {status.job.job_id for status in statuses}
+        calls = 0
+        for job in list(self._active_jobs.values()):
+            if job.job_id in reaped:
+                continue
+            calls += 1
+            result = _wait_job(self._session, job.job_id, lost_failure)
+            if result is None:
+                continue
+            exit_status, failure, usage = result
+            statuses.append(Executor.JobStatus(
+                exit_status=exit_status,
+                has_exited=True,
+                job=job,
+                failure=failure,
+                usage=usage,
+            ))
+        return calls
+
+    def _job_status(self, job: Job) -> Executor.JobStatus:
+        result = _wait_job(self._session, job.job_id)
+        if result is None:
+            return Executor.JobStatus(exit_status=None, has_exited=False, job=job)
+        exit_status, failure, usage = result
         return Executor.JobStatus(
             exit_status=exit_status,
-            has_exited=has_exited,
-            job=job
+            has_exited=True,
+            job=job,
+            failure=failure,
+            usage=usage,
         )
 
     def _cancel_job(self, job: Job):
@@ -78,6 +386,90 @@ class DRMAAExecutor(Executor):
 
         return jt
 
+    @staticmethod
+    def _array_key(spec: JobSpec):
+        return spec.command, spec.num_slots, spec.work_dir
+
+    def _submit_many(self, job_specs: List[JobSpec]) -> List[Job]:
+        if not self._array_jobs:
+            return super()._submit_many(job_specs)
+
+        jobs = []
+        for _, group in groupby(job_specs, self._array_key):
+            group = list(group)
+            if len(group) < self.MIN_ARRAY_SIZE:
+                jobs.extend(super()._submit_many(group))
+                continue
+            try:
+                jobs.extend(self._submit_array(group))
+            except SubmissionError as e:
+                logger.error('Unable to submit {n} jobs starting from {name}: {e}'.format(
+                    n=len(group),
+                    name=group[0].name,
+                    e=e,
+                ))
+                jobs.extend(Job(spec=spec) for spec in group)
+        return jobs
+
+    def _submit_groups(self, job_specs: List[JobSpec]):
+        # DRMAA 1.0 allows one session per process, submission workers share it:
+        # the library is required to be thread-safe
+        if not self._array_jobs:
+            return super()._submit_groups(job_specs)
+        return (list(group) for _, group in groupby(job_specs, self._array_key))
+
+    def _write_array_index(self, job_specs: List[JobSpec])->str:
+        makedirs(self._array_dir, exist_ok=True)
+        fd, index_path = tempfile.mkstemp(prefix='array.', suffix='.tasks', dir=self._array_dir)
+        close(fd)
+        command = shutil.which(job_specs[0].command) or job_specs[0].command
+        try:
+            task_runner.write_index(index_path, [
+                {
+                    'command': command,
+                    'args': spec.args,
+                    'log_path': spec.log_path and abspath(spec.log_path),
+                }
+                for spec in job_specs
+            ])
+        except OSError:
+            remove(index_path)
+            raise
+        self._array_files.append(index_path)
+        return index_path
+
+    def _submit_array(self, job_specs: List[JobSpec])->List[Job]:
+        spec = job_specs[0]
+        try:
+            index_path = self._write_array_index(job_specs)
+        except OSError as e:
+            logger.error('Unable to write array index of {name}: {e}'.format(name=spec.name, e=e))
+            raise SubmissionError(e) from e
+        try:
+            jt = self._create_template(spec)
+            jt.remoteCommand = sys.executable
+            jt.args = ['-m', task_runner.__name__, index_path]
+            # Task runner redirects output to each task's own log
+            jt.outputPath = ':' + devnull
+            jt.joinFiles = True
+            jt.jobName = jt.jobName + '.array'
+
+            job_ids = self._session.runBulkJobs(jt, 1, len(job_specs), 1)
+            self._session.deleteJobTemplate(jt)
+            logger.debug('Submitted {n} jobs starting from {name} as array job'.format(
+                n=len(job_specs),
+                name=spec.name,
+            ))
+            if self._waiter:
+                self._waiter.add_jobs(job_ids)
+            return [
+                Job(spec=job_spec, job_id=job_id)
+                for job_spec, job_id in zip(job_specs, job_ids)
+            ]
+        except _SUBMIT_ERRORS as e:
+            logger.error('drmaa exception in _submit_array: {}'.format(e))
+            raise SubmissionError(e) from e
+
     def _submit(self, job_spec: JobSpec)->Job:
         try:
             jt = self._create_template(job_spec)
@@ -85,12 +477,24 @@ class DRMAAExecutor(Executor):
             job_id = self._session.runJob(jt)
             job = Job(spec=job_spec, job_id=job_id)
             self._session.deleteJobTemplate(jt)
+            if self._waiter:
+                self._waiter.add_jobs([job_id])
             return job
-        except (drmaa.InternalException,
-                drmaa.InvalidAttributeValueException) as e:
+        except _SUBMIT_ERRORS as e:
             logger.error('drmaa exception in _submit: {}'.format(e))
-            # FIXME handle drmaa exceptions
-            raise e
+            raise SubmissionError(e) from e
 
     def shutdown(self):
+        logger.debug('Status harvesting ({}): {}'.format(self._status_mode, self.harvest_stats))
+        # Submission workers must not call runJob() on an exited session
+        self._stop_submitting()
+        if self._waiter:
+            self._waiter.stop()
         self._session.exit()
+        for index_path in self._array_files:
+            for path in (index_path, task_runner.offsets_path(index_path)):
+                try:
+                    remove(path)
+                except OSError as e:
+                    logger.warning('Unable to remove array index {}: {}'.format(path, e))
+        super().shutdown()
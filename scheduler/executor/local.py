@@ -1,11 +1,13 @@
-from collections import deque
-from threading import Thread, Lock
-from typing import Dict
-
 import time
+from collections import deque
+from itertools import count
+from os import cpu_count
+from threading import Thread, Lock, Condition
+from typing import Dict, Callable, Optional
 
 from scheduler.executor.base import Executor
-from scheduler.job import Job, JobSpec
+from scheduler.executor.util import wait_process, terminate_process, rusage_usage, start_process, start_failure
+from scheduler.job import Job, JobSpec, ResourceUsage
 import logging
 import subprocess
 
@@ -15,50 +17,72 @@ logger = logging.getLogger(__name__)
 
 class LocalExecutor(Executor):
     """
-    Only for developing and debugging
+    Runs jobs as local subprocesses packing them by num_slots into num_cores
     """
-    def __init__(self, stop_on_first_error: bool=False, max_jobs: int=None, skip_already_done=False):
-        super().__init__(stop_on_first_error, max_jobs, skip_already_done)
-        self._executor_thread = ExecutorThread()
+    def __init__(self, num_cores: int=None, **kwargs):
+        super().__init__(**kwargs)
+        self._num_cores = num_cores or cpu_count() or 1
+        self._executor_thread = ExecutorThread(
+            num_cores=self._num_cores,
+            on_exit=self._notify_exited,
+        )
         self._executor_thread.start()
 
+    def _notifies_exit(self)->bool:
+        return True
+
+    def _slot_capacity(self)->float:
+        return min(self._max_slots, self._num_cores)
+
     def shutdown(self):
-        logger.warning('showtdown() is not implemented')
-        pass
+        self._executor_thread.stop()
+        super().shutdown()
 
     def _cancel_job(self, job: Job):
-        logger.warning('_cancel_job(job) is not implemented')
-        pass
+        self._executor_thread.cancel_job(job)
 
     def _job_status(self, job: Job) -> Executor.JobStatus:
         return self._executor_thread.job_status(job)
 
+    def _forget_job(self, job: Job):
+        self._executor_thread.forget_job(job)
+
     def _submit(self, job_spec: JobSpec)->Job:
         return self._executor_thread.queue_job(job_spec)
 
 
 class ExecutorThread(Thread):
-    def __init__(self):
+    """
+    Starts queued jobs while their slots fit into free cores,
+    every started process is reaped with its resource usage by its own watcher thread
+    """
+    def __init__(self, num_cores: int=1,
+                 on_exit: Callable[[int, Optional[int], Optional[str], Optional[ResourceUsage]], None]=None):
         super().__init__()
         self.setDaemon(True)
+        self._on_exit = on_exit
+        self._num_cores = num_cores
+        self._free_cores = num_cores
+        self._stopped = False
         self._current_jobs = deque()
+        self._processes = dict()  # type: Dict[int, subprocess.Popen]
         self._executor_lock = Lock()
+        self._jobs_changed = Condition(self._executor_lock)
+        self._job_ids = count(1)
+        # Statuses of jobs not yet forgotten by the executor
         self._job_statuses = dict()  # type: Dict[int, Executor.JobStatus]
 
     def job_status(self, job: Job) -> Executor.JobStatus:
         with self._executor_lock:
-            return next((
-                status
-                for _, status in self._job_statuses.items()
-                if status.job.job_id == job.job_id
-            ), None)
+            return self._job_statuses.get(job.job_id)
 
-    def _next_job_id(self)->int:
-        return max(self._job_statuses.keys() or [0]) + 1
+    def forget_job(self, job: Job):
+        with self._executor_lock:
+            self._job_statuses.pop(job.job_id, None)
 
     def queue_job(self, job_spec: JobSpec)->Job:
         with self._executor_lock:
-            job_id = self._next_job_id()
+            job_id = next(self._job_ids)
             job = Job(spec=job_spec, job_id=job_id)
             self._current_jobs.append(job)
             self._job_statuses[job_id] = Executor.JobStatus(
@@ -66,31 +90,77 @@ class ExecutorThread(Thread):
                 exit_status=None,
                 job=job
             )
+            self._jobs_changed.notify()
             return job
 
+    def cancel_job(self, job: Job):
+        with self._executor_lock:
+            process = self._processes.get(job.job_id)
+            if process is not None:
+                terminate_process(process)
+                return
+            if job not in self._current_jobs:
+                return
+            self._current_jobs.remove(job)
+            self._set_exited(job, None)
+
+    def stop(self):
+        with self._executor_lock:
+            self._stopped = True
+            for process in self._processes.values():
+                terminate_process(process)
+            self._jobs_changed.notify()
+
+    @staticmethod
+    def _job_cores(job: Job)->int:
+        return job.spec.num_slots or 1
+
+    def _can_start(self, job: Job)->bool:
+        # Jobs requesting more than num_cores run alone
+        return self._job_cores(job) <= self._free_cores or self._free_cores == self._num_cores
+
+    def _set_exited(self, job: Job, exit_status: Optional[int], usage: ResourceUsage=None, failure: str=None):
+        status = self._job_statuses[job.job_id]
+        status.has_exited = True
+        status.exit_status = exit_status
+        status.failure = failure
+        status.usage = usage
+        if self._on_exit:
+            self._on_exit(job.job_id, exit_status, failure, usage)
+
     def run(self):
         while True:
-            if len(self._current_jobs):
+            with self._executor_lock:
+                while not self._stopped and not (self._current_jobs and self._can_start(self._current_jobs[0])):
+                    self._jobs_changed.wait()
+                if self._stopped:
+                    return
                 job = self._current_jobs.popleft()
-                self._execute_job(job)
-                self._job_statuses[job.job_id].has_exited = True
-                self._job_statuses[job.job_id].exit_status = 0
-            else:
-                time.sleep(0.3)
-
-    @staticmethod
-    def _execute_job(job: Job)->int:
-        stdout_f = None
-        if job.spec.log_path:
-            stdout_f = open(job.spec.log_path, 'w')
-        try:
-            process = subprocess.Popen(
-                args=[job.spec.command] + job.spec.args,
-                cwd=job.spec.work_dir,
-                stdout=stdout_f,
-                close_fds=True
-            )
-            return process.wait()
-        except FileNotFoundError as e:
-            logger.error(e)
-            return 1
+                cores = self._job_cores(job)
+                if cores > self._num_cores:
+                    logger.warning('Job {name} requested {n} slots, only {cores} cores available'.format(
+                        name=job.spec.name,
+                        n=cores,
+                        cores=self._num_cores,
+                    ))
+                self._free_cores -= cores
+
+                start_time = time.time()
+                try:
+                    process = start_process(job.spec)
+                except OSError as e:
+                    self._free_cores += cores
+                    self._set_exited(job, 1, failure=start_failure(job, e))
+                    continue
+                self._processes[job.job_id] = process
+
+            Thread(target=self._watch, args=(job, process, start_time), daemon=True).start()
+
+    def _watch(self, job: Job, process: subprocess.Popen, start_time: float):
+        exit_status, rusage = wait_process(process)
+        usage = rusage_usage(start_time, time.time(), rusage, max_rss=False)
+        with self._executor_lock:
+            del self._processes[job.job_id]
+            self._free_cores += self._job_cores(job)
+            self._set_exited(job, exit_status, usage)
+            self._jobs_changed.notify()
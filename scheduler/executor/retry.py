@@ -0,0 +1,67 @@
+import random
+from typing import Optional, Iterable
+
+from scheduler.job import Job
+
+# Why an attempt failed
+FAILURE_EXIT = 'exit'        # job exited with non-zero status
+FAILURE_SIGNAL = 'signal'    # job was killed by a signal
+FAILURE_ABORTED = 'aborted'  # job ended without having run, e.g. deleted while queued
+FAILURE_ERROR = 'error'      # backend could not tell what happened to the job
+FAILURE_SUBMIT = 'submit'    # job could not be submitted
+FAILURES = (FAILURE_EXIT, FAILURE_SIGNAL, FAILURE_ABORTED, FAILURE_ERROR, FAILURE_SUBMIT)
+
+# Failures which are usually transient: node and DRM problems rather than job errors
+DEFAULT_RETRY_ON = (FAILURE_SIGNAL, FAILURE_ABORTED, FAILURE_ERROR, FAILURE_SUBMIT)
+
+REQUEUE_FRONT = 'front'
+REQUEUE_BACK = 'back'
+
+
+def classify(exit_status: Optional[int])->str:
+    """
+    Failure of a job which executor only reported the exit status of
+    """
+    if exit_status is None:
+        return FAILURE_ERROR
+    if exit_status < 0:
+        # subprocess reports death by signal N as -N
+        return FAILURE_SIGNAL
+    return FAILURE_EXIT
+
+
+class RetryPolicy:
+    """
+    Failed jobs are resubmitted while they have attempts left and their failure
+    is one of retry_on, or is FAILURE_EXIT with one of retry_exit_codes.
+    Delay before the n-th retry is backoff * 2^(n-1) capped by max_backoff, half of it jittered.
+    """
+    def __init__(self, max_attempts: int=1, backoff: float=30, max_backoff: float=600,
+                 retry_on: Iterable[str]=DEFAULT_RETRY_ON, retry_exit_codes: Iterable[int]=(),
+                 requeue: str=REQUEUE_FRONT):
+        for failure in retry_on:
+            if failure not in FAILURES:
+                raise ValueError('Invalid failure: {}'.format(failure))
+        if requeue not in (REQUEUE_FRONT, REQUEUE_BACK):
+            raise ValueError('Invalid requeue position: {}'.format(requeue))
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_on = frozenset(retry_on)
+        self.retry_exit_codes = frozenset(retry_exit_codes)
+        self.requeue = requeue
+
+    def should_retry(self, job: Job, failure: str, exit_status: Optional[int])->bool:
+        max_attempts = job.spec.max_attempts or self.max_attempts
+        if job.attempt >= max_attempts:
+            return False
+        if failure == FAILURE_EXIT and exit_status in self.retry_exit_codes:
+            return True
+        return failure in self.retry_on
+
+    def delay(self, attempt: int)->float:
+        """
+        Seconds to wait before resubmitting a job which attempt-th attempt failed
+        """
+        delay = min(self.backoff * 2 ** (attempt - 1), self.max_backoff)
+        return delay / 2 + random.uniform(0, delay / 2)
@@ -0,0 +1,134 @@
+import logging
+import queue
+import time
+from threading import Thread
+from typing import Callable, List
+
+from scheduler.job import Job, JobSpec
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Limits submissions to rate jobs per second on average, allowing bursts of up to burst jobs.
+    Used only from the thread running wait_for_jobs().
+    """
+    def __init__(self, rate: float, burst: int=None):
+        if rate <= 0:
+            raise ValueError('Invalid submission rate: {}'.format(rate))
+        self.rate = rate
+        self.burst = max(burst or int(rate), 1)
+        self._tokens = float(self.burst)
+        self._time = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self._tokens + (now - self._time) * self.rate, self.burst)
+        self._time = now
+
+    def available(self)->int:
+        """
+        Number of jobs which may be submitted right now
+        """
+        self._refill()
+        return int(self._tokens)
+
+    def take(self, count: int):
+        self._tokens -= count
+
+    def delay(self)->float:
+        """
+        Seconds until the next job may be submitted
+        """
+        self._refill()
+        return max(1 - self._tokens, 0) / self.rate
+
+
+class SubmitStats:
+    """
+    Counters of submission: backend time spent per job and how long
+    jobs waited from being queued until they were submitted
+    """
+    def __init__(self):
+        self.calls = 0
+        self.jobs = 0
+        self.submit_time = 0.0
+        self.max_call_time = 0.0
+        self.submitted = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def record_call(self, jobs: int, seconds: float):
+        self.calls += 1
+        self.jobs += jobs
+        self.submit_time += seconds
+        self.max_call_time = max(self.max_call_time, seconds)
+
+    def record_job(self, latency: float):
+        self.submitted += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+    def __str__(self):
+        return '{submitted} of {jobs} jobs submitted, avg {per_job:.1f} ms per job, max {max_call:.1f} ms ' \
+               'per call, queue to submit avg {avg:.3f}s, max {max:.3f}s'.format(
+                   submitted=self.submitted,
+                   jobs=self.jobs,
+                   per_job=1000 * self.submit_time / (self.jobs or 1),
+                   max_call=1000 * self.max_call_time,
+                   avg=self.total_latency / (self.submitted or 1),
+                   max=self.max_latency,
+               )
+
+
+class SubmitPool:
+    """
+    Worker threads submitting groups of jobs with submit(job_specs), every group is passed
+    to on_submitted(jobs, seconds) from the worker thread once it has been submitted
+    """
+    def __init__(self, submit: Callable[[List[JobSpec]], List[Job]],
+                 on_submitted: Callable[[List[Job], float], None], workers: int=1):
+        self._submit = submit
+        self._on_submitted = on_submitted
+        self._groups = queue.Queue()  # type: queue.Queue
+        self._threads = [
+            Thread(target=self._run, name='submitter-{}'.format(i), daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def put(self, job_specs: List[JobSpec]):
+        self._groups.put(job_specs)
+
+    def _run(self):
+        while True:
+            job_specs = self._groups.get()
+            if job_specs is None:
+                return
+            start_time = time.time()
+            try:
+                jobs = self._submit(job_specs)
+            except Exception as e:
+                logger.error('Unknown exception in submitter: {}: {}'.format(type(e), e))
+                jobs = [Job(spec=job_spec) for job_spec in job_specs]
+            self._on_submitted(jobs, time.time() - start_time)
+
+    def stop(self)->List[JobSpec]:
+        """
+        Waits for groups being submitted, returns jobs which were not
+        """
+        not_submitted = []
+        while True:
+            try:
+                job_specs = self._groups.get_nowait()
+            except queue.Empty:
+                break
+            if job_specs is not None:
+                not_submitted.extend(job_specs)
+        for _ in self._threads:
+            self._groups.put(None)
+        for thread in self._threads:
+            thread.join()
+        return not_submitted
@@ -0,0 +1,75 @@
+"""
+Runs one task of an array job on a cluster node:
+
+    python -m scheduler.executor.task_runner <index file>
+
+The index file holds one JSON line per task, <index file>.offsets holds
+the byte offset of every line so a task reads only its own one.
+"""
+import json
+import os
+import struct
+import sys
+from typing import List, Dict, Any
+
+# Environment variables holding the 1-based task index in different DRMs
+TASK_ID_VARIABLES = (
+    'SGE_TASK_ID',
+    'SLURM_ARRAY_TASK_ID',
+    'PBS_ARRAYID',
+    'LSB_JOBINDEX',
+)
+
+OFFSET_FORMAT = '<Q'
+OFFSET_SIZE = struct.calcsize(OFFSET_FORMAT)
+
+
+def offsets_path(index_path: str)->str:
+    return index_path + '.offsets'
+
+
+def write_index(index_path: str, tasks: List[Dict[str, Any]]):
+    with open(index_path, 'wb') as index_f, open(offsets_path(index_path), 'wb') as offsets_f:
+        for task in tasks:
+            offsets_f.write(struct.pack(OFFSET_FORMAT, index_f.tell()))
+            index_f.write(json.dumps(task).encode() + b'\n')
+
+
+def read_task(index_path: str, task_id: int)->Dict[str, Any]:
+    with open(offsets_path(index_path), 'rb') as f:
+        f.seek((task_id - 1) * OFFSET_SIZE)
+        offset, = struct.unpack(OFFSET_FORMAT, f.read(OFFSET_SIZE))
+    with open(index_path, 'rb') as f:
+        f.seek(offset)
+        return json.loads(f.readline().decode())
+
+
+def _task_id()->int:
+    for var in TASK_ID_VARIABLES:
+        value = os.environ.get(var)
+        if value and value.isdigit():
+            return int(value)
+    raise RuntimeError('Task index is not set, expected one of: {}'.format(
+        ', '.join(TASK_ID_VARIABLES)
+    ))
+
+
+def main():
+    task = read_task(sys.argv[1], _task_id())
+
+    if task.get('log_path'):
+        log_fd = os.open(task['log_path'], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.dup2(log_fd, sys.stdout.fileno())
+        os.dup2(log_fd, sys.stderr.fileno())
+        os.close(log_fd)
+
+    args = [task['command']] + task['args']
+    try:
+        os.execvp(args[0], args)
+    except OSError as e:
+        sys.stderr.write('{}: {}\n'.format(args[0], e))
+        sys.exit(127)
+
+
+if __name__ == '__main__':
+    main()
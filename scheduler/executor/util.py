@@ -1,19 +1,33 @@
+import json
+import os
 import shlex
+import signal
+import subprocess
+import sys
+from contextlib import contextmanager
 from genericpath import exists
 
 import datetime
 
 import math
+from typing import Optional, Tuple, Dict, Any, Iterator, TextIO
 
-from scheduler.job import Job, JobSpec
+from scheduler.executor.retry import FAILURE_EXIT, FAILURE_ERROR
+from scheduler.job import Job, JobSpec, ResourceUsage
 import logging
 logger = logging.getLogger(__name__)
 
+# ru_maxrss is in kilobytes except on macOS
+_MAXRSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+_NO_USAGE = ResourceUsage(*(None,) * len(ResourceUsage._fields))
+
 
 def print_job_error(job: Job):
-    logger.error("Job {name} (drmaa id: {d}) finished with error. Log file: {log}".format(
+    logger.error("Job {name} (drmaa id: {d}) finished with error{attempts}. Log file: {log}".format(
         name=job.spec.name,
         d=job.job_id,
+        attempts=' after {} attempts'.format(job.attempt) if job.attempts else '',
         log=(job.spec.log_path or '').rstrip(':')
     ))
     args_str = " ".join([shlex.quote(arg) for arg in job.spec.args])
@@ -34,25 +48,210 @@ def print_job_error(job: Job):
 
 
 def print_job_ok(job: Job):
-    logger.info("Job {name} (id: {id}) successfully finished, time: {time}".format(
+    queued = ''
+    if job.queue_wait is not None:
+        queued = ', queued: {}'.format(datetime.timedelta(seconds=math.trunc(job.queue_wait)))
+    logger.info("Job {name} (id: {id}) successfully finished, time: {time}{queued}".format(
         name=job.spec.name,
         id=job.job_id,
-        time=datetime.timedelta(seconds=math.trunc(job.end_time - job.start_time))
+        time=datetime.timedelta(seconds=math.trunc(job.run_time)),
+        queued=queued,
     ))
 
 
 def write_time(job: Job):
     with open(job.spec.time_path, 'w') as f:
-        f.write('{}\n'.format(job.end_time - job.start_time))
+        f.write('{}\n'.format(job.run_time))
+
+
+def usage_path(time_path: str)->str:
+    """
+    Resource usage record of a job is kept next to its time file
+    """
+    path = time_path
+    if path.endswith('.time'):
+        path = path[:-len('.time')]
+    return path + '.usage.json'
+
+
+def usage_record(job: Job, status: str, exit_status: Optional[int])->Dict[str, Any]:
+    """
+    Structured record of one run of a job: timing, resource usage and CPU efficiency
+    (CPU time over run time times requested slots)
+    """
+    usage = job.usage or _NO_USAGE
+    run_time = job.run_time
+    num_slots = job.spec.num_slots or 1
+    return {
+        'name': job.spec.name,
+        'batch': job.spec.layout.batch_name if job.spec.layout else None,
+        'job_id': str(job.job_id),
+        'status': status,
+        'exit_status': exit_status,
+        'attempt': job.attempt,
+        'num_slots': num_slots,
+        'submit_time': job.start_time,
+        'start_time': usage.start_time,
+        'end_time': job.end_time if usage.end_time is None else usage.end_time,
+        'queue_wait': job.queue_wait,
+        'run_time': run_time,
+        'cpu_time': usage.cpu_time,
+        'user_time': usage.user_time,
+        'system_time': usage.system_time,
+        'max_rss': usage.max_rss,
+        'max_vmem': usage.max_vmem,
+        'read_blocks': usage.read_blocks,
+        'write_blocks': usage.write_blocks,
+        'cpu_efficiency': None if usage.cpu_time is None or not run_time else usage.cpu_time / (run_time * num_slots),
+    }
+
+
+def write_usage(job: Job, status: str, exit_status: Optional[int]):
+    with open(usage_path(job.spec.time_path), 'w') as f:
+        json.dump(usage_record(job, status, exit_status), f)
+        f.write('\n')
+
+
+def wait_process(process: subprocess.Popen)->Tuple[int, Any]:
+    """
+    Reaps the process with wait4, returns its exit status (-N if killed
+    by signal N, like Popen) and resource usage
+    """
+    _, status, rusage = os.wait4(process.pid, 0)
+    exit_status = decode_status(status)
+    # Popen must not wait for the reaped process again
+    process.returncode = exit_status
+    return exit_status, rusage
+
+
+def decode_status(status: int)->int:
+    """
+    Exit status of a wait() status, -N if killed by signal N
+    """
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+@contextmanager
+def open_log(job_spec: JobSpec)->Iterator[Optional[TextIO]]:
+    """
+    Log of a local job opened for its process to write both its outputs to, None if it
+    has no log. Raises OSError if it can't be opened.
+    """
+    stdout_f = None
+    if job_spec.log_path:
+        stdout_f = open(job_spec.log_path, 'w')
+    try:
+        yield stdout_f
+    finally:
+        # Child process has its own copy of the descriptor
+        if stdout_f:
+            stdout_f.close()
+
+
+def start_process(job_spec: JobSpec)->subprocess.Popen:
+    """
+    Starts the command of a local job with its output sent to its log,
+    raises OSError if either can't be done
+    """
+    with open_log(job_spec) as stdout_f:
+        return subprocess.Popen(
+            args=[job_spec.command] + job_spec.args,
+            cwd=job_spec.work_dir,
+            stdout=stdout_f,
+            stderr=subprocess.STDOUT if stdout_f else None,
+            close_fds=True
+        )
+
+
+def start_failure(job: Job, error: OSError)->str:
+    """
+    Logs why a local job could not be started, returns its failure: a missing or
+    not executable command fails like the job, other errors like the backend
+    """
+    logger.error('Job {name} (id: {id}) could not be started: {error}'.format(
+        name=job.spec.name,
+        id=job.job_id,
+        error=error,
+    ))
+    if isinstance(error, (FileNotFoundError, PermissionError)):
+        return FAILURE_EXIT
+    return FAILURE_ERROR
+
+
+def terminate_process(process: subprocess.Popen):
+    """
+    Popen.terminate() could reap the process before wait_process() does
+    """
+    try:
+        os.kill(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+
+
+def rusage_usage(start_time: float, end_time: float, rusage, max_rss: bool=True)->ResourceUsage:
+    """
+    Usage of a reaped child, only its times if rusage is None. ru_maxrss of a child
+    includes the memory of its parent before exec, so executors forking jobs from
+    the scheduler itself pass max_rss=False.
+    """
+    if rusage is None:
+        return _NO_USAGE._replace(start_time=start_time, end_time=end_time)
+    return ResourceUsage(
+        start_time=start_time,
+        end_time=end_time,
+        cpu_time=rusage.ru_utime + rusage.ru_stime,
+        user_time=rusage.ru_utime,
+        system_time=rusage.ru_stime,
+        max_rss=rusage.ru_maxrss * _MAXRSS_UNIT if max_rss else None,
+        max_vmem=None,
+        read_blocks=rusage.ru_inblock,
+        write_blocks=rusage.ru_oublock,
+    )
 
 
 def read_status(job_spec: JobSpec)->str:
     if not exists(job_spec.status_path):
         return ''
     with open(job_spec.status_path) as f:
-        return f.read().strip()
+        return f.readline().strip()
+
+
+FINGERPRINT_PREFIX = 'fingerprint '
+
+
+def parse_fingerprint(content: str)->Optional[str]:
+    """
+    Fingerprint recorded in the content of a status file, None if there is none
+    """
+    for line in content.splitlines()[1:]:
+        if line.startswith(FINGERPRINT_PREFIX):
+            return line[len(FINGERPRINT_PREFIX):].strip()
+    return None
+
+
+def read_fingerprint(job_spec: JobSpec)->Optional[str]:
+    if not exists(job_spec.status_path):
+        return None
+    with open(job_spec.status_path) as f:
+        return parse_fingerprint(f.read())
 
 
 def write_status(job: Job, status: str):
+    """
+    Status on the first line, the job's fingerprint if it has one,
+    then one line per failed attempt of a retried job
+    """
     with open(job.spec.status_path, 'w') as f:
         f.write(status)
+        if job.spec.fingerprint:
+            f.write('\n' + FINGERPRINT_PREFIX + job.spec.fingerprint)
+        for i, attempt in enumerate(job.attempts or (), 1):
+            f.write('\nattempt {i}: {failure}, exit status {exit_status}, id {id}, {time:.0f}s'.format(
+                i=i,
+                failure=attempt.failure,
+                exit_status=attempt.exit_status,
+                id=attempt.job_id,
+                time=attempt.end_time - attempt.start_time,
+            ))
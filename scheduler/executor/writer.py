@@ -0,0 +1,70 @@
+import logging
+import queue
+from threading import Thread
+from typing import Callable
+
+from scheduler.store import ResultStore
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class ResultWriter(Thread):
+    """
+    Runs completion side effects (result store writes) in submission order off the
+    scheduling loop. Store is flushed after every batch of tasks. Outcomes of jobs
+    are logged by the loop itself, so they come before the batch and run messages.
+    """
+    # Submitting blocks while this many tasks are waiting
+    MAX_QUEUED = 10000
+    # Tasks run between two flushes of the store
+    BATCH_SIZE = 1000
+
+    def __init__(self, store: ResultStore):
+        super().__init__()
+        self.setDaemon(True)
+        self._store = store
+        self._tasks = queue.Queue(maxsize=self.MAX_QUEUED)
+
+    def submit(self, task: Callable, *args):
+        self._tasks.put((task, args))
+
+    def drain(self):
+        """
+        Waits until all submitted tasks are done and flushed
+        """
+        if self.is_alive():
+            self._tasks.join()
+
+    def close(self):
+        if self.is_alive():
+            self._tasks.put(_STOP)
+            self.join()
+
+    def run(self):
+        stopped = False
+        while not stopped:
+            batch = [self._tasks.get()]
+            while len(batch) < self.BATCH_SIZE:
+                try:
+                    batch.append(self._tasks.get_nowait())
+                except queue.Empty:
+                    break
+
+            for item in batch:
+                if item is _STOP:
+                    stopped = True
+                    continue
+                task, args = item
+                try:
+                    task(*args)
+                except Exception as e:
+                    logger.error('Result writer task failed: {}: {}'.format(type(e), e))
+            try:
+                self._store.flush()
+            except Exception as e:
+                logger.error('Result store flush failed: {}: {}'.format(type(e), e))
+
+            for _ in batch:
+                self._tasks.task_done()
@@ -0,0 +1,82 @@
+import hashlib
+import json
+import os
+import shlex
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from os.path import join
+from typing import Iterable, Iterator, Dict, Tuple, Optional, Any
+
+from scheduler.job import JobSpec
+
+
+def _stat(path: str)->Any:
+    """
+    Size and modification time of path, 'missing' if it does not exist
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return 'missing'
+    return [st.st_size, st.st_mtime_ns]
+
+
+class Fingerprinter:
+    """
+    Fingerprints of jobs: hash of the command, the executable it resolves to, args,
+    work dir and size and modification time of the executable and declared inputs.
+    A job is skipped as already done only when it finished with the fingerprint it has now.
+    """
+    # Jobs fingerprinted at once, inputs are stat-ed in threads as they may be on network filesystems
+    CHUNK_SIZE = 1000
+
+    def __init__(self, threads: int=16):
+        self._threads = threads
+        # Resolved executables by command and work dir
+        self._executables = dict()  # type: Dict[Tuple[str, str], Optional[str]]
+
+    def _executable(self, job_spec: JobSpec)->Optional[str]:
+        key = (job_spec.command, job_spec.work_dir)
+        if key not in self._executables:
+            try:
+                program = shlex.split(job_spec.command)[0]
+            except (ValueError, IndexError):
+                program = job_spec.command
+            if os.sep in program:
+                self._executables[key] = os.path.realpath(join(job_spec.work_dir or '', program))
+            else:
+                self._executables[key] = shutil.which(program)
+        return self._executables[key]
+
+    def fingerprint(self, job_spec: JobSpec)->str:
+        executable = self._executable(job_spec)
+        content = [
+            job_spec.command,
+            executable,
+            _stat(executable) if executable else None,
+            job_spec.work_dir,
+            job_spec.args,
+            [
+                [path, _stat(join(job_spec.work_dir or '', path))]
+                for path in job_spec.inputs or ()
+            ],
+        ]
+        return hashlib.sha1(json.dumps(content).encode()).hexdigest()
+
+    def fingerprint_all(self, job_specs: Iterable[JobSpec])->Iterator[JobSpec]:
+        """
+        Sets fingerprints of jobs chunk by chunk as they are consumed
+        """
+        job_specs = iter(job_specs)
+        with ThreadPoolExecutor(self._threads) as pool:
+            while True:
+                chunk = list(islice(job_specs, self.CHUNK_SIZE))
+                if not chunk:
+                    return
+                # Resolve executables once per command before the threads stat them
+                for job_spec in chunk:
+                    self._executable(job_spec)
+                for job_spec, fingerprint in zip(chunk, pool.map(self.fingerprint, chunk)):
+                    job_spec.fingerprint = fingerprint
+                    yield job_spec
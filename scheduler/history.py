@@ -0,0 +1,83 @@
+import heapq
+import logging
+from math import inf
+from typing import Dict, List, Optional, Tuple
+
+from scheduler.executor.admission import job_slots
+from scheduler.job import JobSpec, BatchLayout
+from scheduler.store import ResultStore
+
+logger = logging.getLogger(__name__)
+
+# Submission orders of queued jobs
+ORDERS = ('file', 'longest-first', 'critical-path')
+
+
+class RuntimeHistory:
+    """
+    Predicts durations of jobs from the runtimes of their last successful runs kept
+    in the result store: by job name within the batch, otherwise by the mean runtime
+    of other jobs with the same command (in any batch loaded so far)
+    """
+    def __init__(self, store: ResultStore):
+        self._store = store
+        # Sum of runtimes and number of runs by command
+        self._by_command = dict()  # type: Dict[str, Tuple[float, int]]
+
+    def predict(self, layout: BatchLayout, job_specs: List[JobSpec])->List[Optional[float]]:
+        """
+        Predicted seconds for every job, None when nothing is known about it
+        """
+        runtimes = self._store.runtimes(layout)
+        predictions = [runtimes.get(job_spec.name) for job_spec in job_specs]
+        for job_spec, runtime in zip(job_specs, predictions):
+            if runtime is not None:
+                total, count = self._by_command.get(job_spec.command, (0.0, 0))
+                self._by_command[job_spec.command] = (total + runtime, count + 1)
+
+        known = 0
+        for i, job_spec in enumerate(job_specs):
+            if predictions[i] is not None:
+                known += 1
+                continue
+            total, count = self._by_command.get(job_spec.command, (0.0, 0))
+            if count:
+                predictions[i] = total / count
+        logger.info('Batch {batch}: runtime history of {known} of {n} jobs, {guessed} guessed by command'.format(
+            batch=layout.batch_name,
+            known=known,
+            n=len(job_specs),
+            guessed=sum(1 for p in predictions if p is not None) - known,
+        ))
+        return predictions
+
+
+def fill_unknown(predictions: List[Optional[float]])->List[float]:
+    """
+    Jobs without prediction are assumed to take the mean of the predicted ones
+    """
+    known = [p for p in predictions if p is not None]
+    default = sum(known) / len(known) if known else 0.0
+    return [default if p is None else p for p in predictions]
+
+
+def predict_makespan(job_specs: List[JobSpec], durations: List[float],
+                     max_jobs: float=inf, max_slots: float=inf)->float:
+    """
+    Seconds to run independent jobs submitted in the given order, first come first served,
+    with at most max_jobs jobs and max_slots slots in use at once
+    """
+    clock = 0.0
+    free_slots = max_slots
+    running = []  # type: List[Tuple[float, int]]
+    makespan = 0.0
+    for job_spec, duration in zip(job_specs, durations):
+        # Jobs larger than the whole budget run alone, like in admission policies
+        slots = min(job_slots(job_spec), max_slots)
+        while running and (len(running) >= max_jobs or free_slots < slots):
+            clock, finished_slots = heapq.heappop(running)
+            free_slots += finished_slots
+        free_slots -= slots
+        heapq.heappush(running, (clock + duration, slots))
+        makespan = max(makespan, clock + duration)
+    return makespan
@@ -1,7 +1,31 @@
-from typing import List
+from collections import namedtuple
+from os.path import join
+from sys import intern
+from typing import List, Iterable, Optional
+
+
+class BatchLayout:
+    """
+    Status, log and time directories of one batch, shared by all its jobs
+    """
+    __slots__ = ('batch_name', 'status_dir', 'log_dir', 'time_dir')
+
+    def __init__(self, batch_name: str, status_dir: str, log_dir: str, time_dir: str):
+        self.batch_name = batch_name
+        self.status_dir = join(status_dir, batch_name)
+        self.log_dir = join(log_dir, batch_name)
+        self.time_dir = join(time_dir, batch_name)
 
 
 class JobSpec:
+    """
+    Paths not set explicitly are derived from the batch layout on access.
+    depends_on is honoured only by the pipelined scheduler.
+    inputs are files the job reads, they are part of its fingerprint.
+    """
+    __slots__ = ('command', 'name', 'args', 'work_dir', 'num_slots', 'layout', 'depends_on',
+                 'max_attempts', 'inputs', 'fingerprint', '_log_path', '_status_path', '_time_path')
+
     def __init__(self,
                  command: str,
                  name: str,
@@ -11,31 +35,144 @@ class JobSpec:
                  log_path: str=None,
                  status_path: str=None,
                  time_path: str=None,
+                 layout: BatchLayout=None,
+                 depends_on: List[str]=None,
+                 max_attempts: int=None,
+                 inputs: List[str]=None,
                  ):
-        self.log_path = log_path
-        self.status_path = status_path
-        self.time_path = time_path
-        self.command = command
+        self._log_path = log_path
+        self._status_path = status_path
+        self._time_path = time_path
+        # Commands and work dirs are repeated by thousands of jobs
+        self.command = intern(command)
         self.args = args or []
         self.name = name
-        self.work_dir = work_dir
+        self.work_dir = work_dir and intern(work_dir)
         self.num_slots = num_slots
+        self.layout = layout
+        # Names of jobs of the same batch or "batch/name" references
+        self.depends_on = depends_on or None
+        # None leaves it to the executor's retry policy
+        self.max_attempts = max_attempts
+        # Paths relative to work_dir
+        self.inputs = inputs or None
+        # Set by fingerprint.Fingerprinter before the job is queued
+        self.fingerprint = None  # type: Optional[str]
+
+    def explicit_paths(self)->List[str]:
+        """
+        Status, log and time paths set in config rather than derived from the layout
+        """
+        return [
+            path
+            for path in (self._status_path, self._log_path, self._time_path)
+            if path
+        ]
+
+    @property
+    def log_path(self)->Optional[str]:
+        if self._log_path or not self.layout:
+            return self._log_path
+        return join(self.layout.log_dir, self.name)
+
+    @log_path.setter
+    def log_path(self, value: str):
+        self._log_path = value
+
+    @property
+    def has_layout_status_path(self)->bool:
+        return not self._status_path and self.layout is not None
+
+    @property
+    def status_path(self)->Optional[str]:
+        if self._status_path or not self.layout:
+            return self._status_path
+        return join(self.layout.status_dir, self.name)
+
+    @status_path.setter
+    def status_path(self, value: str):
+        self._status_path = value
+
+    @property
+    def time_path(self)->Optional[str]:
+        if self._time_path or not self.layout:
+            return self._time_path
+        return join(self.layout.time_dir, self.name+'.time')
+
+    @time_path.setter
+    def time_path(self, value: str):
+        self._time_path = value
+
+
+# Failed attempt of a job which was retried
+Attempt = namedtuple('Attempt', ['job_id', 'failure', 'exit_status', 'start_time', 'end_time'])
+
+# Resources used by one run of a job as reported by the executor, None where unknown.
+# The job executed from start_time to end_time, before that it was queued.
+# Times are in seconds, max_rss and max_vmem in bytes, reads and writes in blocks.
+ResourceUsage = namedtuple('ResourceUsage', [
+    'start_time', 'end_time', 'cpu_time', 'user_time', 'system_time',
+    'max_rss', 'max_vmem', 'read_blocks', 'write_blocks',
+])
 
 
 class Job:
+    """
+    One submission of a job spec, attempts are the earlier failed ones.
+    start_time is the submission time, usage tells when the job actually started.
+    """
+    __slots__ = ('job_id', 'end_time', 'start_time', 'spec', 'attempts', 'usage')
+
     def __init__(self,
                  spec: JobSpec,
                  start_time: int=None,
                  end_time: int=None,
                  job_id: int=None,
+                 attempts: List[Attempt]=None,
+                 usage: ResourceUsage=None,
                  ):
         self.job_id = job_id
         self.end_time = end_time
         self.start_time = start_time
         self.spec = spec
+        self.attempts = attempts
+        self.usage = usage
+
+    @property
+    def attempt(self)->int:
+        return len(self.attempts or ()) + 1
+
+    @property
+    def queue_wait(self)->Optional[float]:
+        """
+        Seconds from submission to start, None if the executor did not tell when the job started
+        """
+        if self.usage is None or self.usage.start_time is None:
+            return None
+        return max(self.usage.start_time - self.start_time, 0.0)
+
+    @property
+    def run_time(self)->float:
+        """
+        Seconds of execution, counted from submission if the executor did not tell when the job started
+        """
+        start_time = self.start_time
+        end_time = self.end_time
+        if self.usage is not None:
+            if self.usage.start_time is not None:
+                start_time = self.usage.start_time
+            if self.usage.end_time is not None:
+                end_time = self.usage.end_time
+        return max(end_time - start_time, 0.0)
 
 
 class Batch:
-    def __init__(self, name: str, jobs: List[JobSpec]):
+    """
+    jobs is a list, or a one-shot iterator when the config is streamed.
+    depends_on names batches which must succeed before this one starts,
+    None leaves it to the scheduler's default.
+    """
+    def __init__(self, name: str, jobs: Iterable[JobSpec], depends_on: List[str]=None):
         self.name = name
         self.jobs = jobs
+        self.depends_on = depends_on
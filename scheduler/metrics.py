@@ -0,0 +1,263 @@
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import time
+import tracemalloc
+from math import inf
+from os.path import dirname
+from typing import Dict, Optional, Any
+
+from scheduler.executor.admission import job_slots
+from scheduler.job import Job
+
+logger = logging.getLogger(__name__)
+
+FORMAT_PROMETHEUS = 'prometheus'
+FORMAT_JSONL = 'jsonl'
+FORMATS = (FORMAT_PROMETHEUS, FORMAT_JSONL)
+
+# Metrics returned by Executor.metrics(): name, type, help
+METRICS = (
+    ('queued_jobs', 'gauge', 'Jobs pulled from batches and waiting for submission'),
+    ('retry_waiting_jobs', 'gauge', 'Failed jobs waiting for their retry'),
+    ('submitting_jobs', 'gauge', 'Jobs handed to submission workers'),
+    ('active_jobs', 'gauge', 'Submitted jobs which have not exited yet'),
+    ('active_slots', 'gauge', 'Slots taken by active and submitting jobs'),
+    ('submitted_jobs_total', 'counter', 'Jobs submitted successfully'),
+    ('submit_seconds_total', 'counter', 'Time spent in submission calls'),
+    ('submit_latency_seconds_sum', 'counter', 'Sum of times from queueing to submission of jobs'),
+    ('submit_latency_seconds_max', 'gauge', 'Longest time from queueing to submission of a job'),
+    ('harvest_sweeps_total', 'counter', 'Status harvesting sweeps'),
+    ('harvest_calls_total', 'counter', 'Backend calls made by status harvesting'),
+    ('harvest_seconds_total', 'counter', 'Time spent harvesting statuses'),
+    ('harvest_seconds_last', 'gauge', 'Duration of the last harvesting sweep'),
+    ('exits_total', 'counter', 'Exits of submitted jobs handled'),
+    ('exit_detection_seconds_count', 'counter', 'Exits handled which the backend told the time of'),
+    ('exit_detection_seconds_sum', 'counter', 'Sum of times from job exit to its handling, for exits timed by backend'),
+    ('exit_detection_seconds_max', 'gauge', 'Longest time from job exit to its handling, for exits timed by backend'),
+    ('skipped_jobs_total', 'counter', 'Jobs skipped as already done'),
+)
+
+# Metrics returned by Executor.batch_metrics() for every batch, labelled with its status directory
+BATCH_METRICS = (
+    ('batch_ok_jobs_total', 'counter', 'Jobs of the batch finished successfully'),
+    ('batch_failed_jobs_total', 'counter', 'Jobs of the batch failed after their last attempt'),
+    ('batch_retried_jobs_total', 'counter', 'Failed attempts of jobs of the batch which were retried'),
+    ('batch_makespan_seconds', 'gauge', 'Time from the first submission to the last exit in the batch'),
+    ('batch_busy_slot_seconds_total', 'counter', 'Sum of slots times seconds of execution of jobs of the batch'),
+    ('batch_utilization', 'gauge', 'Busy slot seconds of the batch over its makespan times slot capacity'),
+    ('batch_queue_wait_seconds_sum', 'counter', 'Sum of times jobs of the batch waited from submission to start'),
+    ('batch_queue_wait_seconds_max', 'gauge', 'Longest time a job of the batch waited from submission to start'),
+    ('batch_cpu_seconds_total', 'counter', 'CPU time used by jobs of the batch'),
+    ('batch_cpu_efficiency', 'gauge', 'CPU time of jobs of the batch over their slot seconds'),
+    ('batch_max_rss_bytes', 'gauge', 'Largest resident set size of a job of the batch'),
+)
+
+
+class Summary:
+    """
+    Count, sum and maximum of observed values
+    """
+    __slots__ = ('count', 'total', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+
+class BatchStats:
+    """
+    Jobs of one batch handled by the executor, the slot time and resources they took
+    """
+    __slots__ = ('ok', 'failed', 'retried', 'start_time', 'end_time', 'busy', 'queue_wait',
+                 'cpu_time', 'cpu_slot_time', 'max_rss', 'max_rss_job', 'max_vmem')
+
+    def __init__(self):
+        self.ok = 0
+        self.failed = 0
+        self.retried = 0
+        self.start_time = inf
+        self.end_time = 0.0
+        # Slot seconds of execution (from submission when executor can't tell the start)
+        self.busy = 0.0
+        self.queue_wait = Summary()
+        # CPU seconds and slot seconds of the jobs which reported CPU time
+        self.cpu_time = 0.0
+        self.cpu_slot_time = 0.0
+        self.max_rss = None  # type: Optional[int]
+        self.max_rss_job = None  # type: Optional[str]
+        self.max_vmem = None  # type: Optional[int]
+
+    def record(self, job: Job):
+        slots = job_slots(job.spec)
+        run_time = job.run_time
+        self.start_time = min(self.start_time, job.start_time)
+        self.end_time = max(self.end_time, job.end_time)
+        self.busy += slots * run_time
+        if job.queue_wait is not None:
+            self.queue_wait.observe(job.queue_wait)
+        usage = job.usage
+        if usage is None:
+            return
+        if usage.cpu_time is not None:
+            self.cpu_time += usage.cpu_time
+            self.cpu_slot_time += slots * run_time
+        if usage.max_rss is not None and (self.max_rss is None or usage.max_rss > self.max_rss):
+            self.max_rss = usage.max_rss
+            self.max_rss_job = job.spec.name
+        if usage.max_vmem is not None:
+            self.max_vmem = max(self.max_vmem or 0, usage.max_vmem)
+
+    @property
+    def makespan(self)->float:
+        return max(self.end_time - self.start_time, 0.0)
+
+    def utilization(self, capacity: float)->Optional[float]:
+        """
+        None when capacity is unbounded or nothing has run yet
+        """
+        if capacity == inf or not self.makespan:
+            return None
+        return self.busy / (self.makespan * capacity)
+
+    @property
+    def cpu_efficiency(self)->Optional[float]:
+        """
+        CPU seconds over slot seconds, low values mean jobs requested more slots than they use
+        """
+        if not self.cpu_slot_time:
+            return None
+        return self.cpu_time / self.cpu_slot_time
+
+    def summary(self, capacity: float)->Dict[str, Any]:
+        return {
+            'ok': self.ok,
+            'failed': self.failed,
+            'retried': self.retried,
+            'makespan': self.makespan,
+            'busy_slot_seconds': self.busy,
+            'utilization': self.utilization(capacity),
+            'queue_wait_avg': self.queue_wait.total / self.queue_wait.count if self.queue_wait.count else None,
+            'queue_wait_max': self.queue_wait.max if self.queue_wait.count else None,
+            'cpu_time': self.cpu_time,
+            'cpu_efficiency': self.cpu_efficiency,
+            'max_rss': self.max_rss,
+            'max_rss_job': self.max_rss_job,
+            'max_vmem': self.max_vmem,
+        }
+
+
+def _format_value(value: float)->str:
+    if value == inf:
+        return '+Inf'
+    return repr(value)
+
+
+def _escape_label(value: str)->str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricsExporter:
+    """
+    Writes snapshots of executor metrics to path: as a Prometheus textfile
+    (for node_exporter textfile collector, replaced atomically) or appended to a JSONL file
+    """
+    PREFIX = 'scheduler_'
+
+    def __init__(self, path: str, format: str=FORMAT_PROMETHEUS, interval: float=15):
+        if format not in FORMATS:
+            raise ValueError('Invalid metrics format: {}'.format(format))
+        self._path = path
+        self._format = format
+        self._interval = interval
+        self._next_time = 0.0
+        if dirname(path):
+            os.makedirs(dirname(path), exist_ok=True)
+
+    def due(self)->bool:
+        """
+        True once in interval seconds
+        """
+        now = time.time()
+        if now < self._next_time:
+            return False
+        self._next_time = now + self._interval
+        return True
+
+    def write(self, metrics: Dict[str, float], batches: Dict[str, Dict[str, float]]):
+        if self._format == FORMAT_JSONL:
+            with open(self._path, 'a') as f:
+                f.write(json.dumps({'time': time.time(), 'metrics': metrics, 'batches': batches}) + '\n')
+            return
+
+        lines = []
+        for name, kind, help in METRICS:
+            if metrics.get(name) is None:
+                continue
+            lines.append('# HELP {}{} {}'.format(self.PREFIX, name, help))
+            lines.append('# TYPE {}{} {}'.format(self.PREFIX, name, kind))
+            lines.append('{}{} {}'.format(self.PREFIX, name, _format_value(metrics[name])))
+        for name, kind, help in BATCH_METRICS:
+            lines.append('# HELP {}{} {}'.format(self.PREFIX, name, help))
+            lines.append('# TYPE {}{} {}'.format(self.PREFIX, name, kind))
+            for batch, values in batches.items():
+                if values.get(name) is None:
+                    continue
+                lines.append('{}{}{{batch="{}"}} {}'.format(
+                    self.PREFIX, name, _escape_label(batch), _format_value(values[name])
+                ))
+        tmp_path = '{}.{}.tmp'.format(self._path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, self._path)
+
+
+class Profiler:
+    """
+    Profiles wait_for_jobs() with cProfile and/or traces its allocations with tracemalloc,
+    used as a context manager around every call. close() writes and logs the results.
+    """
+    # Entries of the results logged
+    TOP = 25
+
+    def __init__(self, profile_path: str=None, trace_memory: bool=False):
+        self._profile_path = profile_path
+        self._profile = cProfile.Profile() if profile_path else None
+        self._trace_memory = trace_memory
+
+    def __enter__(self):
+        if self._trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if self._profile:
+            self._profile.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._profile:
+            self._profile.disable()
+
+    def close(self):
+        if self._profile:
+            self._profile.dump_stats(self._profile_path)
+            out = io.StringIO()
+            pstats.Stats(self._profile, stream=out).sort_stats('cumulative').print_stats(self.TOP)
+            logger.info('Profile of wait_for_jobs() written to {}:\n{}'.format(self._profile_path, out.getvalue()))
+        if self._trace_memory and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            logger.info('Memory allocated since wait_for_jobs() started: {current:.1f} MiB, peak {peak:.1f} MiB, '
+                        'top allocations:\n{top}'.format(
+                            current=current / 2 ** 20,
+                            peak=peak / 2 ** 20,
+                            top='\n'.join(str(stat) for stat in snapshot.statistics('lineno')[:self.TOP]),
+                        ))
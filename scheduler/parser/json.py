@@ -1,35 +1,103 @@
+import logging
+
 import ujson as json
-from typing import List, Any, Dict, TextIO
+from typing import List, Any, Dict, TextIO, Iterator, Tuple
 
 from scheduler.job import Batch, JobSpec
 
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+logger = logging.getLogger(__name__)
+
 
 def parse_config(file)->List[Batch]:
-    data = json.load(file)
+    return parse_batches(json.load(file))
+
 
+def parse_batches(data: List[Dict[str, Any]])->List[Batch]:
+    """
+    Batches of config already loaded from JSON
+    """
     return [_parse_batch(batch_e)
             for batch_e in data]
 
 
+def iter_config(file)->Iterator[Batch]:
+    """
+    Yields batches while reading the file, jobs of every batch are parsed lazily
+    and must be consumed before the next batch is requested
+    """
+    if ijson is None:
+        logger.warning('ijson is not installed, reading the whole config at once')
+        yield from parse_config(file)
+        return
+    yield from _iter_batches(ijson.parse(getattr(file, 'buffer', file)))
+
+
+def _iter_jobs(events: Iterator[Tuple[str, str, Any]])->Iterator[JobSpec]:
+    for prefix, event, value in events:
+        if prefix == 'item.jobs' and event == 'end_array':
+            return
+        if prefix == 'item.jobs.item' and event == 'start_map':
+            builder = ijson.ObjectBuilder()
+            builder.event(event, value)
+            for prefix, event, value in events:
+                builder.event(event, value)
+                if prefix == 'item.jobs.item' and event == 'end_map':
+                    break
+            yield _parse_job(builder.value)
+
+
+def _iter_batches(events: Iterator[Tuple[str, str, Any]])->Iterator[Batch]:
+    name = None
+    buffered_jobs = None
+    for prefix, event, value in events:
+        if prefix == 'item' and event == 'start_map':
+            name = None
+            buffered_jobs = None
+        elif prefix == 'item.name':
+            name = value
+        elif prefix == 'item.jobs' and event == 'start_array':
+            if name is None:
+                # "jobs" came before "name", batch can't be yielded before the name is known
+                buffered_jobs = list(_iter_jobs(events))
+                continue
+            jobs = _iter_jobs(events)
+            yield Batch(name=name, jobs=jobs)
+            # skip jobs not consumed by the caller
+            for _ in jobs:
+                pass
+        elif prefix == 'item' and event == 'end_map' and buffered_jobs is not None:
+            yield Batch(name=name, jobs=buffered_jobs)
+
+
 def write_config(f: TextIO, batches: List[Batch]):
-    batches_dicts = [
+    json.dump(batches_to_dicts(batches), f)
+
+
+def batches_to_dicts(batches: List[Batch])->List[Dict[str, Any]]:
+    return [
         _batch_to_dict(b)
         for b in batches
     ]
 
-    json.dump(batches_dicts, f)
-
 
 def _parse_job(job_e: Dict[str, Any])->JobSpec:
     return JobSpec(
             command=job_e['command'],
             args=job_e.get('args', []),
             num_slots=job_e.get('params', {}).get('num_slots', 1),
+            max_attempts=job_e.get('params', {}).get('max_attempts'),
             log_path=job_e.get('log_path'),
             time_path=job_e.get('time_path'),
             status_path=job_e.get('status_path'),
             work_dir=job_e.get('work_dir'),
             name=job_e.get('name'),
+            depends_on=job_e.get('depends_on'),
+            inputs=job_e.get('inputs'),
         )
 
 
@@ -38,7 +106,7 @@ def _parse_batch(batch_e: Dict[str, Any])->Batch:
         _parse_job(job_e)
         for job_e in batch_e['jobs']
     ]
-    return Batch(name=batch_e['name'], jobs=jobs)
+    return Batch(name=batch_e['name'], jobs=jobs, depends_on=batch_e.get('depends_on'))
 
 
 def _job_to_dict(job_spec: JobSpec)->Dict[str, Any]:
@@ -51,6 +119,9 @@ def _job_to_dict(job_spec: JobSpec)->Dict[str, Any]:
     if job_spec.num_slots:
         res['params'] = {'num_slots': job_spec.num_slots}
 
+    if job_spec.max_attempts:
+        res.setdefault('params', {})['max_attempts'] = job_spec.max_attempts
+
     if job_spec.work_dir:
         res['work_dir'] = job_spec.work_dir
 
@@ -63,14 +134,23 @@ def _job_to_dict(job_spec: JobSpec)->Dict[str, Any]:
     if job_spec.time_path:
         res['time_path'] = job_spec.time_path
 
+    if job_spec.depends_on:
+        res['depends_on'] = job_spec.depends_on
+
+    if job_spec.inputs:
+        res['inputs'] = job_spec.inputs
+
     return res
 
 
 def _batch_to_dict(batch: Batch)->Dict[str, Any]:
-    return dict(
+    res = dict(
         name=batch.name,
         jobs=[
             _job_to_dict(j)
             for j in batch.jobs
         ]
     )
+    if batch.depends_on is not None:
+        res['depends_on'] = batch.depends_on
+    return res
@@ -1,10 +1,65 @@
 import argparse
-from itertools import groupby
+import re
+from collections import namedtuple
+from itertools import groupby, islice
+from operator import itemgetter
+from multiprocessing import Pool
 from shlex import split, quote
-from typing import List, TextIO
+from typing import List, TextIO, Iterable, Iterator, Optional
 
 from scheduler.job import Batch, JobSpec
 
+# Value options of _init_parser() and their destinations
+_OPTIONS = {
+    '--batch': 'batch',
+    '-b': 'batch',
+    '--name': 'name',
+    '-j': 'name',
+    '--work-dir': 'work_dir',
+    '--time-path': 'time_path',
+    '--status-path': 'status_path',
+    '--log-path': 'log_path',
+    '--threads': 'threads',
+    '-t': 'threads',
+    '--depends-on': 'depends_on',
+    '--max-attempts': 'max_attempts',
+    '--inputs': 'inputs',
+}
+
+
+def _split_references(value: str)->List[str]:
+    return [reference for reference in value.split(',') if reference]
+
+
+_CONVERTERS = {
+    'threads': int,
+    'depends_on': _split_references,
+    'max_attempts': int,
+    'inputs': _split_references,
+}
+_DEFAULTS = dict(
+    batch='default',
+    name=None,
+    work_dir=None,
+    time_path=None,
+    status_path=None,
+    log_path=None,
+    threads=1,
+    depends_on=None,
+    max_attempts=None,
+    inputs=None,
+)
+# Parsed job line, fields are named after _init_parser() destinations. Worker processes
+# return plain tuples in the same order: pickling namedtuples costs about as much as parsing.
+JobArgs = namedtuple('JobArgs', sorted(_DEFAULTS) + ['command', 'arguments'])
+_batch_of = itemgetter(JobArgs._fields.index('batch'))
+
+# Lines without these characters are split by shlex exactly like by str.split()
+_SHLEX_SPECIAL_RE = re.compile(r'[\'"\\]|[^\S \t\r\n]')
+
+# Lines sent to a worker process at once
+PARSE_CHUNK_SIZE = 50000
+
 
 def _init_parser()->argparse.ArgumentParser:
     parser = argparse.ArgumentParser()
@@ -15,6 +70,9 @@ def _init_parser()->argparse.ArgumentParser:
     parser.add_argument('--status-path')
     parser.add_argument('--log-path')
     parser.add_argument('--threads', '-t', default=1, type=int)
+    parser.add_argument('--depends-on', type=_split_references)
+    parser.add_argument('--max-attempts', type=int)
+    parser.add_argument('--inputs', type=_split_references)
     parser.add_argument('command')
     parser.add_argument('arguments', nargs=argparse.REMAINDER)
 
@@ -41,6 +99,15 @@ def _job_to_args(batch: Batch, job_spec: JobSpec)->List[str]:
     if job_spec.time_path:
         job_args.extend(('--time-path', job_spec.time_path))
 
+    if job_spec.depends_on:
+        job_args.extend(('--depends-on', ','.join(job_spec.depends_on)))
+
+    if job_spec.max_attempts:
+        job_args.extend(('--max-attempts', job_spec.max_attempts))
+
+    if job_spec.inputs:
+        job_args.extend(('--inputs', ','.join(job_spec.inputs)))
+
     job_args.append(job_spec.command)
     job_args.extend(job_spec.args)
 
@@ -59,47 +126,134 @@ def _batches_to_args(batches: List[Batch])->List[List[str]]:
     ]
 
 
-def _parse_batch(batch_name: str, job_args_list: List[argparse.Namespace])->Batch:
-    jobs = [
+def _iter_jobs(batch_name: str, job_args_list: Iterable[tuple])->Iterator[JobSpec]:
+    return (
         _parse_job(
             job_args=job_args,
             default_name='{}-{}'.format(batch_name, i+1)
         )
         for i, job_args in enumerate(job_args_list)
-    ]
+    )
+
+
+def _parse_batch(batch_name: str, job_args_list: List[tuple])->Batch:
     return Batch(
         name=batch_name,
-        jobs=jobs
+        jobs=list(_iter_jobs(batch_name, job_args_list))
     )
 
 
-def _parse_job(job_args, default_name: str)->JobSpec:
+def _parse_job(job_args: tuple, default_name: str)->JobSpec:
+    """
+    job_args is a JobArgs or a plain tuple of its fields
+    """
+    (_, depends_on, inputs, log_path, max_attempts, name, status_path, threads, time_path, work_dir,
+     command, arguments) = job_args
     return JobSpec(
-            command=job_args.command,
-            args=job_args.arguments,
-            name=job_args.name or default_name,
-            num_slots=job_args.threads,
-            work_dir=job_args.work_dir,
-            time_path=job_args.time_path,
-            status_path=job_args.status_path,
-            log_path=job_args.log_path,
+            command=command,
+            args=arguments,
+            name=name or default_name,
+            num_slots=threads,
+            work_dir=work_dir,
+            time_path=time_path,
+            status_path=status_path,
+            log_path=log_path,
+            depends_on=depends_on,
+            max_attempts=max_attempts,
+            inputs=inputs,
         )
 
 
-def parse_config(file: TextIO)->List[Batch]:
-    parser = _init_parser()
+def _split_line(line: str)->List[str]:
+    if _SHLEX_SPECIAL_RE.search(line):
+        return split(line)
+    return line.split()
+
+
+def _scan_args(args: List[str])->Optional[JobArgs]:
+    """
+    Fast equivalent of _init_parser().parse_args() for lines using only
+    "--option value" forms. Returns None for everything else (abbreviations,
+    "--option=value", "--", invalid values), those lines are left to argparse.
+    """
+    values = dict(_DEFAULTS)
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if not arg.startswith('-') or arg == '-':
+            values['command'] = arg
+            values['arguments'] = args[i+1:]
+            if '--' in values['arguments']:
+                return None
+            return JobArgs(**values)
 
-    job_args_list = [
-        parser.parse_args(split(l.strip())) for l in file
+        dest = _OPTIONS.get(arg)
+        if dest is None or i + 1 == len(args) or args[i+1].startswith('-'):
+            return None
+        value = args[i+1]
+        if dest in _CONVERTERS:
+            try:
+                value = _CONVERTERS[dest](value)
+            except ValueError:
+                return None
+        values[dest] = value
+        i += 2
+    return None
+
+
+def _parse_line(parser: argparse.ArgumentParser, line: str)->JobArgs:
+    args = _split_line(line.strip())
+    return _scan_args(args) or JobArgs(**vars(parser.parse_args(args)))
+
+
+def _parse_lines(lines: List[str])->List[tuple]:
+    parser = _init_parser()
+    return [
+        tuple(_parse_line(parser, l)) for l in lines
     ]
 
+
+def _chunks(file: TextIO, size: int)->Iterator[List[str]]:
+    while True:
+        chunk = list(islice(file, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _iter_job_args(file: TextIO, processes: int=None)->Iterator[tuple]:
+    if not processes or processes < 2:
+        parser = _init_parser()
+        for l in file:
+            yield _parse_line(parser, l)
+        return
+
+    with Pool(processes) as pool:
+        for job_args_list in pool.imap(_parse_lines, _chunks(file, PARSE_CHUNK_SIZE)):
+            yield from job_args_list
+
+
+def parse_config(file: TextIO, processes: int=None)->List[Batch]:
+    job_args_list = list(_iter_job_args(file, processes))
+
     batches = [
         _parse_batch(batch, group)
-        for batch, group in groupby(job_args_list, lambda ja: ja.batch)
+        for batch, group in groupby(job_args_list, _batch_of)
     ]
     return batches
 
 
+def iter_config(file: TextIO, processes: int=None)->Iterator[Batch]:
+    """
+    Yields batches while reading the file line by line, jobs of every batch
+    are parsed lazily and must be consumed before the next batch is requested
+    """
+    job_args_list = _iter_job_args(file, processes)
+
+    for batch, group in groupby(job_args_list, _batch_of):
+        yield Batch(name=batch, jobs=_iter_jobs(batch, group))
+
+
 def write_config(f: TextIO, batches: List[Batch]):
     for line in _batches_to_args(batches):
         f.write(" ".join(line)+'\n')
\ No newline at end of file
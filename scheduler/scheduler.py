@@ -1,69 +1,229 @@
 import logging
 from os import getcwd, makedirs
-from os.path import join, dirname
+from os.path import dirname, sep
+from sys import intern
 from time import time
-from typing import List
+from typing import List, Iterator, Sized, Callable, Dict, Iterable
 
-import math
+from scheduler.dag import JobGraph, batch_dependencies, _format_seconds
+from scheduler.executor.base import Executor, JobGroup
+from scheduler.fingerprint import Fingerprinter
+from scheduler.history import RuntimeHistory, fill_unknown, predict_makespan
+from scheduler.job import Batch, JobSpec, BatchLayout
 
-import datetime
+logger = logging.getLogger(__name__)
 
-from scheduler.executor.base import Executor
-from scheduler.job import Batch
 
-logger = logging.getLogger(__name__)
+class DirectoryCache:
+    """
+    Creates every distinct directory only once per run
+    """
+    def __init__(self):
+        self._created = set()
+
+    def makedirs(self, path: str):
+        if path in self._created:
+            return
+        makedirs(path, exist_ok=True)
+        self._created.add(path)
 
 
 class Scheduler:
-    def __init__(self, log_dir: str, status_dir: str, time_dir: str):
+    def __init__(self, log_dir: str, status_dir: str, time_dir: str,
+                 order: str='file', history: RuntimeHistory=None, fingerprinter: Fingerprinter=None,
+                 work_dir: str=None):
+        """
+        order is one of history.ORDERS, orders other than 'file' need history.
+        With fingerprinter jobs are fingerprinted before they are queued.
+        Jobs without work dir run in work_dir, by default the current directory.
+        """
         self.time_dir = time_dir
         self.status_dir = status_dir
         self.log_dir = log_dir
-
-    def run_batches(self, executor: Executor, batches: List[Batch]):
-        for batch in batches:
-            start_time = time()
-            try:
-                res = self._run_batch(executor, batch)
-                if not res:
-                    logger.warning("Stopping jobs because of error")
-                    executor.cancel()
+        self._directories = DirectoryCache()
+        self._order = order if history else 'file'
+        self._history = history
+        self._fingerprinter = fingerprinter
+        self._work_dir = work_dir
+        # Predicted seconds of batches being run
+        self._predicted = dict()  # type: Dict[str, float]
+
+    def run_batches(self, executor: Executor, batches: List[Batch],
+                    pipeline: bool=False, default_depends_on: str='previous'):
+        """
+        Batches run one after another, or in pipeline mode as soon as
+        the batches they depend on have succeeded
+        """
+        try:
+            if pipeline:
+                self._run_pipeline(executor, batches, default_depends_on)
+                return
+            for batch in batches:
+                start_time = time()
+                try:
+                    res = self._run_batch(executor, batch)
+                    if not res:
+                        logger.warning("Stopping jobs because of error")
+                        executor.cancel()
+                        break
+                except KeyboardInterrupt:
+                    executor.interrupt()
                     break
-            except KeyboardInterrupt:
+                finally:
+                    self._log_batch_time(batch.name, start_time)
+        finally:
+            # Drains pending result writes even if a batch failed unexpectedly
+            executor.shutdown()
+
+    def _run_pipeline(self, executor: Executor, batches: List[Batch], default_depends_on: str):
+        """
+        Every job is queued as soon as its own dependencies and the batches its batch
+        depends on have succeeded, so it fills slots left free by stragglers
+        """
+        start_time = time()
+        self.start_graph(executor, batches, default_depends_on)
+        try:
+            if not executor.wait_for_jobs():
+                logger.warning("Stopping jobs because of error")
                 executor.cancel()
-                break
-            finally:
-                end_time = time()
-                logger.info('Batch {batch} done in {time}'.format(
-                    batch=batch.name,
-                    time=str(datetime.timedelta(seconds=math.trunc(end_time - start_time))),
-                ))
-        executor.shutdown()
-
-    def _run_batch(self, executor: Executor, batch: Batch):
-        logger.info('Executing batch: {} ({} jobs)'.format(batch.name, len(batch.jobs)))
+        except KeyboardInterrupt:
+            executor.interrupt()
+        logger.info('All batches done in {}'.format(_format_seconds(time() - start_time)))
+
+    def start_graph(self, executor: Executor, batches: List[Batch], default_depends_on: str,
+                    on_job_done: Callable[[JobSpec, bool, bool], None]=None,
+                    on_done: Callable[[JobGraph], None]=None)->JobGraph:
+        """
+        Queues jobs of batches in pipeline mode, they are run by executor.wait_for_jobs(),
+        see JobGraph.start() for the callbacks
+        """
+        dependencies = batch_dependencies(batches, default_depends_on)
+        prepared = []
+        for batch in batches:
+            layout = self._create_layout(batch)
+            executor.preload_done(layout)
+            jobs = self._prepare_jobs(batch, layout, None)
+            if self._fingerprinter:
+                jobs = self._fingerprinter.fingerprint_all(jobs)
+            jobs = list(jobs)
+            prepared.append(Batch(name=batch.name, jobs=jobs, depends_on=batch.depends_on))
+
+        graph = JobGraph(prepared, dependencies)
+        if self._order != 'file':
+            self._prioritize(executor, graph, prepared)
+        graph.start(executor, on_job_done, on_done)
+        return graph
+
+    def _prioritize(self, executor: Executor, graph: JobGraph, batches: List[Batch]):
+        durations = []
+        for batch in batches:
+            durations.extend(self._history.predict(batch.jobs[0].layout, batch.jobs) if batch.jobs else [])
+        durations = fill_unknown(durations)
+        critical_path = graph.prioritize(durations, critical_path=self._order == 'critical-path')
+        finish = graph.simulate(durations, executor.max_jobs, executor.max_slots)
+        logger.info('Predicted run time {makespan}, critical path {critical_path}'.format(
+            makespan=_format_seconds(max(finish, default=0.0)),
+            critical_path=_format_seconds(critical_path),
+        ))
+
+    def _log_batch_time(self, batch_name: str, start_time: float):
+        predicted = self._predicted.pop(batch_name, None)
+        logger.info('Batch {batch} done in {time}{predicted}'.format(
+            batch=batch_name,
+            time=_format_seconds(time() - start_time),
+            predicted='' if predicted is None else ' (predicted {})'.format(_format_seconds(predicted)),
+        ))
+
+    def _create_layout(self, batch: Batch)->BatchLayout:
+        layout = BatchLayout(
+            batch_name=batch.name,
+            status_dir=self.status_dir,
+            log_dir=self.log_dir,
+            time_dir=self.time_dir,
+        )
+        for path in (layout.status_dir, layout.log_dir, layout.time_dir):
+            self._directories.makedirs(path)
+        return layout
+
+    def _prepare_jobs(self, batch: Batch, layout: BatchLayout, start_time: float)->Iterator[JobSpec]:
+        work_dir = intern(self._work_dir or getcwd())
 
         for i, job in enumerate(batch.jobs):
             if not job.name:
                 job.name = '{}.{}.txt'.format(batch.name, i)
-            if not job.status_path:
-                job.status_path = join(self.status_dir, batch.name, job.name)
-
-            if not job.log_path:
-                job.log_path = join(self.log_dir, batch.name, job.name)
-
-            if not job.time_path:
-                job.time_path = join(self.time_dir, batch.name, job.name+'.time')
+            # status, log and time paths not set in config are derived from the layout
+            job.layout = layout
 
             if not job.work_dir:
-                job.work_dir = getcwd()
-
-            makedirs(dirname(job.status_path), exist_ok=True)
-            makedirs(dirname(job.log_path), exist_ok=True)
-            makedirs(dirname(job.time_path), exist_ok=True)
-
-            executor.queue(job)
-        res = executor.wait_for_jobs()
-        return res
-
+                job.work_dir = work_dir
+
+            # Only paths set explicitly in config or derived from a name with
+            # subdirectories may lie outside of layout directories
+            if sep in job.name:
+                paths = (job.status_path, job.log_path, job.time_path)
+            else:
+                paths = job.explicit_paths()
+            for path in paths:
+                self._directories.makedirs(dirname(path))
+
+            if start_time is not None:
+                logger.info('Batch {batch} setup took {time:.3f}s before its first job was prepared'.format(
+                    batch=batch.name,
+                    time=time() - start_time,
+                ))
+                start_time = None
+            yield job
+
+    def _start_batch(self, executor: Executor, batch: Batch,
+                     on_done: Callable[[JobGroup], None], start_time: float)->BatchLayout:
+        if isinstance(batch.jobs, Sized):
+            logger.info('Executing batch: {} ({} jobs)'.format(batch.name, len(batch.jobs)))
+        else:
+            logger.info('Executing batch: {} (streamed)'.format(batch.name))
+
+        layout = self._create_layout(batch)
+        executor.preload_done(layout)
+
+        # Jobs are prepared only when the executor is ready to submit them
+        jobs = self._prepare_jobs(batch, layout, start_time)
+        if self._fingerprinter:
+            jobs = self._fingerprinter.fingerprint_all(jobs)
+        if self._order != 'file':
+            jobs = self._longest_first(executor, batch, layout, list(jobs))
+        executor.queue_all(jobs, on_done)
+        return layout
+
+    def _longest_first(self, executor: Executor, batch: Batch, layout: BatchLayout,
+                       jobs: List[JobSpec])->Iterable[JobSpec]:
+        """
+        Without dependencies between jobs of a batch the critical path order is longest first
+        """
+        predictions = self._history.predict(layout, jobs)
+        if all(p is None for p in predictions):
+            return jobs
+        durations = fill_unknown(predictions)
+        order = sorted(range(len(jobs)), key=lambda i: -durations[i])
+        jobs = [jobs[i] for i in order]
+        self._predicted[batch.name] = predict_makespan(
+            jobs, [durations[i] for i in order], executor.max_jobs, executor.max_slots
+        )
+        logger.info('Batch {batch}: predicted run time {time}'.format(
+            batch=batch.name,
+            time=_format_seconds(self._predicted[batch.name]),
+        ))
+        return jobs
+
+    @staticmethod
+    def _log_skipped(batch: Batch, group: JobGroup):
+        if group.skipped:
+            logger.info('Batch {batch}: skipped {n} already done jobs'.format(
+                batch=batch.name,
+                n=group.skipped,
+            ))
 
+    def _run_batch(self, executor: Executor, batch: Batch):
+        layout = self._start_batch(executor, batch, lambda group: self._log_skipped(batch, group), time())
+        try:
+            return executor.wait_for_jobs()
+        finally:
+            executor.finish_batch(layout)
@@ -0,0 +1,430 @@
+import json
+import logging
+import sqlite3
+import time
+from abc import ABCMeta, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+import os
+from os import makedirs, scandir, fsync, O_RDONLY
+from os.path import dirname, realpath, join, sep
+from threading import Lock
+from typing import Optional, Dict, List, Tuple, Any
+
+from scheduler.executor.util import read_status, write_status, write_time, write_usage, usage_path, usage_record, \
+    read_fingerprint, parse_fingerprint, FINGERPRINT_PREFIX
+from scheduler.job import Job, JobSpec, BatchLayout, Attempt
+
+logger = logging.getLogger(__name__)
+
+STATUS_OK = 'ok'
+STATUS_ERROR = 'error'
+# Journal records of failed attempts which were retried
+STATUS_RETRY = 'retry'
+
+# Filesystems where every file access is a round-trip to a server
+NETWORK_FILESYSTEMS = {
+    'nfs', 'nfs4', 'lustre', 'gpfs', 'cifs', 'smb3', 'smbfs',
+    'beegfs', 'ceph', 'glusterfs', 'fuse.glusterfs', 'fuse.sshfs',
+}
+
+
+def _filesystem_type(path: str)->Optional[str]:
+    """
+    Type of the filesystem holding path according to /proc/mounts, None if unknown
+    """
+    path = realpath(path)
+    fs_type = None
+    mount_point_len = -1
+    try:
+        with open('/proc/mounts') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount_point = fields[1]
+                if (path == mount_point or path.startswith(mount_point.rstrip('/') + '/')) \
+                        and len(mount_point) > mount_point_len:
+                    fs_type = fields[2]
+                    mount_point_len = len(mount_point)
+    except OSError:
+        return None
+    return fs_type
+
+
+def _read_file(path: str)->str:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return ''
+
+
+def _batch_name(job_spec: JobSpec)->str:
+    return job_spec.layout.batch_name if job_spec.layout else ''
+
+
+class ResultStore(metaclass=ABCMeta):
+    """
+    Where results of finished jobs are kept
+    """
+    @abstractmethod
+    def read_status(self, job_spec: JobSpec)->str:
+        pass
+
+    @abstractmethod
+    def read_fingerprint(self, job_spec: JobSpec)->Optional[str]:
+        """
+        Fingerprint the job had when its status was written, None if it had none
+        """
+        pass
+
+    @abstractmethod
+    def write_result(self, job: Job, status: str, exit_status: Optional[int]):
+        pass
+
+    def write_attempt(self, job: Job, attempt: Attempt):
+        """
+        Records a failed attempt which is going to be retried, stores keeping
+        attempt history with the final result (in job.attempts) need not
+        """
+        pass
+
+    @abstractmethod
+    def done_jobs(self, layout: BatchLayout)->Dict[str, Optional[str]]:
+        """
+        Names of successfully finished jobs of the batch with the fingerprints they
+        finished with, only for jobs which status path is derived from the layout
+        """
+        pass
+
+    @abstractmethod
+    def runtimes(self, layout: BatchLayout)->Dict[str, float]:
+        """
+        Seconds taken by the last successful run of jobs of the batch,
+        only for jobs which time path is derived from the layout
+        """
+        pass
+
+    def write_batch_usage(self, layout: BatchLayout, summary: Dict[str, Any]):
+        """
+        Records the resource usage summary of a finished batch
+        """
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class FileStore(ResultStore):
+    """
+    One status file, one time file and one resource usage record per job,
+    usage summary of a batch next to the batch's time directory
+    """
+    # Status files on network filesystems are read in this many threads
+    PRELOAD_THREADS = 16
+
+    def __init__(self, fsync: bool=False):
+        """
+        With fsync files written since the last flush() are fsynced by it
+        """
+        self._fsync = fsync
+        self._unsynced_paths = []
+
+    @staticmethod
+    def _list_files(directory: str, prefix: str='')->List[Tuple[str, str]]:
+        """
+        Names relative to the top directory and paths of all files in directory and its
+        subdirectories, which hold jobs with a path separator in their name
+        """
+        entries = []
+        try:
+            with scandir(directory) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        entries.extend(FileStore._list_files(entry.path, prefix + entry.name + sep))
+                    elif entry.is_file():
+                        entries.append((prefix + entry.name, entry.path))
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def _read_dir(self, directory: str, suffix: str='')->List[Tuple[str, str]]:
+        """
+        Names (relative to directory) and contents of files in directory ending with suffix
+        """
+        entries = [(name, path) for name, path in self._list_files(directory) if name.endswith(suffix)]
+        if not entries:
+            return []
+
+        paths = [path for _, path in entries]
+        fs_type = _filesystem_type(directory)
+        if fs_type in NETWORK_FILESYSTEMS and len(paths) > 1:
+            logger.debug('Reading {} files on {} in {} threads'.format(
+                len(paths), fs_type, self.PRELOAD_THREADS
+            ))
+            with ThreadPoolExecutor(self.PRELOAD_THREADS) as pool:
+                contents = list(pool.map(_read_file, paths))
+        else:
+            contents = [_read_file(path) for path in paths]
+        return [(name, content) for (name, _), content in zip(entries, contents)]
+
+    def done_jobs(self, layout: BatchLayout)->Dict[str, Optional[str]]:
+        # Status is the first line, fingerprint and attempt history may follow
+        return {
+            name: parse_fingerprint(content)
+            for name, content in self._read_dir(layout.status_dir)
+            if content.partition('\n')[0] == STATUS_OK
+        }
+
+    def runtimes(self, layout: BatchLayout)->Dict[str, float]:
+        runtimes = dict()
+        # Usage records are kept next to time files
+        for name, content in self._read_dir(layout.time_dir, '.time'):
+            try:
+                runtimes[name[:-len('.time')]] = float(content)
+            except ValueError:
+                pass
+        return runtimes
+
+    def read_status(self, job_spec: JobSpec)->str:
+        return read_status(job_spec)
+
+    def read_fingerprint(self, job_spec: JobSpec)->Optional[str]:
+        return read_fingerprint(job_spec)
+
+    def write_result(self, job: Job, status: str, exit_status: Optional[int]):
+        write_status(job, status)
+        if status == STATUS_OK:
+            write_time(job)
+        write_usage(job, status, exit_status)
+        if self._fsync:
+            self._unsynced_paths.append(job.spec.status_path)
+            self._unsynced_paths.append(usage_path(job.spec.time_path))
+            if status == STATUS_OK:
+                self._unsynced_paths.append(job.spec.time_path)
+
+    def write_batch_usage(self, layout: BatchLayout, summary: Dict[str, Any]):
+        with open(layout.time_dir + '.usage.json', 'w') as f:
+            json.dump(summary, f, indent=2)
+            f.write('\n')
+
+    def flush(self):
+        paths, self._unsynced_paths = self._unsynced_paths, []
+        for path in paths:
+            try:
+                fd = os.open(path, O_RDONLY)
+                try:
+                    fsync(fd)
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                logger.warning('Unable to fsync {}: {}'.format(path, e))
+
+
+class JournalStore(ResultStore):
+    """
+    Append-only SQLite journal (WAL mode) of job results, the latest record of a job wins.
+    A job is known by its batch, name and status path, so batches of the same name run
+    with different status directories (e.g. by clients of one daemon) are kept apart.
+    SQLite needs working file locks, so the journal should be kept on a local disk.
+    """
+    # Buffered records are written in one transaction when there are
+    # FLUSH_SIZE of them or FLUSH_INTERVAL seconds have passed
+    FLUSH_SIZE = 500
+    FLUSH_INTERVAL = 1
+
+    def __init__(self, path: str):
+        if dirname(path):
+            makedirs(dirname(path), exist_ok=True)
+        self._lock = Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        with self._connection:
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS results (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    batch TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    exit_status INTEGER,
+                    job_id TEXT,
+                    start_time REAL,
+                    end_time REAL,
+                    status_path TEXT,
+                    time_path TEXT,
+                    run_time REAL,
+                    usage TEXT,
+                    fingerprint TEXT
+                )
+            ''')
+            # Journals created before resource accounting and fingerprints
+            columns = {row[1] for row in self._connection.execute('PRAGMA table_info(results)')}
+            for column, column_type in (('run_time', 'REAL'), ('usage', 'TEXT'), ('fingerprint', 'TEXT')):
+                if column not in columns:
+                    self._connection.execute('ALTER TABLE results ADD COLUMN {} {}'.format(column, column_type))
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS results_job ON results (batch, name, id)'
+            )
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS batch_usage (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    batch TEXT NOT NULL,
+                    time REAL NOT NULL,
+                    summary TEXT NOT NULL
+                )
+            ''')
+        self._buffer = []
+        self._flushed_at = time.time()
+
+    def read_status(self, job_spec: JobSpec)->str:
+        with self._lock:
+            self._flush()
+            row = self._connection.execute(
+                'SELECT status FROM results WHERE batch = ? AND name = ? AND status_path = ? '
+                'ORDER BY id DESC LIMIT 1',
+                (_batch_name(job_spec), job_spec.name, job_spec.status_path)
+            ).fetchone()
+        return row[0] if row else ''
+
+    def read_fingerprint(self, job_spec: JobSpec)->Optional[str]:
+        with self._lock:
+            self._flush()
+            row = self._connection.execute(
+                'SELECT fingerprint FROM results WHERE batch = ? AND name = ? AND status_path = ? '
+                'ORDER BY id DESC LIMIT 1',
+                (_batch_name(job_spec), job_spec.name, job_spec.status_path)
+            ).fetchone()
+        return row[0] if row else None
+
+    def done_jobs(self, layout: BatchLayout)->Dict[str, Optional[str]]:
+        with self._lock:
+            self._flush()
+            rows = self._connection.execute('''
+                SELECT name, fingerprint FROM results
+                WHERE id IN (
+                    SELECT MAX(id) FROM results WHERE batch = ? AND status_path = ? || name GROUP BY name
+                ) AND status = ?
+            ''', (layout.batch_name, join(layout.status_dir, ''), STATUS_OK)).fetchall()
+        return dict(rows)
+
+    def runtimes(self, layout: BatchLayout)->Dict[str, float]:
+        with self._lock:
+            self._flush()
+            rows = self._connection.execute('''
+                SELECT name, COALESCE(run_time, end_time - start_time) FROM results
+                WHERE id IN (
+                    SELECT MAX(id) FROM results
+                    WHERE batch = ? AND time_path = ? || name || '.time' AND status = ? GROUP BY name
+                )
+            ''', (layout.batch_name, join(layout.time_dir, ''), STATUS_OK)).fetchall()
+        return dict(rows)
+
+    def write_attempt(self, job: Job, attempt: Attempt):
+        self._append((
+            _batch_name(job.spec),
+            job.spec.name,
+            STATUS_RETRY,
+            attempt.exit_status,
+            str(attempt.job_id),
+            attempt.start_time,
+            attempt.end_time,
+            job.spec.status_path,
+            job.spec.time_path,
+            None,
+            None,
+            job.spec.fingerprint,
+        ))
+
+    def write_result(self, job: Job, status: str, exit_status: Optional[int]):
+        self._append((
+            _batch_name(job.spec),
+            job.spec.name,
+            status,
+            exit_status,
+            str(job.job_id),
+            job.start_time,
+            job.end_time,
+            job.spec.status_path,
+            job.spec.time_path,
+            job.run_time,
+            json.dumps(usage_record(job, status, exit_status)),
+            job.spec.fingerprint,
+        ))
+
+    def write_batch_usage(self, layout: BatchLayout, summary: Dict[str, Any]):
+        with self._lock:
+            with self._connection:
+                self._connection.execute(
+                    'INSERT INTO batch_usage (batch, time, summary) VALUES (?, ?, ?)',
+                    (layout.batch_name, time.time(), json.dumps(summary))
+                )
+
+    def _append(self, row: tuple):
+        with self._lock:
+            self._buffer.append(row)
+            if len(self._buffer) >= self.FLUSH_SIZE or time.time() - self._flushed_at >= self.FLUSH_INTERVAL:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        rows, self._buffer = self._buffer, []
+        self._flushed_at = time.time()
+        if not rows:
+            return
+        with self._connection:
+            self._connection.executemany(
+                'INSERT INTO results '
+                '(batch, name, status, exit_status, job_id, start_time, end_time, status_path, time_path, '
+                'run_time, usage, fingerprint) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                rows
+            )
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._connection.close()
+
+    def export(self)->int:
+        """
+        Writes the latest result of every job to the legacy status and time files
+        and its resource usage record
+        """
+        self.flush()
+        with self._lock:
+            rows = self._connection.execute('''
+                SELECT status, start_time, end_time, status_path, time_path, run_time, usage, fingerprint
+                FROM results
+                WHERE id IN (SELECT MAX(id) FROM results GROUP BY batch, name, status_path)
+            ''').fetchall()
+
+        created_dirs = set()
+        for status, start_time, end_time, status_path, time_path, run_time, usage, fingerprint in rows:
+            paths = [status_path]
+            if status == STATUS_OK:
+                paths.append(time_path)
+            for path in paths:
+                directory = dirname(path)
+                if directory and directory not in created_dirs:
+                    makedirs(directory, exist_ok=True)
+                    created_dirs.add(directory)
+
+            with open(status_path, 'w') as f:
+                f.write(status)
+                if fingerprint:
+                    f.write('\n' + FINGERPRINT_PREFIX + fingerprint)
+            if status == STATUS_OK:
+                with open(time_path, 'w') as f:
+                    f.write('{}\n'.format(end_time - start_time if run_time is None else run_time))
+            if usage is not None:
+                with open(usage_path(time_path), 'w') as f:
+                    f.write(usage + '\n')
+        logger.info('Exported {} job results'.format(len(rows)))
+        return len(rows)
@@ -13,5 +13,8 @@ setup(
         'console_scripts': [
             'scheduler = scheduler.cli:main'
         ]
-    }, install_requires=['drmaa', 'PyYAML', 'ujson']
+    }, install_requires=['drmaa', 'PyYAML', 'ujson'],
+    extras_require={
+        'stream': ['ijson'],
+    }
 )
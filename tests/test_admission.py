@@ -0,0 +1,58 @@
+from collections import deque
+from unittest import mock
+
+import pytest
+
+from scheduler.executor import admission
+from scheduler.executor.admission import create_policy
+from scheduler.job import JobSpec
+
+
+def _queue(*slots):
+    return deque(JobSpec(command='true', name='job{}'.format(i), num_slots=n) for i, n in enumerate(slots))
+
+
+def _names(job_specs):
+    return [job_spec.name for job_spec in job_specs]
+
+
+def test_fifo_head_blocks_the_rest():
+    queued = _queue(2, 8, 1)
+    assert _names(create_policy('fifo', 8).select(queued, 10, 4)) == ['job0']
+    assert _names(queued) == ['job1', 'job2']
+
+
+def test_first_fit_takes_fitting_jobs_in_queue_order():
+    queued = _queue(2, 8, 1, 1)
+    assert _names(create_policy('first-fit', 8).select(queued, 10, 4)) == ['job0', 'job2', 'job3']
+    assert _names(queued) == ['job1']
+
+
+def test_largest_first_prefers_large_jobs():
+    queued = _queue(1, 1, 1, 3)
+    assert _names(create_policy('largest-first', 8).select(queued, 10, 4)) == ['job0', 'job3']
+    assert _names(queued) == ['job1', 'job2']
+
+
+def test_max_count_limits_selection():
+    queued = _queue(1, 1, 1)
+    assert _names(create_policy('first-fit', 8).select(queued, 2, 8)) == ['job0', 'job1']
+
+
+@pytest.mark.parametrize('name', sorted(admission.POLICIES))
+def test_job_larger_than_budget_runs_alone(name):
+    policy = create_policy(name, 8)
+    assert policy.select(_queue(16), 10, 4) == []
+    assert _names(policy.select(_queue(16), 10, 8)) == ['job0']
+
+
+def test_backfill_stops_after_reservation_delay():
+    clock = mock.Mock()
+    clock.time.return_value = 0.0
+    policy = create_policy('backfill', 8)
+    queued = _queue(8, 1, 1)
+    with mock.patch.object(admission, 'time', clock):
+        assert _names(policy.select(queued, 10, 1)) == ['job1']
+        clock.time.return_value = policy.RESERVATION_DELAY
+        assert policy.select(queued, 10, 3) == []
+    assert _names(queued) == ['job0', 'job2']
@@ -0,0 +1,27 @@
+from os.path import join
+
+from scheduler.executor.base import Executor
+from scheduler.job import BatchLayout, Job, JobSpec
+
+
+def test_job_model_has_no_instance_dicts():
+    spec = JobSpec(command='true', name='a')
+    for obj in (spec, Job(spec=spec), Executor.JobStatus(has_exited=False, exit_status=None, job=Job(spec=spec))):
+        assert not hasattr(obj, '__dict__'), type(obj)
+
+
+def test_paths_are_derived_from_layout_unless_set():
+    layout = BatchLayout('b', 'status', 'log', 'time')
+    spec = JobSpec(command='true', name='a', layout=layout, log_path='own.log')
+    assert spec.status_path == join('status', 'b', 'a')
+    assert spec.time_path == join('time', 'b', 'a.time')
+    assert spec.log_path == 'own.log'
+    assert spec.has_layout_status_path
+    assert spec.explicit_paths() == ['own.log']
+
+
+def test_shared_strings_are_interned():
+    first = JobSpec(command=''.join(['/bin/', 'true']), name='a', work_dir=''.join(['/', 'w']))
+    second = JobSpec(command=''.join(['/bin/', 'true']), name='b', work_dir=''.join(['/', 'w']))
+    assert first.command is second.command
+    assert first.work_dir is second.work_dir
@@ -0,0 +1,67 @@
+import json
+
+import pytest
+
+from scheduler.executor.async_local import AsyncLocalExecutor
+from scheduler.executor.local import LocalExecutor, ExecutorThread
+from scheduler.executor.util import usage_path
+from scheduler.job import Batch, JobSpec
+from scheduler.scheduler import Scheduler
+
+
+@pytest.fixture(params=[LocalExecutor, AsyncLocalExecutor], ids=['local', 'async-local'])
+def executor_class(request):
+    return request.param
+
+
+def _run(tmp_path, executor_class, jobs):
+    scheduler = Scheduler(log_dir=str(tmp_path / 'log'), status_dir=str(tmp_path / 'status'),
+                          time_dir=str(tmp_path / 'time'), work_dir=str(tmp_path))
+    batch = Batch(name='b', jobs=jobs)
+    scheduler.run_batches(executor_class(num_cores=4), [batch])
+    results = {}
+    for job in batch.jobs:
+        with open(job.status_path) as f:
+            status = f.readline().strip()
+        with open(usage_path(job.time_path)) as f:
+            results[job.name] = status, json.load(f)
+    return results
+
+
+def test_jobs_run_with_their_usage(tmp_path, executor_class):
+    results = _run(tmp_path, executor_class, [
+        JobSpec(command='sh', args=['-c', 'echo $0 > out', 'hello'], name='echo'),
+        JobSpec(command='sh', args=['-c', 'exit 3'], name='fail'),
+    ] + [JobSpec(command='true', name='true{}'.format(i)) for i in range(20)])
+
+    assert (tmp_path / 'out').read_text() == 'hello\n'
+    status, usage = results['echo']
+    assert status == 'ok'
+    assert usage['cpu_time'] is not None
+    # Resident set of a forked child includes the scheduler's before exec
+    assert usage['max_rss'] is None
+    status, usage = results['fail']
+    assert (status, usage['exit_status']) == ('error', 3)
+    assert all(results['true{}'.format(i)][0] == 'ok' for i in range(20))
+
+
+def test_job_which_can_not_start_fails(tmp_path, executor_class):
+    results = _run(tmp_path, executor_class, [
+        JobSpec(command=str(tmp_path / 'missing'), name='missing'),
+        JobSpec(command='true', name='after'),
+    ])
+    status, usage = results['missing']
+    assert (status, usage['exit_status']) == ('error', 1)
+    assert results['after'][0] == 'ok'
+
+
+def test_forgotten_jobs_are_pruned():
+    # The thread is not started, jobs stay queued
+    executor_thread = ExecutorThread()
+    spec = JobSpec(command='true', name='job')
+    jobs = [executor_thread.queue_job(spec) for _ in range(3)]
+    assert [job.job_id for job in jobs] == [1, 2, 3]
+    executor_thread.forget_job(jobs[1])
+    assert executor_thread.job_status(jobs[1]) is None
+    assert executor_thread.job_status(jobs[2]).job is jobs[2]
+    assert executor_thread.queue_job(spec).job_id == 4
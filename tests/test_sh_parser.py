@@ -0,0 +1,112 @@
+import io
+import random
+import shlex
+from contextlib import redirect_stderr
+
+from scheduler.job import Batch, JobSpec
+from scheduler.parser.sh import JobArgs, _init_parser, _scan_args, _split_line, parse_config, write_config
+
+# Options, values and words job lines are built of, including forms left to argparse
+_FRAGMENTS = [
+    '-b', '--batch', '-j', '--name', '--work-dir', '--time-path', '--status-path', '--log-path',
+    '-t', '--threads', '--depends-on', '--max-attempts', '--inputs',
+    '--bat', '--threads=4', '-t4', '-jname', '--', '-', '-x', '--unknown',
+    'a', 'b1', 'batch/x', '4', '0', '-1', 'x1', 'a,b', ',a,,b,', '',
+    'echo', 'sleep', "'quoted arg'", '"double quoted"', 'back\\ slash', 'tab\there', 'é',
+]
+
+
+def _argparse(args):
+    """
+    JobArgs argparse makes of args, None if it rejects them
+    """
+    parser = _init_parser()
+    try:
+        with redirect_stderr(io.StringIO()):
+            return JobArgs(**vars(parser.parse_args(args)))
+    except SystemExit:
+        return None
+
+
+def _random_line(rng: random.Random)->str:
+    return ' '.join(rng.choice(_FRAGMENTS) for _ in range(rng.randint(1, 8)))
+
+
+def _config_text(batches):
+    f = io.StringIO()
+    write_config(f, batches)
+    return f.getvalue()
+
+
+def test_split_line_matches_shlex():
+    rng = random.Random(1)
+    for _ in range(20000):
+        line = _random_line(rng)
+        try:
+            expected = shlex.split(line)
+        except ValueError:
+            expected = ValueError
+        try:
+            actual = _split_line(line)
+        except ValueError:
+            actual = ValueError
+        assert actual == expected, line
+
+
+def test_scan_args_matches_argparse():
+    rng = random.Random(2)
+    scanned = 0
+    for _ in range(20000):
+        try:
+            args = shlex.split(_random_line(rng))
+        except ValueError:
+            continue
+        job_args = _scan_args(args)
+        if job_args is None:
+            continue
+        scanned += 1
+        assert job_args == _argparse(args), args
+    # Fuzzing must reach the scanner, not only its fallbacks
+    assert scanned > 1000
+
+
+def test_scan_args_leaves_other_forms_to_argparse():
+    for args in (
+        ['--bat', 'a', 'echo'],
+        ['--threads=4', 'echo'],
+        ['-t4', 'echo'],
+        ['-j', '-x', 'echo'],
+        ['-t', 'x1', 'echo'],
+        ['-b', 'a', 'echo', '--', 'x'],
+        ['-b', 'a'],
+    ):
+        assert _scan_args(args) is None, args
+
+
+def test_parse_config_in_processes():
+    rng = random.Random(3)
+    lines = []
+    while len(lines) < 500:
+        line = _random_line(rng)
+        try:
+            args = shlex.split(line)
+        except ValueError:
+            continue
+        if _argparse(args) is not None:
+            lines.append(line + '\n')
+    serial = parse_config(io.StringIO(''.join(lines)))
+    parallel = parse_config(io.StringIO(''.join(lines)), processes=2)
+    assert _config_text(parallel) == _config_text(serial)
+
+
+def test_write_config_round_trip():
+    batches = [
+        Batch(name='a', jobs=[
+            JobSpec(command='echo', name='a1', args=['x y', "it's"], num_slots=2, depends_on=['b/b1'],
+                    max_attempts=3, inputs=['in.txt']),
+            JobSpec(command='sleep', name='a2', args=['1'], work_dir='/tmp', log_path='a2.log', num_slots=1),
+        ]),
+        Batch(name='b', jobs=[JobSpec(command='true', name='b1', num_slots=1)]),
+    ]
+    text = _config_text(batches)
+    assert _config_text(parse_config(io.StringIO(text))) == text
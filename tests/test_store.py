@@ -0,0 +1,45 @@
+import os
+
+import scheduler.store
+from scheduler.job import BatchLayout, Job, JobSpec
+from scheduler.store import FileStore, JournalStore, STATUS_OK, STATUS_ERROR
+
+
+def _write(store, layout, name, status, run_time=1.0):
+    job = Job(spec=JobSpec(command='true', name=name, layout=layout), start_time=0.0, end_time=run_time)
+    for path in (job.spec.status_path, job.spec.time_path):
+        # Scheduler creates directories of jobs with a separator in their name
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    store.write_result(job, status, 0 if status == STATUS_OK else 1)
+
+
+def test_file_store_preloads_jobs_in_subdirectories(tmp_path):
+    store = FileStore()
+    layout = BatchLayout('b', str(tmp_path / 'status'), str(tmp_path / 'log'), str(tmp_path / 'time'))
+    _write(store, layout, 'plain', STATUS_OK)
+    _write(store, layout, 's1/step1', STATUS_OK, 2.0)
+    _write(store, layout, 's1/step2', STATUS_ERROR)
+    assert store.done_jobs(layout) == {'plain': None, 's1/step1': None}
+    assert store.runtimes(layout) == {'plain': 1.0, 's1/step1': 2.0}
+
+
+def test_journal_keeps_batches_of_different_status_dirs_apart(tmp_path):
+    store = JournalStore(str(tmp_path / 'journal.db'))
+    first = BatchLayout('b', str(tmp_path / 'c1/status'), str(tmp_path / 'c1/log'), str(tmp_path / 'c1/time'))
+    second = BatchLayout('b', str(tmp_path / 'c2/status'), str(tmp_path / 'c2/log'), str(tmp_path / 'c2/time'))
+    _write(store, first, 'a', STATUS_OK)
+    _write(store, second, 'a', STATUS_ERROR)
+    assert store.done_jobs(first) == {'a': None}
+    assert store.done_jobs(second) == {}
+    assert store.read_status(JobSpec(command='true', name='a', layout=second)) == STATUS_ERROR
+    store.close()
+
+
+def test_file_store_reads_only_time_files_for_runtimes(tmp_path, monkeypatch):
+    store = FileStore()
+    layout = BatchLayout('b', str(tmp_path / 'status'), str(tmp_path / 'log'), str(tmp_path / 'time'))
+    _write(store, layout, 'a', STATUS_OK)
+    read = []
+    monkeypatch.setattr(scheduler.store, '_read_file', lambda path: read.append(path) or '1.0')
+    assert store.runtimes(layout) == {'a': 1.0}
+    assert read == [layout.time_dir + '/a.time']